@@ -0,0 +1,205 @@
+"""
+Run the bridge against simulated gateways and an in-process MQTT broker, and report poll cycle latency,
+publish rate, CPU time and memory.
+
+Run from the repository root: python benchmarks/load.py --units 40 --gateways 4 --runtime asyncio
+With --rtu the units are on one simulated RTU bus behind a pseudo terminal instead, Linux only.
+
+The simulators and the broker run in the same process on their own event loop thread, so the CPU time includes
+their share as well.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import paho.mqtt.client as mqtt  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from config import Config, ModbusConfig, MQTTConfig, SerialConfig, UnitConfig  # noqa: E402
+from models.poll_cycle_event import PollCycleEvent  # noqa: E402
+from server import Server  # noqa: E402
+from simulator import MqttBroker, Pdrycb500Simulator, RtuBusSimulator  # noqa: E402
+
+COMMANDS = [
+    ("command/temperature", lambda: f"{random.randint(36, 56) / 2:.1f}"),
+    ("command/fan-mode", lambda: random.choice(("low", "medium", "high", "auto"))),
+    ("command/mode", lambda: random.choice(("cool", "heat", "dry", "auto"))),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load benchmark against simulated PDRYCB500 gateways")
+    parser.add_argument("--runtime", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--units", type=int, default=10)
+    parser.add_argument("--gateways", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--poll-interval", type=float, default=1)
+    parser.add_argument("--spread-polls", action="store_true")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds the simulator adds to every request")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--command-rate", type=float, default=1, help="MQTT commands per second over all units")
+    parser.add_argument("--topic-prefix", help="put the unit topics under this prefix, with a wildcard subscription")
+    parser.add_argument("--json-state", action="store_true", help="publish the state of a unit as one JSON message")
+    parser.add_argument("--pipeline-window", type=int, default=1,
+                        help="requests in flight per gateway connection at most, needs --runtime asyncio")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="let the simulated gateways process requests in parallel, answering out of order")
+    parser.add_argument("--rtu", action="store_true", help="poll the units over one simulated RTU bus")
+    parser.add_argument("--baudrate", type=int, default=9600, help="baud rate of the RTU bus")
+    args = parser.parse_args()
+    if args.rtu:
+        args.gateways = 1
+    return args
+
+
+class Simulation:
+    """
+    The broker and the gateways, served from an event loop on a background thread.
+    """
+
+    def __init__(self, args):
+        self.broker = MqttBroker()
+        if args.rtu:
+            self.gateways = [RtuBusSimulator(slaves=range(1, args.units + 1), baudrate=args.baudrate,
+                                             latency=args.latency, error_rate=args.error_rate)]
+        else:
+            self.gateways = [Pdrycb500Simulator(slaves=range(1, len(range(gateway, args.units, args.gateways)) + 1),
+                                                latency=args.latency, error_rate=args.error_rate,
+                                                concurrent=args.concurrent)
+                             for gateway in range(args.gateways)]
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self._run(self.broker.start())
+        for gateway in self.gateways:
+            self._run(gateway.start())
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def stop(self) -> None:
+        for gateway in self.gateways:
+            self._run(gateway.stop())
+        self._run(self.broker.stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def build_config(args, simulation: Simulation) -> Config:
+    if args.rtu:
+        bus = simulation.gateways[0]
+        modbus = ModbusConfig(transport="rtu", serial=SerialConfig(port=bus.port, baudrate=args.baudrate),
+                              poll_interval=args.poll_interval, spread_polls=args.spread_polls)
+        units = [UnitConfig(name=f"AC {index}", id=f"ac-{index}", model="PDRYCB500", slave=index + 1)
+                 for index in range(args.units)]
+    else:
+        modbus = ModbusConfig(host="127.0.0.1", port=simulation.gateways[0].port, poll_interval=args.poll_interval,
+                              spread_polls=args.spread_polls, pipeline_window=args.pipeline_window)
+        units = _tcp_units(args, simulation)
+    return Config(
+        runtime=args.runtime,
+        modbus=modbus,
+        mqtt=MQTTConfig(host="127.0.0.1", port=simulation.broker.port, keepalive=60, username="", password="",
+                        topic_prefix=args.topic_prefix, json_state=args.json_state),
+        units=units
+    )
+
+
+def _tcp_units(args, simulation: Simulation) -> List[UnitConfig]:
+    units = []
+    for index in range(args.units):
+        gateway = simulation.gateways[index % args.gateways]
+        units.append(UnitConfig(name=f"AC {index}", id=f"ac-{index}", model="PDRYCB500",
+                                slave=index // args.gateways + 1, host=gateway.host, port=gateway.port))
+    return units
+
+
+def send_commands(args, port: int, stop: threading.Event) -> None:
+    if args.command_rate <= 0:
+        return
+    client = mqtt.Client()
+    client.connect("127.0.0.1", port)
+    client.loop_start()
+    prefix = f"{args.topic_prefix}/" if args.topic_prefix else ""
+    while not stop.wait(1 / args.command_rate):
+        topic, payload = random.choice(COMMANDS)
+        client.publish(f"{prefix}ac-{random.randrange(args.units)}/{topic}", payload())
+    client.loop_stop()
+    client.disconnect()
+
+
+def percentile(values: List[float], share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> None:
+    args = parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    simulation = Simulation(args)
+    server = Server(build_config(args, simulation))
+    cycles: List[PollCycleEvent] = []
+    for unit in server.units:
+        unit.modbus_client.poll_completed.add_handler(cycles.append)
+    publishes: List[float] = []
+    server._mqtt_client.batch_published.add_handler(publishes.append)
+
+    stop = threading.Event()
+    commands = threading.Thread(target=send_commands, args=(args, simulation.broker.port, stop), daemon=True)
+
+    def finish() -> None:
+        stop.set()
+        server.request_stop()
+
+    threading.Timer(args.duration, finish).start()
+    commands.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    messages_start = simulation.broker.messages
+    server.start()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    messages = simulation.broker.messages - messages_start
+    commands.join()
+    simulation.stop()
+
+    durations = sorted(cycle.duration * 1000 for cycle in cycles)
+    requests = sum(gateway.requests for gateway in simulation.gateways)
+    print(f"runtime {args.runtime}, {args.units} units on {args.gateways} gateway(s), {wall:.1f} s")
+    if durations:
+        print(f"poll cycles      {len(cycles)}, {sum(cycle.errors > 0 for cycle in cycles)} with read errors")
+        print(f"cycle latency    p50 {percentile(durations, 0.5):.1f} ms, p90 {percentile(durations, 0.9):.1f} ms, "
+              f"p99 {percentile(durations, 0.99):.1f} ms, max {durations[-1]:.1f} ms")
+    print(f"modbus requests  {requests / wall:.0f}/s")
+    windows = [gateway.window.size for gateway in server._gateway_pool.all() if gateway.window is not None]
+    if windows:
+        print(f"pipeline window  {', '.join(map(str, windows))} of {args.pipeline_window}")
+    if args.rtu:
+        bus = simulation.gateways[0]
+        print(f"rtu bus          {bus.timing_violations} inter-frame gap violations, {bus.crc_errors} CRC errors")
+    print(f"mqtt messages    {messages / wall:.0f}/s")
+    if publishes:
+        publishes.sort()
+        print(f"publish latency  p50 {percentile(publishes, 0.5) * 1e6:.0f} us, "
+              f"p99 {percentile(publishes, 0.99) * 1e6:.0f} us, from the state change to the socket")
+    print(f"cpu              {cpu / wall * 100:.1f}% of one core")
+    print(f"rss              {rss_mb():.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Cost of handling one incoming MQTT message, from the paho callback to the command reaching the Modbus client.
+
+Run from the repository root: python benchmarks/mqtt_dispatch.py --units 500
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from loguru import logger  # noqa: E402
+
+from config import Config, ModbusConfig, MQTTConfig, UnitConfig  # noqa: E402
+from server import Server  # noqa: E402
+
+NUMBER = 20000
+
+
+class Message:
+    # What paho hands to on_message
+    def __init__(self, topic: str, payload: bytes):
+        self.topic = topic
+        self.payload = payload
+        self.qos = 0
+        self.retain = False
+
+
+def build_server(units: int) -> Server:
+    return Server(Config(
+        # Commands are collected for an hour, nothing is written while measuring
+        modbus=ModbusConfig(host="127.0.0.1", port=502, poll_interval=1, write_debounce=3600),
+        mqtt=MQTTConfig(host="127.0.0.1", port=1883, keepalive=60, username="", password=""),
+        units=[UnitConfig(name=f"AC {index}", id=f"ac-{index}", model="PDRYCB500", slave=index % 247 + 1)
+               for index in range(units)]
+    ))
+
+
+def measure(name: str, statement) -> None:
+    seconds = min(timeit.repeat(statement, number=NUMBER, repeat=5))
+    print(f"{name:<45} {seconds / NUMBER * 1e6:8.2f} us per message")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cost of dispatching incoming MQTT messages")
+    parser.add_argument("--units", type=int, default=500)
+    args = parser.parse_args()
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    server = build_server(args.units)
+    on_message = server._mqtt_client._on_message
+    last = f"ac-{args.units - 1}"
+    for name, topic, payload in [
+        ("fan mode command, last unit", f"{last}/command/fan-mode", b"high"),
+        ("temperature command, last unit", f"{last}/command/temperature", b"21.5"),
+        ("power command, first unit", "ac-0/command/power", b"ON"),
+    ]:
+        message = Message(topic, payload)
+        measure(name, lambda: on_message(None, None, message))
+
+    for unit in server.units:
+        unit.modbus_client.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Time from starting the bridge process to its first publish, and to the first state of every unit, against simulated
+gateways and an in-process MQTT broker. Fails when the median time to the first state exceeds the budget.
+
+Run from the repository root: python benchmarks/startup.py --units 10 --budget 1
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Optional
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from load import Simulation, build_config  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Startup benchmark against simulated PDRYCB500 gateways")
+    parser.add_argument("--runtime", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--units", type=int, default=10)
+    parser.add_argument("--gateways", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed until every unit published a state")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    # Used by build_config and the simulators
+    args.poll_interval = 1
+    args.spread_polls = False
+    args.latency = 0.005
+    args.error_rate = 0
+    args.topic_prefix = None
+    args.json_state = False
+    args.rtu = False
+    args.pipeline_window = 1
+    args.concurrent = False
+    return args
+
+
+class FirstPublishes:
+    """
+    Listens on the broker for the first message of the bridge and the first state of every unit.
+    """
+
+    def __init__(self, units: int):
+        self._pending = {f"ac-{index}/current-temperature" for index in range(units)}
+        self.first: Optional[float] = None
+        self.all_states: Optional[float] = None
+        self.done = threading.Event()
+
+    def __call__(self, topic: str, payload: bytes) -> None:
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        self._pending.discard(topic)
+        if not self._pending and self.all_states is None:
+            self.all_states = now
+            self.done.set()
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0
+
+
+def write_workdir(args, simulation: Simulation) -> str:
+    # The bridge reads its config relative to the working directory
+    workdir = tempfile.mkdtemp(prefix="lg-airco-startup-")
+    os.makedirs(os.path.join(workdir, "config"))
+    with open(os.path.join(workdir, "config", "config.yaml"), "w") as f:
+        yaml.safe_dump(build_config(args, simulation).model_dump(mode="json"), f)
+    shutil.copy(os.path.join(ROOT, "config", "register_map.yaml"), os.path.join(workdir, "config"))
+    shutil.copy(os.path.join(ROOT, "version.info"), workdir)
+    return workdir
+
+
+def run_once(args, simulation: Simulation, workdir: str):
+    publishes = FirstPublishes(args.units)
+    simulation.broker.listeners.append(publishes)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "src", "server.py")], cwd=workdir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not publishes.done.wait(args.timeout):
+            raise RuntimeError(f"The bridge did not publish the state of every unit within {args.timeout} s")
+        rss = rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        simulation.broker.listeners.remove(publishes)
+    return publishes.first - started, publishes.all_states - started, rss
+
+
+def main() -> None:
+    args = parse_args()
+    simulation = Simulation(args)
+    workdir = write_workdir(args, simulation)
+    try:
+        runs = [run_once(args, simulation, workdir) for _ in range(args.runs)]
+    finally:
+        simulation.stop()
+        shutil.rmtree(workdir)
+
+    first = statistics.median(run[0] for run in runs)
+    all_states = statistics.median(run[1] for run in runs)
+    print(f"runtime {args.runtime}, {args.units} units on {args.gateways} gateway(s), median of {args.runs} runs")
+    print(f"first publish    {first * 1000:.0f} ms")
+    print(f"every state      {all_states * 1000:.0f} ms, budget {args.budget * 1000:.0f} ms")
+    print(f"rss              {statistics.median(run[2] for run in runs):.1f} MB")
+    if all_states > args.budget:
+        print("over budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
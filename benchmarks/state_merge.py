@@ -0,0 +1,73 @@
+"""
+Cost of merging one poll into the state of a unit.
+
+Run from the repository root: python benchmarks/state_merge.py
+"""
+import os
+import sys
+import timeit
+from dataclasses import asdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from loguru import logger  # noqa: E402
+
+from models.fan_speed_enums import FanSpeed  # noqa: E402
+from models.mode_enums import Mode  # noqa: E402
+from models.state import State  # noqa: E402
+from state_service import STATE_FIELDS, StateService  # noqa: E402
+
+NUMBER = 20000
+
+POLL = {
+    "running": True,
+    "current_temperature": 21.5,
+    "set_temperature": 22.0,
+    "mode": Mode.COOL,
+    "fan_speed": FanSpeed.AUTO,
+}
+
+
+def model_merge(current: State, state: State):
+    # The merge as it was done before the state was held in a flat list, for reference
+    old_state_data = asdict(current)
+    changes = {}
+    for name, value in asdict(state).items():
+        if value is not None:
+            setattr(current, name, value)
+            if old_state_data[name] != value:
+                changes[name] = value
+    if changes:
+        return State(**changes)
+
+
+def measure(name: str, statement) -> None:
+    seconds = min(timeit.repeat(statement, number=NUMBER, repeat=5))
+    print(f"{name:<45} {seconds / NUMBER * 1e6:8.2f} us per merge")
+
+
+def main() -> None:
+    logger.remove()
+
+    service = StateService()
+    service.merge_in_values(POLL)
+    measure("merge_in_values, nothing changed", lambda: service.merge_in_values(POLL))
+
+    # How a poll cycle merges, the decoded blocks fill a slot per field
+    slots = [POLL.get(name) for name in STATE_FIELDS]
+    measure("merge_in_slots, nothing changed", lambda: service.merge_in_slots(slots))
+
+    temperatures = [{**POLL, "current_temperature": 20 + index / 10} for index in range(2)]
+    counter = iter(range(10 ** 9))
+    measure("merge_in_values, one field changed",
+            lambda: service.merge_in_values(temperatures[next(counter) % 2]))
+
+    state = State(**POLL)
+    measure("merge_in_values(State), nothing changed", lambda: service.merge_in_values(state.__dict__))
+
+    current = State(**POLL)
+    measure("asdict merge, nothing changed", lambda: model_merge(current, State(**POLL)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+from functools import partial
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Set
+
+from loguru import logger
+from pymodbus.exceptions import ConnectionException, ModbusIOException
+
+from config import ModbusConfig, UnitConfig
+from modbus_client_base import BlockReads, ModbusClientBase
+from modbus_gateway import AsyncModbusGateway
+from poll_scheduler import PollScheduler
+from read_planner import ReadBlock
+from register_map import RegisterDefinition
+from request_queue import PRIORITY_POLL, PRIORITY_READ_BACK, PRIORITY_WRITE, RequestDropped
+from state_service import StateService
+from write_queue import WriteBatch
+from write_verifier import VERIFY_FIRST_DELAY, VERIFY_MAX_DELAY
+
+
+class AsyncModbusClient(ModbusClientBase):
+    """
+    ModbusClient for the asyncio runtime. Polling runs as a task on the event loop.
+    The write methods only schedule a task, so they can be called straight from the MQTT callbacks.
+    """
+
+    def __init__(self, config: ModbusConfig, unit: UnitConfig, gateway: AsyncModbusGateway,
+                 state_service: StateService, register_map: List[RegisterDefinition], phase: float = 0):
+        super().__init__(config, unit, gateway, state_service, register_map, phase)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # Set to wake the poll task early, e.g. to poll sooner after a command
+        self._wake_event = asyncio.Event()
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def connect(self) -> None:
+        if await self._gateway.connect():
+            logger.info(f"Modbus | Connected, starting the modbus polling of {self._unit.id}.")
+        else:
+            logger.warning(f"Modbus | Could not connect to {self._gateway.name}, "
+                           f"polling {self._unit.id} once it is reachable.")
+        self._closing = False
+        self._loop = asyncio.get_running_loop()
+        self._scheduler = PollScheduler(interval=self._poll_interval, phase=self._phase)
+        self._poll_task = self._loop.create_task(self._poll_forever())
+
+    async def disconnect(self) -> None:
+        logger.info(f"Modbus | Stopping the modbus polling of {self._unit.id}.")
+        self._closing = True
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        tasks = list(self._tasks)
+        if self._poll_task:
+            tasks.append(self._poll_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _wake(self) -> None:
+        self._wake_event.set()
+
+    def _call_later(self, delay: float, function: Callable, *args) -> None:
+        self._loop.call_later(delay, function, *args)
+
+    async def _poll_forever(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake_event.wait(), self._scheduler.time_until_next_tick())
+            except asyncio.TimeoutError:
+                pass
+            self._wake_event.clear()
+            self._apply_poll_interval()
+            if self._scheduler.time_until_next_tick() > 0:
+                # Woken early, wait for the rescheduled tick
+                continue
+
+            await self._poll_modbus_server()
+            if asyncio.current_task().cancelling():
+                # pymodbus can swallow a cancellation that arrives while a request is in flight
+                raise asyncio.CancelledError()
+            self._advance_schedule()
+
+    async def _poll_modbus_server(self) -> None:
+        blocks = self._start_poll()
+        if blocks is None:
+            return
+        start = perf_counter()
+        # Only timed per block when someone listens, e.g. the metrics or the history
+        block_durations = {} if self.poll_completed.has_handlers else None
+        try:
+            # The connection is shared with the other units on this gateway, the polls queue behind the commands
+            reads = await self._gateway.run(
+                PRIORITY_POLL, partial(self._read_blocks, blocks, self._unit.slave, block_durations),
+                key=("poll", self._unit.id), slave=self._unit.slave)
+            self._complete_poll(blocks, reads, start, block_durations)
+        except Exception as e:
+            self._poll_failed(e)
+
+    async def _read_blocks(self, blocks: List[ReadBlock], slave: int,
+                           durations: Optional[Dict[str, float]] = None) -> BlockReads:
+        self._check_connected()
+        reads = BlockReads(self._unit.id, len(blocks))
+        for block in blocks:
+            start = perf_counter()
+            try:
+                rr = await block.read(address=block.address, count=block.count, slave=slave)
+            except ConnectionException:
+                self._gateway.connection_lost()
+                raise
+            except ModbusIOException as e:
+                # The async clients raise on a missing response instead of returning it
+                rr = e
+            if durations is not None:
+                durations[block.name] = perf_counter() - start
+            if not reads.add(block, rr):
+                break
+        return reads
+
+    def _spawn(self, coroutine) -> None:
+        task = self._loop.create_task(coroutine)
+        # Keep a reference until done, the loop only keeps weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is None:
+            # Writes arriving until the flush runs are collapsed into it
+            self._flush_handle = self._loop.call_later(self._write_debounce, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._flush_handle = None
+        self._spawn(self._flush_writes())
+
+    async def _flush_writes(self) -> None:
+        batches = self._write_queue.drain()
+        if not batches:
+            return
+
+        try:
+            written = await self._gateway.run(PRIORITY_WRITE, partial(self._write_batches, batches),
+                                              slave=self._unit.slave)
+        except RequestDropped as e:
+            for batch in batches:
+                self._write_failed(batch, e)
+            return
+
+        if written:
+            await self._verify_writes(written)
+
+    async def _write_batches(self, batches: List[WriteBatch]) -> List[WriteBatch]:
+        written = []
+        for batch in batches:
+            try:
+                self._check_connected()
+                response = await getattr(self._client, batch.method)(slave=self._unit.slave, **batch.kwargs)
+            except ConnectionException as e:
+                self._gateway.connection_lost()
+                self._write_failed(batch, e)
+                continue
+            except Exception as e:
+                self._write_failed(batch, e)
+                continue
+            self._record_write(batch, response, written)
+        return written
+
+    async def _verify_writes(self, batches: List[WriteBatch]) -> None:
+        # Read back only the written registers, with a growing delay, until the unit confirms or the deadline passes
+        blocks = self._write_verifier.read_back_plan(batches, self._client)
+        delay = VERIFY_FIRST_DELAY
+        start = perf_counter()
+        while self._write_verifier.has_pending(blocks):
+            await asyncio.sleep(delay)
+            try:
+                reads = await self._gateway.run(PRIORITY_READ_BACK,
+                                                partial(self._read_blocks, blocks, self._unit.slave),
+                                                slave=self._unit.slave)
+                values = reads.values
+            except Exception as e:
+                logger.error(f"Modbus | {self._unit.id} | Could not read back {batches}: {e}")
+            else:
+                self._check_read_back(values)
+            delay = min(delay * 2, VERIFY_MAX_DELAY)
+        logger.debug(f"Modbus | {self._unit.id} | Write settled after {(perf_counter() - start) * 1000:.0f} ms")
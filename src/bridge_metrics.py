@@ -0,0 +1,107 @@
+from time import monotonic
+from typing import Dict, List, Tuple
+
+from metrics import CONTENT_TYPE, Counter, Gauge, Histogram, MetricsRegistry
+from models.poll_cycle_event import PollCycleEvent
+from mqtt_client import MqttClient
+from unit import Unit
+from unit_health import HealthState
+
+# State publishes take well below a millisecond unless the socket is backed up
+PUBLISH_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+class BridgeMetrics:
+    """
+    The metrics of the bridge. Only the latency histograms are recorded as the polls happen, everything else is
+    counted by the clients anyway and read when scraped.
+    """
+
+    def __init__(self, units: List[Unit], gateways: List, mqtt_client: MqttClient):
+        self._units = units
+        self._gateways = gateways
+        self._mqtt_client = mqtt_client
+        self.registry = MetricsRegistry()
+        register = self.registry.register
+
+        self._read_seconds = register(Histogram(
+            "lg_airco_modbus_read_seconds", "Round trip of one block read", ("unit", "block")))
+        self._poll_seconds = register(Histogram(
+            "lg_airco_poll_cycle_seconds", "Duration of a poll cycle, including the wait for the gateway", ("unit",)))
+        self._publish_seconds = register(Histogram(
+            "lg_airco_mqtt_publish_seconds", "From merging a state change to its batch being handed to the socket",
+            buckets=PUBLISH_BUCKETS))
+        self._read_errors = register(Counter(
+            "lg_airco_modbus_read_errors", "Block reads answered with an error", ("unit",)))
+        register(Counter(
+            "lg_airco_poll_failures", "Poll cycles that failed as a whole, e.g. on a lost connection", ("unit",),
+            collect=lambda: {(unit.id,): unit.modbus_client.failed_polls for unit in self._units}))
+        register(Counter(
+            "lg_airco_poll_skipped_ticks", "Poll ticks skipped because the previous poll overran", ("unit",),
+            collect=lambda: {(unit.id,): unit.modbus_client.scheduler.skipped_ticks for unit in self._units}))
+        register(Counter(
+            "lg_airco_modbus_writes", "Write requests sent to the gateway", ("unit", "result"),
+            collect=self._collect_writes))
+        register(Counter(
+            "lg_airco_modbus_connects", "Connection attempts per gateway, the first one included", ("gateway",),
+            collect=lambda: {(gateway.name,): gateway.connects for gateway in self._gateways}))
+        register(Gauge(
+            "lg_airco_modbus_queue_depth", "Requests waiting for the gateway", ("gateway",),
+            collect=lambda: {(gateway.name,): len(gateway.queue) for gateway in self._gateways}))
+        register(Gauge(
+            "lg_airco_modbus_pipeline_window", "Requests the gateway may have in flight at once, as probed",
+            ("gateway",), collect=lambda: {(gateway.name,): gateway.window.size
+                                           for gateway in self._gateways if gateway.window is not None}))
+        register(Counter(
+            "lg_airco_modbus_dropped_requests", "Queued polls superseded or dropped because the queue was full",
+            ("gateway",), collect=lambda: {(gateway.name,): gateway.queue.dropped for gateway in self._gateways}))
+        register(Counter(
+            "lg_airco_mqtt_connects", "Successful connections to the broker, the first one included",
+            collect=lambda: {(): self._mqtt_client.connects}))
+        register(Counter(
+            "lg_airco_mqtt_publishes", "Messages published per topic", ("topic",),
+            collect=lambda: {(topic,): count for topic, count in list(self._mqtt_client.publishes.items())}))
+        register(Gauge(
+            "lg_airco_unit_health", "1 for the current health state of a unit, 0 for the others", ("unit", "state"),
+            collect=self._collect_health))
+        register(Counter(
+            "lg_airco_unit_circuit_opens", "Times a unit stopped answering and was no longer polled", ("unit",),
+            collect=lambda: {(unit.id,): unit.modbus_client.health.opens for unit in self._units}))
+        register(Gauge(
+            "lg_airco_state_age_seconds", "Seconds since the state of a unit was last read", ("unit",),
+            collect=self._collect_state_age))
+
+        for unit in units:
+            unit.modbus_client.poll_completed.add_handler(self._on_poll_completed)
+        mqtt_client.batch_published.add_handler(self._publish_seconds.observe)
+
+    def _on_poll_completed(self, event: PollCycleEvent) -> None:
+        labels = (event.unit_id,)
+        self._poll_seconds.observe(event.duration, labels)
+        for block, duration in event.block_durations.items():
+            self._read_seconds.observe(duration, (event.unit_id, block))
+        if event.errors:
+            self._read_errors.inc(labels, event.errors)
+
+    def _collect_writes(self):
+        values = {}
+        for unit in self._units:
+            values[(unit.id, "ok")] = unit.modbus_client.writes
+            values[(unit.id, "error")] = unit.modbus_client.failed_writes
+        return values
+
+    def _collect_health(self):
+        values = {}
+        for unit in self._units:
+            state = unit.modbus_client.health.state
+            for health_state in HealthState:
+                values[(unit.id, health_state.value)] = int(health_state == state)
+        return values
+
+    def _collect_state_age(self):
+        now = monotonic()
+        return {(unit.id,): now - unit.modbus_client.last_poll
+                for unit in self._units if unit.modbus_client.last_poll is not None}
+
+    def serve(self, query: Dict[str, str]) -> Tuple[int, str, bytes]:
+        return 200, CONTENT_TYPE, self.registry.render().encode()
@@ -1,13 +1,102 @@
+from dataclasses import fields
+from typing import Dict, List, Literal, Optional, get_args
+
 import yaml
 
-from pydantic import BaseModel, IPvAnyAddress, Field
+from pydantic import BaseModel, IPvAnyAddress, Field, PositiveFloat, PositiveInt, model_validator
+
+from models.state import State
+
+# State fields a threshold or smoothing can be applied to, the others are compared for equality only
+NUMERIC_STATE_FIELDS = frozenset(field.name for field in fields(State)
+                                 if {float, int} & set(get_args(field.type)))
+
+
+class SerialConfig(BaseModel):
+    # The RS485 adapter the units are daisy-chained on
+    port: str = Field(..., example="/dev/ttyUSB0")
+    baudrate: PositiveInt = Field(9600)
+    bytesize: Literal[7, 8] = Field(8)
+    parity: Literal["N", "E", "O"] = Field("N")
+    stopbits: Literal[1, 2] = Field(1)
+    # Seconds the bus stays silent between a response and the next request. Defaults to the 3.5 character times of
+    # the Modbus RTU spec, 1.75 ms above 19200 baud
+    inter_request_gap: Optional[float] = Field(None, ge=0)
+    # Seconds to wait for a response, an absent slave costs this much on every request
+    timeout: float = Field(1, gt=0)
+
+
+class UnitHealthConfig(BaseModel):
+    # Poll cycles in a row without any answer after which a unit is no longer polled and marked unavailable
+    open_after: PositiveInt = Field(3)
+    # Seconds until such a unit is probed again, doubled after every failed probe up to the maximum. A random
+    # jitter of up to half of it is added on top, so the delay never falls below the minimum
+    probe_min_delay: float = Field(30, gt=0)
+    probe_max_delay: float = Field(300, gt=0)
+
+    @model_validator(mode='after')
+    def _check_probe_delays(self) -> 'UnitHealthConfig':
+        if self.probe_min_delay > self.probe_max_delay:
+            raise ValueError("probe_min_delay must not exceed probe_max_delay")
+        return self
 
 
 class ModbusConfig(BaseModel):
-    host: str = Field(..., example="192.168.1.10")
-    port: int = Field(..., gt=0, lt=65535)
-    slave: int = Field(..., gt=0)
-    poll_interval: int = Field(..., gt=0)
+    # "tcp" talks to Modbus TCP gateways at host:port, "rtu" to the units on the serial bus of `serial`
+    transport: Literal["tcp", "rtu"] = Field("tcp")
+    host: Optional[str] = Field(None, example="192.168.1.10")
+    port: int = Field(502, gt=0, lt=65535)
+    serial: Optional[SerialConfig] = Field(None)
+    # Seconds to wait for the response of a tcp gateway, a unit that stopped answering costs this much per poll cycle
+    timeout: float = Field(3, gt=0)
+    slave: Optional[int] = Field(None, gt=0)
+    poll_interval: float = Field(..., gt=0)
+    # Spread the polls of the units on one gateway evenly over the poll interval instead of polling them in lockstep
+    spread_polls: bool = Field(False)
+    # Seconds to collect commands before writing, repeated writes to one register within the window only write
+    # the last value
+    write_debounce: float = Field(0.2, ge=0)
+    # Seconds a written register may take to show the written value on read-back
+    verify_timeout: float = Field(5, gt=0)
+    # Number of unused addresses a block read may span to merge neighbouring registers into one request
+    max_read_gap: int = Field(16, ge=0)
+    # Adaptive polling: busy units are polled down to min_poll_interval and idle ones up to max_poll_interval.
+    # Both default to poll_interval, which keeps the rate fixed
+    min_poll_interval: Optional[float] = Field(None, gt=0)
+    max_poll_interval: Optional[float] = Field(None, gt=0)
+    # Seconds without any change after which a unit that is on counts as idle
+    idle_after: float = Field(300, gt=0)
+    # Seconds to poll at min_poll_interval after a command or a change made on the unit itself
+    boost_duration: float = Field(30, gt=0)
+    # Requests to keep in flight at once on one gateway connection, matched to the responses by transaction id. The
+    # window is probed between 1 and this, 1 sends one request at a time. Needs the asyncio runtime and tcp transport
+    pipeline_window: int = Field(1, ge=1, le=64)
+    # When to stop polling a unit that does not answer, and how often to probe it
+    health: UnitHealthConfig = Field(UnitHealthConfig())
+
+    @model_validator(mode='after')
+    def _check_transport(self) -> 'ModbusConfig':
+        if self.transport == "tcp" and self.host is None:
+            raise ValueError("modbus.host must be configured for the tcp transport")
+        if self.transport == "rtu" and self.serial is None:
+            raise ValueError("modbus.serial must be configured for the rtu transport")
+        return self
+
+    @model_validator(mode='after')
+    def _check_poll_intervals(self) -> 'ModbusConfig':
+        min_interval = self.min_poll_interval or self.poll_interval
+        max_interval = self.max_poll_interval or self.poll_interval
+        if not min_interval <= self.poll_interval <= max_interval:
+            raise ValueError("min_poll_interval <= poll_interval <= max_poll_interval must hold")
+        return self
+
+
+class MQTTQosConfig(BaseModel):
+    # QoS per kind of topic: climate state, sensor state, availability and Home Assistant discovery
+    state: Literal[0, 1, 2] = Field(0)
+    sensor: Literal[0, 1, 2] = Field(0)
+    availability: Literal[0, 1, 2] = Field(0)
+    discovery: Literal[0, 1, 2] = Field(1)
 
 
 class MQTTConfig(BaseModel):
@@ -16,14 +105,136 @@ class MQTTConfig(BaseModel):
     keepalive: int = Field(..., gt=0)
     username: str = Field(...)
     password: str = Field(...)
+    availability_topic: str = Field("lg-airco-modbus-mqtt/availability")
+    # Puts the topics of every unit under <topic_prefix>/<unit id>/, the commands of all units are then received
+    # through a single wildcard subscription
+    topic_prefix: Optional[str] = None
+    # Messages with QoS 1 that may await their acknowledgement at once, paces the discovery burst on connect
+    max_inflight: PositiveInt = 20
+    # Discovery configs published per second at most, only new or changed ones are published at all
+    discovery_rate: PositiveFloat = 100
+    qos: MQTTQosConfig = Field(MQTTQosConfig())
+    # Publish the whole state of a unit as one JSON message on <unit>/state instead of a topic per field
+    json_state: bool = False
 
+    @model_validator(mode='after')
+    def _check_topic_prefix(self) -> 'MQTTConfig':
+        if self.topic_prefix is not None:
+            self.topic_prefix = self.topic_prefix.strip("/")
+            if not self.topic_prefix or "+" in self.topic_prefix or "#" in self.topic_prefix:
+                raise ValueError("topic_prefix must be a topic without wildcards")
+        return self
 
-class Config(BaseModel):
-    modbus: ModbusConfig
-    mqtt: MQTTConfig
+
+class UnitConfig(BaseModel):
     name: str = Field(...)
     id: str = Field(...)
     model: str = Field(...)
+    slave: int = Field(..., gt=0)
+    # Optional gateway override, defaults to the host/port of the modbus section
+    host: Optional[str] = Field(None, example="192.168.1.11")
+    port: Optional[int] = Field(None, gt=0, lt=65535)
+
+
+class PublishFilterConfig(BaseModel):
+    # Minimum change from the last published value
+    threshold: float = Field(0, ge=0)
+    # Minimum seconds between two publishes
+    min_interval: float = Field(0, ge=0)
+    # Number of polls to average over, 1 disables smoothing
+    smoothing: int = Field(1, ge=1)
+    # Publish a changed value at least this often, even when it moved less than the threshold
+    max_staleness: Optional[float] = Field(None, gt=0)
+
+
+class MetricsConfig(BaseModel):
+    # Serve OpenMetrics on http://<host>:<port>/metrics, off by default
+    enabled: bool = Field(False)
+    host: str = Field("127.0.0.1")
+    port: int = Field(9337, gt=0, lt=65535)
+
+
+class HistoryConfig(BaseModel):
+    # Keep the last `size` polled states of every unit and serve them on http://<host>:<port>/history
+    enabled: bool = Field(False)
+    size: int = Field(10000, gt=0)
+    # Directory for one memory-mapped file per unit, so the history survives a restart. In memory only when unset
+    path: Optional[str] = Field(None, example="history")
+    host: str = Field("127.0.0.1")
+    port: int = Field(9337, gt=0, lt=65535)
+
+
+class SensorConfig(BaseModel):
+    name: str = Field(...)
+    device_class: Optional[str] = Field(None, example="temperature")
+    unit_of_measurement: Optional[str] = Field(None, example="°C")
+    state_class: Optional[str] = Field(None, example="measurement")
+
+
+class RegisterConfig(BaseModel):
+    field: str = Field(...)
+    table: Literal["coil", "discrete_input", "input_register", "holding_register"]
+    address: int = Field(..., ge=0, lt=65536)
+    scale: int = Field(1, gt=0)
+    enum: Optional[str] = Field(None, example="Mode")
+    poll_every: int = Field(1, ge=0)
+    # Also expose the field as a Home Assistant sensor
+    sensor: Optional[SensorConfig] = Field(None)
+
+
+class RegisterMapConfig(BaseModel):
+    registers: List[RegisterConfig]
+
+
+class Config(BaseModel):
+    modbus: ModbusConfig
+    mqtt: MQTTConfig
+    name: Optional[str] = Field(None)
+    id: Optional[str] = Field(None)
+    model: Optional[str] = Field(None)
+    units: List[UnitConfig] = Field([])
+    # "threaded" polls every unit on its own timer thread, "asyncio" runs polling, commands and publishing
+    # as tasks on a single event loop
+    runtime: Literal["threaded", "asyncio"] = Field("threaded")
+    # Per State field, e.g. current_temperature, limits on how often a changed value is published
+    publish_filters: Dict[str, PublishFilterConfig] = Field({})
+    metrics: MetricsConfig = Field(MetricsConfig())
+    history: HistoryConfig = Field(HistoryConfig())
+    register_map: str = Field("config/register_map.yaml")
+
+    @model_validator(mode='after')
+    def _resolve_units(self) -> 'Config':
+        if not self.units:
+            # Single unit config, as used before units could be listed
+            if None in (self.name, self.id, self.model, self.modbus.slave):
+                raise ValueError("Either 'units' or 'name', 'id', 'model' and 'modbus.slave' must be configured")
+            self.units = [UnitConfig(name=self.name, id=self.id, model=self.model, slave=self.modbus.slave)]
+
+        for unit in self.units:
+            if self.modbus.transport == "rtu":
+                if unit.host is not None or unit.port is not None:
+                    raise ValueError("Units can not set a host or port with the rtu transport")
+                # Every unit is on the one serial bus, which takes the place of the gateway
+                unit.host = self.modbus.serial.port
+                continue
+            unit.host = unit.host or self.modbus.host
+            unit.port = unit.port or self.modbus.port
+
+        if self.modbus.pipeline_window > 1 and (self.runtime != "asyncio" or self.modbus.transport != "tcp"):
+            raise ValueError("modbus.pipeline_window needs the asyncio runtime and the tcp transport")
+
+        ids = [unit.id for unit in self.units]
+        if len(ids) != len(set(ids)):
+            raise ValueError("Unit ids must be unique")
+        if self.mqtt.topic_prefix is not None and any(char in unit_id for unit_id in ids for char in "/+#"):
+            raise ValueError("Unit ids can not contain '/', '+' or '#' with a topic_prefix")
+
+        for name, publish_filter in self.publish_filters.items():
+            if name not in State.__dataclass_fields__:
+                raise ValueError(f"Unknown state field '{name}' in publish_filters")
+            if (publish_filter.threshold or publish_filter.smoothing > 1) and name not in NUMERIC_STATE_FIELDS:
+                raise ValueError(f"publish_filters.{name}: threshold and smoothing only apply to numeric fields")
+        return self
 
 
 def load_config():
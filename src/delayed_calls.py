@@ -0,0 +1,62 @@
+import heapq
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
+
+from loguru import logger
+
+
+class DelayedCalls:
+    """
+    Runs functions after a delay on one long-lived thread, one at a time in the order they come due, instead of
+    starting a Timer thread per call. A call that blocks holds up the ones after it.
+    """
+
+    def __init__(self, name: str, clock=monotonic):
+        self._name = name
+        self._clock = clock
+        self._condition = Condition()
+        # (due, sequence, function, args), the sequence keeps calls due at the same time in order
+        self._calls: List[Tuple[float, int, Callable, tuple]] = []
+        self._sequence = count()
+        # Incremented by start and stop, a thread left from an earlier start ends once its call returns
+        self._generation = 0
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        with self._condition:
+            self._generation += 1
+            generation = self._generation
+        self._thread = Thread(target=self._run, args=(generation,), name=self._name, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Drop the pending calls and end the thread, a call that is running finishes first.
+        """
+        with self._condition:
+            self._generation += 1
+            self._calls.clear()
+            self._condition.notify()
+
+    def call_later(self, delay: float, function: Callable, *args) -> None:
+        with self._condition:
+            heapq.heappush(self._calls, (self._clock() + delay, next(self._sequence), function, args))
+            self._condition.notify()
+
+    def _run(self, generation: int) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    if self._generation != generation:
+                        return
+                    timeout = self._calls[0][0] - self._clock() if self._calls else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                _, _, function, args = heapq.heappop(self._calls)
+            try:
+                function(*args)
+            except Exception as e:
+                logger.error(f"Modbus | {self._name} | {function.__name__} failed: {e}")
@@ -11,6 +11,11 @@ class EventHook(Generic[T]):
     def add_handler(self, handler: Callable[[T], None]):
         self.__handlers.append(handler)
 
+    @property
+    def has_handlers(self) -> bool:
+        # Lets a caller skip building event args nobody receives
+        return bool(self.__handlers)
+
     def fire(self, event_args: T):
         for handler in self.__handlers:
             handler(event_args)
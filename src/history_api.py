@@ -0,0 +1,95 @@
+import json
+import math
+from typing import Dict, List, Optional, Tuple
+
+from state_history import AVERAGED_FIELDS, HISTORY_FIELDS
+from unit import Unit
+
+CONTENT_TYPE = "application/json"
+
+
+class HistoryApi:
+    """
+    Serves the state history of the units as JSON on /history.
+
+    Without parameters it lists the units and fields. With `unit` it returns the samples of that unit, optionally
+    limited to `fields` (comma separated) and to `start` and `end` (Unix timestamps). With `step` (seconds) the
+    samples are downsampled into buckets of that length: temperatures are averaged, the other fields keep their last
+    value in the bucket.
+    """
+
+    def __init__(self, units: List[Unit]):
+        self._units = {unit.id: unit for unit in units}
+
+    def serve(self, query: Dict[str, str]) -> Tuple[int, str, bytes]:
+        try:
+            body = self._query(query)
+        except ValueError as e:
+            return 400, CONTENT_TYPE, json.dumps({"error": str(e)}).encode()
+        return 200, CONTENT_TYPE, json.dumps(body).encode()
+
+    def _query(self, query: Dict[str, str]) -> dict:
+        unit_id = query.get("unit")
+        if unit_id is None:
+            return {"units": list(self._units), "fields": list(HISTORY_FIELDS)}
+        unit = self._units.get(unit_id)
+        if unit is None:
+            raise ValueError(f"Unknown unit '{unit_id}'")
+
+        names = query["fields"].split(",") if "fields" in query else list(HISTORY_FIELDS)
+        unknown = [name for name in names if name not in HISTORY_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s) {', '.join(unknown)}")
+        indices = [HISTORY_FIELDS.index(name) for name in names]
+
+        start = _parse_float(query, "start", -math.inf)
+        end = _parse_float(query, "end", math.inf)
+        step = _parse_float(query, "step", None)
+        if step is not None and step <= 0:
+            raise ValueError("step must be positive")
+
+        samples = [[timestamp] + [values[index] for index in indices]
+                   for timestamp, values in unit.history.samples(start, end)]
+        if step is not None:
+            samples = _downsample(samples, names, step)
+        return {"unit": unit_id, "fields": names, "step": step, "samples": samples}
+
+
+def _parse_float(query: Dict[str, str], name: str, default: Optional[float]) -> Optional[float]:
+    if name not in query:
+        return default
+    try:
+        return float(query[name])
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
+
+
+def _downsample(samples: List[list], names: List[str], step: float) -> List[list]:
+    averaged = [name in AVERAGED_FIELDS for name in names]
+    buckets: List[list] = []
+    bucket_start = None
+    rows: List[list] = []
+
+    def close_bucket() -> None:
+        row = [bucket_start]
+        for column, average in enumerate(averaged, 1):
+            values = [sample[column] for sample in rows if sample[column] is not None]
+            if not values:
+                row.append(None)
+            elif average:
+                row.append(round(sum(values) / len(values), 3))
+            else:
+                row.append(values[-1])
+        buckets.append(row)
+
+    for sample in samples:
+        sample_bucket = math.floor(sample[0] / step) * step
+        if sample_bucket != bucket_start:
+            if rows:
+                close_bucket()
+            bucket_start = sample_bucket
+            rows = []
+        rows.append(sample)
+    if rows:
+        close_bucket()
+    return buckets
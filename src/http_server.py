@@ -0,0 +1,60 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+
+# A route gets the query parameters and returns the status code, content type and body
+Route = Callable[[Dict[str, str]], Tuple[int, str, bytes]]
+
+
+class LocalHttpServer:
+    """
+    A small HTTP server on its own thread, for local endpoints like the metrics. Only GET requests are served.
+    """
+
+    def __init__(self, host: str, port: int):
+        self._host = host
+        self._port = port
+        self._routes: Dict[str, Route] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def add_route(self, path: str, route: Route) -> None:
+        self._routes[path] = route
+
+    def start(self) -> None:
+        routes = self._routes
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                route = routes.get(url.path)
+                if route is None:
+                    self.send_error(404)
+                    return
+                try:
+                    query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                    status, content_type, body = route(query)
+                except Exception as e:
+                    logger.error(f"HTTP   | Could not serve {self.path}: {e}")
+                    self.send_error(500)
+                    return
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(f"HTTP   | {self.address_string()} | {format % args}")
+
+        self._server = ThreadingHTTPServer((self._host, self._port), Handler)
+        self._server.daemon_threads = True
+        Thread(target=self._server.serve_forever, name="http", daemon=True).start()
+        logger.info(f"HTTP   | Serving {', '.join(sorted(routes))} on {self._host}:{self._server.server_port}")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,128 @@
+import math
+from bisect import bisect_left
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Modbus round trips on a LAN take a few milliseconds, a poll cycle of several blocks up to a few hundred
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric:
+    """
+    A metric family. The values are either kept by the metric itself, or, with `collect` set, read from the
+    objects that already count them at the moment of a scrape, so nothing extra runs on the hot path.
+    """
+    type = "unknown"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._collect = collect
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = Lock()
+
+    def values(self) -> Dict[LabelValues, float]:
+        if self._collect is not None:
+            return self._collect()
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float]]:
+        for labels, value in sorted(self.values().items()):
+            yield self.name, labels, value
+
+    def render(self) -> List[str]:
+        lines = [f"# TYPE {self.name} {self.type}", f"# HELP {self.name} {self.documentation}"]
+        extra_names = {f"{self.name}_bucket": ("le",)}
+        for name, labels, value in self.samples():
+            label_names = self.label_names + extra_names.get(name, ())
+            lines.append(f"{name}{_format_labels(label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, labels: LabelValues = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float]]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}_total", labels, value
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self._buckets = tuple(buckets)
+        # Per label set: the count per bucket, with +Inf last, and the sum
+        self._histograms: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = ([0] * (len(self._buckets) + 1), [0.0])
+            histogram[0][index] += 1
+            histogram[1][0] += value
+
+    def samples(self) -> Iterable[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            histograms = {labels: (list(counts), total[0]) for labels, (counts, total) in self._histograms.items()}
+        for labels, (counts, total) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (_format_value(bound),), cumulative
+            yield f"{self.name}_count", labels, cumulative
+            yield f"{self.name}_sum", labels, total
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
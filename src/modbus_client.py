@@ -1,172 +1,173 @@
-from threading import Event, Timer
+from functools import partial
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
 
 from loguru import logger
-from pymodbus.client import ModbusTcpClient
 from pymodbus.exceptions import ConnectionException
 
-from config import ModbusConfig
-from models.fan_speed_enums import FanSpeed
-from models.mode_enums import Mode
-from models.state import State
+from config import ModbusConfig, UnitConfig
+from delayed_calls import DelayedCalls
+from modbus_client_base import BlockReads, ModbusClientBase
+from modbus_gateway import ModbusGateway
+from poll_scheduler import PollScheduler
+from read_planner import ReadBlock
+from register_map import RegisterDefinition
+from request_queue import PRIORITY_POLL, PRIORITY_READ_BACK, PRIORITY_WRITE, RequestDropped
 from state_service import StateService
+from write_queue import WriteBatch
+from write_verifier import VERIFY_FIRST_DELAY, VERIFY_MAX_DELAY
 
 
-class ModbusClient:
-    def __init__(self, config: ModbusConfig, state_service: StateService):
-        self._config = config
-        self._client = None
-        self._state_service = state_service
-        self._poll_interval = config.poll_interval
+class ModbusClient(ModbusClientBase):
+    def __init__(self, config: ModbusConfig, unit: UnitConfig, gateway: ModbusGateway, state_service: StateService,
+                 register_map: List[RegisterDefinition], phase: float = 0):
+        super().__init__(config, unit, gateway, state_service, register_map, phase)
+        self._poll_thread = None
         self._shutdown_event = Event()
-        self._loops_to_skip = 0
+        # Set to wake the poll thread early, e.g. to poll sooner after a command
+        self._wake_event = Event()
+        # Flushes, delayed writes and read-backs run on one long-lived thread per unit, next to the poll thread
+        self._delayed_calls = DelayedCalls(name=f"writes-{unit.id}")
+        self._flush_lock = Lock()
+        self._flush_scheduled = False
 
     def connect(self) -> None:
-        logger.info(f"Modbus | Connecting to {self._config.host}:{self._config.port}.")
-        self._client = ModbusTcpClient(host=self._config.host, port=self._config.port)
-        self._client.connect()
-        if not self._client.is_socket_open():
-            raise Exception('Modbus | Could not open connection.')
-        logger.info("Modbus | Connected.")
-        logger.info("Modbus | Starting the modbus polling.")
+        if self._gateway.connect():
+            logger.info(f"Modbus | Connected, starting the modbus polling of {self._unit.id}.")
+        else:
+            logger.warning(f"Modbus | Could not connect to {self._gateway.name}, "
+                           f"polling {self._unit.id} once it is reachable.")
+        self._closing = False
         self._shutdown_event.clear()
-        self._schedule_next_poll()
+        self._wake_event.clear()
+        self._scheduler = PollScheduler(interval=self._poll_interval, phase=self._phase)
+        with self._flush_lock:
+            self._flush_scheduled = False
+        self._delayed_calls.start()
+        self._poll_thread = Thread(target=self._poll_loop, name=f"poll-{self._unit.id}", daemon=True)
+        self._poll_thread.start()
 
     def disconnect(self) -> None:
-        logger.info("Modbus | Stopping the modbus polling.")
+        logger.info(f"Modbus | Stopping the modbus polling of {self._unit.id}.")
+        self._closing = True
         self._shutdown_event.set()
-        if hasattr(self, '_poll_timer') and self._poll_timer:
-            self._poll_timer.cancel()
-        logger.info("Modbus | Closing the connection.")
-        self._client.close()
-
-    def _schedule_next_poll(self) -> None:
-        if not self._shutdown_event.is_set():
-            self._poll_timer = Timer(interval=self._poll_interval, function=self._poll_modbus_server)
-            self._poll_timer.start()
+        self._wake_event.set()
+        self._delayed_calls.stop()
+
+    def _wake(self) -> None:
+        self._wake_event.set()
+
+    def _call_later(self, delay: float, function: Callable, *args) -> None:
+        self._delayed_calls.call_later(delay, function, *args)
+
+    def _poll_loop(self) -> None:
+        # One long-lived thread per unit, woken on the fixed rate ticks of the scheduler
+        while True:
+            self._wake_event.wait(self._scheduler.time_until_next_tick())
+            self._wake_event.clear()
+            if self._shutdown_event.is_set():
+                return
+            self._apply_poll_interval()
+            if self._scheduler.time_until_next_tick() > 0:
+                # Woken early, wait for the rescheduled tick
+                continue
+
+            self._poll_modbus_server()
+            self._advance_schedule()
 
     def _poll_modbus_server(self) -> None:
-        slave = self._config.slave
-        if self._loops_to_skip > 0:
-            logger.debug("Modbus | Skipping poll")
-            self._loops_to_skip -= 1
-            self._schedule_next_poll()
+        blocks = self._start_poll()
+        if blocks is None:
+            return
+        start = perf_counter()
+        # Only timed per block when someone listens, e.g. the metrics or the history
+        block_durations = {} if self.poll_completed.has_handlers else None
+        try:
+            # The connection is shared with the other units on this gateway, the polls queue behind the commands
+            reads = self._gateway.run(PRIORITY_POLL, partial(self._read_blocks, blocks, self._unit.slave,
+                                                             block_durations), key=("poll", self._unit.id))
+            self._complete_poll(blocks, reads, start, block_durations)
+        except Exception as e:
+            self._poll_failed(e)
+
+    def _read_blocks(self, blocks: List[ReadBlock], slave: int,
+                     durations: Optional[Dict[str, float]] = None) -> BlockReads:
+        self._check_connected()
+        reads = BlockReads(self._unit.id, len(blocks))
+        for block in blocks:
+            start = perf_counter()
+            try:
+                rr = block.read(address=block.address, count=block.count, slave=slave)
+            except ConnectionException:
+                self._gateway.connection_lost()
+                raise
+            if durations is not None:
+                durations[block.name] = perf_counter() - start
+            if not reads.add(block, rr):
+                break
+        return reads
+
+    def _schedule_flush(self) -> None:
+        with self._flush_lock:
+            if not self._flush_scheduled:
+                # Writes arriving until the flush runs are collapsed into it. Even without a debounce the flush runs
+                # on the writes thread, it waits for the gateway and the caller is the MQTT network thread
+                self._flush_scheduled = True
+                self._delayed_calls.call_later(self._write_debounce, self._flush_writes)
+
+    def _flush_writes(self) -> None:
+        with self._flush_lock:
+            self._flush_scheduled = False
+        batches = self._write_queue.drain()
+        if not batches:
             return
 
-        if self._shutdown_event.is_set():
-            # Stop polling since the shutdown flag is set
+        try:
+            written = self._gateway.run(PRIORITY_WRITE, partial(self._write_batches, batches))
+        except RequestDropped as e:
+            for batch in batches:
+                self._write_failed(batch, e)
             return
 
+        if written:
+            self._verify_writes(written)
+
+    def _write_batches(self, batches: List[WriteBatch]) -> List[WriteBatch]:
+        written = []
+        for batch in batches:
+            try:
+                self._check_connected()
+                response = getattr(self._client, batch.method)(slave=self._unit.slave, **batch.kwargs)
+            except ConnectionException as e:
+                self._gateway.connection_lost()
+                self._write_failed(batch, e)
+                continue
+            except Exception as e:
+                self._write_failed(batch, e)
+                continue
+            self._record_write(batch, response, written)
+        return written
+
+    def _verify_writes(self, batches: List[WriteBatch]) -> None:
+        blocks = self._write_verifier.read_back_plan(batches, self._client)
+        self._schedule_read_back(batches, blocks, VERIFY_FIRST_DELAY, perf_counter())
+
+    def _schedule_read_back(self, batches: List[WriteBatch], blocks: List[ReadBlock], delay: float,
+                            start: float) -> None:
+        # Read back only the written registers, with a growing delay, until the unit confirms or the deadline passes.
+        # Every read-back is a call of its own, so newer writes are flushed in between
+        if self._write_verifier.has_pending(blocks):
+            self._delayed_calls.call_later(delay, self._read_back, batches, blocks, delay, start)
+        else:
+            logger.debug(f"Modbus | {self._unit.id} | Write settled after {(perf_counter() - start) * 1000:.0f} ms")
+
+    def _read_back(self, batches: List[WriteBatch], blocks: List[ReadBlock], delay: float, start: float) -> None:
         try:
-            if not self._client.is_socket_open():
-                self._client.connect()
-
-            """
-            Read in operation
-            """
-            in_operation = None
-            rr = self._client.read_coils(address=0, slave=slave, unit=1)
-            if rr.isError():
-                logger.error("Modbus | Could not read set temperature")
-                pass
-            else:
-                in_operation = rr.bits[0] == 1
-
-            """
-            Read current temperature
-            """
-            current_temperature = None
-            rr = self._client.read_input_registers(address=2, slave=slave, unit=1)
-            if rr.isError():
-                logger.error("Modbus | Could not read current temperature")
-                pass
-            else:
-                current_temperature = rr.registers[0] / 10
-
-            """
-            Read set temperature
-            """
-            set_temperature = None
-            rr = self._client.read_holding_registers(address=1, slave=slave, unit=1)
-            if rr.isError():
-                logger.error("Modbus | Could not read set temperature")
-                pass
-            else:
-                set_temperature = rr.registers[0] / 10
-
-            """
-            Read run mode
-            """
-            run_mode = None
-            rr = self._client.read_holding_registers(address=0, slave=slave, unit=1)
-            if rr.isError():
-                logger.error("Modbus | Could not read run mode")
-                pass
-            else:
-                run_mode = rr.registers[0]
-
-            """
-            Read fan speed
-            """
-            fan_speed = None
-            rr = self._client.read_holding_registers(address=14, slave=slave, unit=1)
-            if rr.isError():
-                logger.error("Modbus | Could not read fan speed")
-                pass
-            else:
-                fan_speed = rr.registers[0]
-
-            """
-            Send off the state
-            """
-            self._state_service.merge_in_state(State(
-                running=in_operation,
-                current_temperature=current_temperature,
-                set_temperature=set_temperature,
-                mode=Mode.from_value(run_mode),
-                fan_speed=FanSpeed.from_value(fan_speed)
-            ))
-        except ConnectionException as e:
-            logger.error(f"Modbus | Connection exception: {e}")
+            values = self._gateway.run(PRIORITY_READ_BACK,
+                                       partial(self._read_blocks, blocks, self._unit.slave)).values
         except Exception as e:
-            logger.error(f"Modbus | Polling exception: {e}")
-        finally:
-            self._schedule_next_poll()
-
-    def write_operate(self, value: bool) -> None:
-        logger.debug(f"Modbus | Writing {value} to operate coil.")
-        self._loops_to_skip = 3
-        response = self._client.write_coil(address=0, value=value, slave=self._config.slave)
-        if response.isError():
-            logger.error(f"Modbus | Could not set operate to {value}")
-        else:
-            logger.debug(f"Modbus | {response}")
-
-    def set_temperature(self, value: float) -> None:
-        temp = int(value*10)
-        logger.debug(f"Modbus | Writing {value} to register 1.")
-        self._loops_to_skip = 3
-        response = self._client.write_register(address=1, value=temp, slave=self._config.slave)
-        if response.isError():
-            logger.error(f"Modbus | Could not set temperature to {temp}")
-        else:
-            logger.debug(f"Modbus | {response}")
-
-    def set_mode(self, value: Mode) -> None:
-        mode = value.value
-        logger.debug(f"Modbus | Writing {value} to register 0.")
-        self._loops_to_skip = 3
-        response = self._client.write_register(address=0, value=mode, slave=self._config.slave)
-        if response.isError():
-            logger.error(f"Modbus | Could not set mode to {mode}")
-        else:
-            logger.debug(f"Modbus | {response}")
-
-    def set_fan_speed(self, value) -> None:
-        fan_speed = value.value
-        logger.debug(f"Modbus | Writing {value} to register 0.")
-        self._loops_to_skip = 3
-        response = self._client.write_register(address=14, value=fan_speed, slave=self._config.slave)
-        if response.isError():
-            logger.error(f"Modbus | Could not set fan speed to {fan_speed}")
+            logger.error(f"Modbus | {self._unit.id} | Could not read back {batches}: {e}")
         else:
-            logger.debug(f"Modbus | {response}")
+            self._check_read_back(values)
+        self._schedule_read_back(batches, blocks, min(delay * 2, VERIFY_MAX_DELAY), start)
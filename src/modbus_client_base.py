@@ -0,0 +1,257 @@
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, Optional
+
+from loguru import logger
+from pymodbus.exceptions import ConnectionException
+
+from config import ModbusConfig, UnitConfig
+from event_hook import EventHook
+from models.mode_enums import Mode
+from models.poll_cycle_event import PollCycleEvent
+from poll_scheduler import AdaptivePollInterval, PollScheduler
+from read_planner import ReadBlock, TieredReadPlan
+from register_map import RegisterDefinition, RegisterTable, encode_value
+from request_queue import RequestDropped
+from state_service import STATE_FIELDS, StateService
+from unit_health import UnitHealth, is_no_response
+from write_queue import WriteBatch, WriteQueue
+from write_verifier import WriteVerifier
+
+
+class BlockReads:
+    """
+    The outcome of reading the blocks of a poll cycle or a read-back, one response at a time.
+    """
+
+    def __init__(self, unit_id: str, blocks: int):
+        self._unit_id = unit_id
+        self._remaining = blocks
+        # A slot per state field, None for the fields that were not read
+        self.values: List = [None] * len(STATE_FIELDS)
+        self.errors = 0
+        # Whether the unit answered at least one request
+        self.answered = False
+        # Whether at least one block was decoded
+        self.decoded = False
+
+    def add(self, block: ReadBlock, response) -> bool:
+        """
+        Record the response to a block read, returns False when the remaining blocks should not be read.
+        """
+        if is_no_response(response):
+            # The other blocks would wait out the timeout as well, holding up every unit on the gateway
+            self.errors += self._remaining
+            logger.error(f"Modbus | {self._unit_id} | No answer, skipping the rest of the poll cycle")
+            return False
+        self._remaining -= 1
+        self.answered = True
+        if response.isError():
+            self.errors += 1
+            logger.error(f"Modbus | {self._unit_id} | Could not read "
+                         f"{', '.join(definition.field for definition, _ in block.registers)}")
+            return True
+
+        block.decode_into(response, self.values)
+        self.decoded = True
+        return True
+
+
+class ModbusClientBase:
+    """
+    What the threaded and the asyncio client share: planning the reads, merging the polled values into the state,
+    queueing and verifying writes, the unit health and the events. The subclasses do the I/O, blocking or awaited.
+    """
+
+    def __init__(self, config: ModbusConfig, unit: UnitConfig, gateway, state_service: StateService,
+                 register_map: List[RegisterDefinition], phase: float = 0):
+        self._config = config
+        self._unit = unit
+        self._gateway = gateway
+        self._client = gateway.client
+        self._state_service = state_service
+        self._writable = {definition.field: definition for definition in register_map if definition.table.is_writable}
+        self._poll_interval = config.poll_interval
+        self._phase = phase
+        self._scheduler = PollScheduler(interval=self._poll_interval, phase=phase)
+        self._poll_rate = AdaptivePollInterval(
+            config, control_fields=[d.field for d in register_map if d.table.is_writable])
+        self._read_plan = TieredReadPlan(register_map, max_gap=config.max_read_gap, client=self._client)
+        self._poll_count = 0
+        self._write_queue = WriteQueue()
+        self._write_debounce = config.write_debounce
+        self._write_verifier = WriteVerifier(unit_id=unit.id, definitions=register_map,
+                                             timeout=config.verify_timeout)
+        # Set by disconnect, late polls and commands are dropped quietly
+        self._closing = False
+
+        # Counters for the metrics, read when scraped
+        self.failed_polls = 0
+        self.writes = 0
+        self.failed_writes = 0
+        self.last_poll = None
+        self.health = UnitHealth(unit.id, config.health)
+
+        self.poll_completed = EventHook[PollCycleEvent]()
+
+    @property
+    def scheduler(self) -> PollScheduler:
+        return self._scheduler
+
+    def boost_polling(self) -> None:
+        """
+        Poll at the fastest rate for a while, called when a command comes in.
+        """
+        if self._poll_rate.enabled:
+            self._poll_rate.boost()
+            self._wake()
+
+    def _wake(self) -> None:
+        """
+        Wake the poll loop before its next tick.
+        """
+        raise NotImplementedError
+
+    def _call_later(self, delay: float, function: Callable, *args) -> None:
+        raise NotImplementedError
+
+    def _schedule_flush(self) -> None:
+        """
+        Have the queued writes flushed after the debounce, without blocking the caller.
+        """
+        raise NotImplementedError
+
+    def _apply_poll_interval(self) -> None:
+        if not self._poll_rate.enabled:
+            return
+        interval = self._poll_rate.current()
+        if interval != self._scheduler.interval:
+            logger.debug(f"Modbus | {self._unit.id} | Polling every {interval} s")
+            self._scheduler.set_interval(interval)
+
+    def _advance_schedule(self) -> None:
+        skipped = self._scheduler.advance()
+        if skipped:
+            logger.warning(f"Modbus | {self._unit.id} | Poll cycle overran, skipped {skipped} tick(s). "
+                           f"{self._scheduler.overruns} overrun(s) in {self._scheduler.ticks} cycles so far")
+        self._apply_poll_interval()
+
+    def _start_poll(self) -> Optional[List[ReadBlock]]:
+        """
+        The blocks to read this cycle, None to skip it.
+        """
+        if not self._gateway.available:
+            # The gateway is reconnecting in the background, there is nothing to gain from trying
+            return None
+        blocks = self._read_plan.blocks(self._poll_count)
+        if not blocks:
+            # Every field is skipped on this cycle, there is no answer to judge the unit by
+            self._poll_count += 1
+            return None
+        if not self.health.should_poll():
+            return None
+        self._poll_count += 1
+        return blocks
+
+    def _complete_poll(self, blocks: List[ReadBlock], reads: BlockReads, start: float,
+                       block_durations: Optional[Dict[str, float]]) -> None:
+        requests = len(blocks)
+        duration = perf_counter() - start
+        logger.debug("Modbus | {} | Poll cycle took {} request(s) in {:.1f} ms", self._unit.id, requests,
+                     duration * 1000)
+        values = reads.values
+        if reads.decoded:
+            self.last_poll = monotonic()
+
+        # Fields with a write in flight keep their commanded value until the read-back settles them
+        self._write_verifier.mask(values)
+        changes = self._state_service.merge_in_slots(values)
+        self._poll_rate.record(changes, running=self._state_service.get_value("running"))
+        if self.poll_completed.has_handlers:
+            # Fired after the merge, so the handlers see the state of this cycle
+            self.poll_completed.fire(PollCycleEvent(
+                unit_id=self._unit.id,
+                requests=requests,
+                errors=reads.errors,
+                duration=duration,
+                block_durations=block_durations
+            ))
+        self.health.record(reads.answered)
+
+    def _poll_failed(self, e: Exception) -> None:
+        if isinstance(e, RequestDropped):
+            if not self._closing:
+                logger.warning(f"Modbus | {self._unit.id} | Poll {e}")
+        elif isinstance(e, ConnectionException):
+            self.failed_polls += 1
+            # Start over with a full read once the gateway answers again
+            self._poll_count = 0
+            logger.error(f"Modbus | Connection exception: {e}")
+        else:
+            self.failed_polls += 1
+            logger.error(f"Modbus | Polling exception: {e}")
+
+    def _check_connected(self) -> None:
+        if not self._gateway.available:
+            raise ConnectionException(f"Not connected to {self._gateway.name}")
+
+    def write_operate(self, value: bool) -> None:
+        self._write_field("running", value)
+
+    def set_temperature(self, value: float) -> None:
+        self._write_field("set_temperature", value)
+
+    def set_mode(self, value: Mode, delay: float = 0) -> None:
+        self._write_field("mode", value, delay=delay)
+
+    def set_fan_speed(self, value) -> None:
+        self._write_field("fan_speed", value)
+
+    def _write_field(self, field: str, value, delay: float = 0) -> None:
+        definition = self._writable.get(field)
+        if definition is None:
+            logger.error(f"Modbus | {self._unit.id} | The register map has no writable register for {field}")
+            return
+        raw = encode_value(definition, value)
+        logger.debug("Modbus | {} | Writing {} to {} {}.", self._unit.id, value, definition.table.value,
+                     definition.address)
+        if delay > 0:
+            self._expect_write(definition.table, definition.address, raw, delay=delay)
+            # Wait on a timer, so the caller is never blocked
+            self._call_later(delay, self._queue_write, definition.table, definition.address, raw)
+            return
+
+        self._queue_write(definition.table, definition.address, raw)
+
+    def _expect_write(self, table: RegisterTable, address: int, value, delay: float = 0) -> None:
+        # Show the commanded value right away, the read-back after the write confirms or corrects it
+        expected = self._write_verifier.expect(table, address, value, delay=delay + self._write_debounce)
+        if expected is not None:
+            field, decoded = expected
+            self._state_service.merge_in_values({field: decoded})
+
+    def _queue_write(self, table: RegisterTable, address: int, value) -> None:
+        if self._closing:
+            # A delayed write or a late command after disconnect
+            return
+        self._expect_write(table, address, value)
+        if self._write_queue.put(table, address, value):
+            logger.debug("Modbus | {} | Superseded the pending write to {} {}", self._unit.id, table.value, address)
+        self._schedule_flush()
+
+    def _record_write(self, batch: WriteBatch, response, written: List[WriteBatch]) -> None:
+        if response.isError():
+            self._write_failed(batch, response)
+        else:
+            logger.debug("Modbus | {}", response)
+            self.writes += 1
+            written.append(batch)
+
+    def _write_failed(self, batch: WriteBatch, reason) -> None:
+        logger.error(f"Modbus | {self._unit.id} | Could not write {batch}: {reason}")
+        self.failed_writes += 1
+        self._write_verifier.forget(batch)
+
+    def _check_read_back(self, values: List) -> None:
+        expired = self._write_verifier.check(values)
+        if expired:
+            self._state_service.merge_in_values(expired)
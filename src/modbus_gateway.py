@@ -0,0 +1,507 @@
+import asyncio
+import random
+import time
+from functools import partial
+from threading import Event, Lock, Thread
+from typing import Callable, Dict, Hashable, Optional, Set, Tuple
+
+from loguru import logger
+from pymodbus.client import AsyncModbusSerialClient, AsyncModbusTcpClient, ModbusSerialClient, ModbusTcpClient
+from pymodbus.exceptions import ModbusIOException
+
+from config import SerialConfig
+from event_hook import EventHook
+from pipeline_window import PipelineWindow
+from request_queue import AsyncRequestQueue, Request, RequestQueue
+
+# Delay before the first reconnect attempt, doubled after every failed attempt up to the maximum
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+# Seconds to wait for the response of a Modbus TCP gateway, the default of pymodbus
+TCP_TIMEOUT = 3.0
+
+
+class ReconnectBackoff:
+    """
+    Exponential backoff with jitter. Each delay is picked between half and the full backoff, so gateways that went
+    down together, e.g. on a switch reboot, do not all retry at the same moment. With `jitter_above` it is picked
+    between the backoff and one and a half times it instead, so it never falls below `min_delay`.
+    """
+
+    def __init__(self, min_delay: float = RECONNECT_MIN_DELAY, max_delay: float = RECONNECT_MAX_DELAY,
+                 rng=random.random, jitter_above: bool = False):
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._rng = rng
+        self._jitter_above = jitter_above
+        self._attempts = 0
+
+    def next_delay(self) -> float:
+        backoff = min(self._max_delay, self._min_delay * 2 ** self._attempts)
+        self._attempts += 1
+        if self._jitter_above:
+            return backoff + self._rng() * backoff / 2
+        return backoff / 2 + self._rng() * backoff / 2
+
+    def reset(self) -> None:
+        self._attempts = 0
+
+
+class _GatewayBase:
+    def __init__(self, host: str, port: Optional[int]):
+        self.host = host
+        self.port = port
+        self.connects = 0
+        self._available = False
+        self._backoff = ReconnectBackoff()
+        # Set when requests are pipelined on the connection
+        self.window: Optional[PipelineWindow] = None
+
+        # Fired with True when the link comes up and False when it goes down
+        self.availability_changed = EventHook[bool]()
+
+    @property
+    def name(self) -> str:
+        # A serial bus has no port
+        return self.host if self.port is None else f"{self.host}:{self.port}"
+
+    @property
+    def available(self) -> bool:
+        """
+        Whether the link is up. While it is down, requests are not sent at all, a reconnect runs in the background.
+        """
+        return self._available
+
+    def _set_available(self, available: bool) -> None:
+        if available == self._available:
+            return
+        self._available = available
+        if available:
+            self._backoff.reset()
+        self.availability_changed.fire(available)
+
+
+# The clients below reach into private internals of pymodbus 3.5, see requirements.txt. They are checked once,
+# where one is missing the client keeps the behaviour of pymodbus
+_CAN_SEND_ONCE = all(hasattr(AsyncModbusTcpClient, name) and hasattr(AsyncModbusSerialClient, name)
+                     for name in ("_build_response", "transport_send"))
+_CAN_WAIT_FOR_DATA = all(hasattr(ModbusSerialClient, name) for name in ("_in_waiting", "_wait_for_data"))
+
+
+def _forget_missed_responses(transaction) -> None:
+    # pymodbus 3.5.4, pinned in requirements.txt, keeps the slaves that missed a response in this private list and
+    # waits out the whole timeout on their next response. Other versions may not have it, then there is nothing to do
+    if hasattr(transaction, "_no_response_devices"):
+        transaction._no_response_devices.clear()
+
+
+async def _execute_once(client, request):
+    """
+    What pymodbus' async_execute does, without the retries: the request is sent once and a missing response raises
+    ModbusIOException, without closing the connection. That is on purpose, a retry would hold every other unit on
+    the gateway up for another timeout, and the next poll cycle reads the unit again anyway. Broadcasts are sent
+    without waiting for a response, as pymodbus does.
+    """
+    packet = client.framer.buildPacket(request)
+    if client.params.broadcast_enable and not request.slave_id:
+        client.transport_send(packet)
+        return b"Broadcast write sent - no response expected"
+    response = client._build_response(request.transaction_id)
+    client.transport_send(packet)
+    try:
+        return await asyncio.wait_for(response, timeout=client.comm_params.timeout_connect)
+    except asyncio.TimeoutError:
+        client.transaction.delTransaction(request.transaction_id)
+        raise ModbusIOException(f"No response from slave {request.slave_id}") from None
+
+
+class _TcpClient(ModbusTcpClient):
+    """
+    pymodbus waits out the whole timeout on the next response of a slave that missed one, as if its length were
+    unknown. The MBAP header carries it, so a unit that answers again is read as fast as any other.
+    """
+
+    def execute(self, request=None):
+        _forget_missed_responses(self.transaction)
+        return super().execute(request)
+
+
+class ModbusGateway(_GatewayBase):
+    """
+    One Modbus TCP connection, shared by every unit behind the same host:port.
+    All requests go through `run`, a single I/O thread takes them from a priority queue one at a time, so the frames
+    of different units never interleave and a command does not wait behind the polls of the other units.
+    """
+
+    def __init__(self, host: str, port: Optional[int], timeout: float = TCP_TIMEOUT):
+        super().__init__(host, port)
+        self.timeout = timeout
+        self.client = self._create_client()
+        # Held by the I/O thread while it runs a request and by the reconnect thread while it connects
+        self.lock = Lock()
+        self.queue = RequestQueue()
+        self._worker: Optional[Thread] = None
+        self._reconnect_thread: Optional[Thread] = None
+        self._closed = Event()
+
+    def _create_client(self):
+        return _TcpClient(host=self.host, port=self.port, timeout=self.timeout)
+
+    def run(self, priority: int, function: Callable, key: Optional[Hashable] = None):
+        """
+        Run `function` on the I/O thread and return its result. A queued request with the same key is superseded,
+        it raises RequestDropped.
+        """
+        return self.queue.put(priority, function, key).result()
+
+    def connect(self) -> bool:
+        """
+        Connect once, if that fails the gateway keeps reconnecting in the background.
+        """
+        if self._worker is None:
+            self._worker = Thread(target=self._work, name=f"modbus-{self.name}", daemon=True)
+            self._worker.start()
+        if self._available:
+            return True
+        if self._reconnect_thread is not None and self._reconnect_thread.is_alive():
+            return False
+        with self.lock:
+            if self._try_connect():
+                return True
+        self._start_reconnecting()
+        return False
+
+    def connection_lost(self) -> None:
+        """
+        Called by a client that lost the connection, with `lock` held.
+        """
+        if not self._available:
+            return
+        logger.warning(f"Modbus | Lost the connection to {self.name}.")
+        self.client.close()
+        self._set_available(False)
+        self._start_reconnecting()
+
+    def close(self) -> None:
+        self._closed.set()
+        self.queue.close()
+        with self.lock:
+            logger.info(f"Modbus | Closing the connection to {self.name}.")
+            self.client.close()
+
+    def _work(self) -> None:
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            if not request.future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.lock:
+                    result = request.function()
+            except BaseException as e:
+                request.future.set_exception(e)
+            else:
+                request.future.set_result(result)
+
+    def _try_connect(self) -> bool:
+        logger.info(f"Modbus | Connecting to {self.name}.")
+        self.connects += 1
+        self.client.connect()
+        if not self.client.is_socket_open():
+            return False
+        self._set_available(True)
+        return True
+
+    def _start_reconnecting(self) -> None:
+        if self._reconnect_thread is not None and self._reconnect_thread.is_alive():
+            return
+        self._reconnect_thread = Thread(target=self._reconnect_loop, name=f"reconnect-{self.name}", daemon=True)
+        self._reconnect_thread.start()
+
+    def _reconnect_loop(self) -> None:
+        while True:
+            delay = self._backoff.next_delay()
+            logger.info(f"Modbus | Reconnecting to {self.name} in {delay:.1f} s.")
+            if self._closed.wait(delay):
+                return
+            with self.lock:
+                if self._try_connect():
+                    logger.info(f"Modbus | Reconnected to {self.name}.")
+                    return
+
+
+class _AsyncTcpClient(AsyncModbusTcpClient):
+    """
+    Sends a request once and raises ModbusIOException when the response is missing. pymodbus would resend it
+    `retries` times and then close the connection, so one slave that stopped answering took down every unit on the
+    gateway.
+    """
+
+    async def async_execute(self, request=None):
+        if not _CAN_SEND_ONCE:
+            return await super().async_execute(request)
+        request.transaction_id = self.transaction.getNextTID()
+        return await _execute_once(self, request)
+
+
+class AsyncModbusGateway(_GatewayBase):
+    """
+    The asyncio counterpart of ModbusGateway, used by the asyncio runtime.
+
+    With a `pipeline_window` above 1 the I/O task keeps up to that many requests in flight on the connection, pymodbus
+    matches the responses to them by transaction id. Requests for the same slave still run one after the other.
+    """
+
+    def __init__(self, host: str, port: Optional[int], pipeline_window: int = 1, timeout: float = TCP_TIMEOUT):
+        super().__init__(host, port)
+        if pipeline_window > 1:
+            self.window = PipelineWindow(pipeline_window)
+        self.timeout = timeout
+        self.client = self._create_client()
+        self.lock = asyncio.Lock()
+        self.queue = AsyncRequestQueue()
+        self._worker: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+
+    def _create_client(self):
+        # Reconnecting is left to the gateway, so it can mark the units unavailable in the meantime
+        return _AsyncTcpClient(host=self.host, port=self.port, timeout=self.timeout, reconnect_delay=0)
+
+    async def run(self, priority: int, function: Callable, key: Optional[Hashable] = None,
+                  slave: Optional[int] = None):
+        """
+        Await the coroutine function `function` on the I/O task and return its result.
+        """
+        return await (await self.queue.put(priority, function, key, slave))
+
+    async def connect(self) -> bool:
+        if self._worker is None:
+            work = self._work() if self.window is None else self._work_pipelined()
+            self._worker = asyncio.get_running_loop().create_task(work)
+        if self._available:
+            return True
+        if self._reconnect_task is not None and not self._reconnect_task.done():
+            return False
+        async with self.lock:
+            if await self._try_connect():
+                return True
+        self._start_reconnecting()
+        return False
+
+    def connection_lost(self) -> None:
+        if not self._available:
+            return
+        logger.warning(f"Modbus | Lost the connection to {self.name}.")
+        self.client.close()
+        self._set_available(False)
+        self._start_reconnecting()
+
+    def close(self) -> None:
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._worker is not None:
+            self._worker.cancel()
+        self.queue.close()
+        logger.info(f"Modbus | Closing the connection to {self.name}.")
+        self.client.close()
+
+    async def _work(self) -> None:
+        while True:
+            request = await self.queue.get()
+            if request.future.done():
+                # The caller gave up waiting, e.g. on shutdown
+                continue
+            try:
+                async with self.lock:
+                    result = await request.function()
+            except asyncio.CancelledError:
+                request.future.cancel()
+                raise
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                if not request.future.done():
+                    request.future.set_result(result)
+            if asyncio.current_task().cancelling():
+                # pymodbus can swallow a cancellation that arrives while a request is in flight
+                raise asyncio.CancelledError()
+
+    async def _work_pipelined(self) -> None:
+        running: Set[asyncio.Task] = set()
+        busy_slaves: Set[int] = set()
+        try:
+            while True:
+                if len(running) >= self.window.size:
+                    await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                request = await self.queue.get(busy_slaves)
+                if request.future.done():
+                    continue
+                if request.slave is not None:
+                    busy_slaves.add(request.slave)
+                task = asyncio.get_running_loop().create_task(self._run_pipelined(request, len(running) + 1))
+                running.add(task)
+                task.add_done_callback(partial(self._on_pipelined_done, running, busy_slaves, request.slave))
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _run_pipelined(self, request: Request, in_flight: int) -> None:
+        start = time.perf_counter()
+        try:
+            result = await request.function()
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as e:
+            self.window.record(in_flight, time.perf_counter() - start, failed=True)
+            if not request.future.done():
+                request.future.set_exception(e)
+        else:
+            self.window.record(in_flight, time.perf_counter() - start)
+            if not request.future.done():
+                request.future.set_result(result)
+
+    def _on_pipelined_done(self, running: Set[asyncio.Task], busy_slaves: Set[int], slave: Optional[int],
+                           task: asyncio.Task) -> None:
+        running.discard(task)
+        busy_slaves.discard(slave)
+        # A request for that slave may be waiting
+        self.queue.notify()
+
+    async def _try_connect(self) -> bool:
+        logger.info(f"Modbus | Connecting to {self.name}.")
+        self.connects += 1
+        await self.client.connect()
+        if not self.client.connected:
+            return False
+        self._set_available(True)
+        return True
+
+    def _start_reconnecting(self) -> None:
+        if self._reconnect_task is not None and not self._reconnect_task.done():
+            return
+        self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect_forever())
+
+    async def _reconnect_forever(self) -> None:
+        while True:
+            delay = self._backoff.next_delay()
+            logger.info(f"Modbus | Reconnecting to {self.name} in {delay:.1f} s.")
+            await asyncio.sleep(delay)
+            async with self.lock:
+                if await self._try_connect():
+                    logger.info(f"Modbus | Reconnected to {self.name}.")
+                    return
+
+
+def _serial_client_kwargs(config: SerialConfig) -> dict:
+    return dict(port=config.port, baudrate=config.baudrate, bytesize=config.bytesize, parity=config.parity,
+                stopbits=config.stopbits, timeout=config.timeout)
+
+
+class _RtuClient(ModbusSerialClient):
+    """
+    Keeps the bus silent for `gap` seconds between a response and the next request, pymodbus 3.5 only computes the
+    silent interval but does not wait for it.
+    """
+
+    def __init__(self, gap: Optional[float], **kwargs):
+        super().__init__(**kwargs)
+        self.gap = self.silent_interval if gap is None else gap
+        self._idle_since = 0.0
+        # pymodbus checks for more response bytes every 10 to 50 ms, which adds up to most of a request at 9600 baud.
+        # A pause of the silent interval already ends a frame, and the full response is still read with the timeout.
+        # Versions without this private attribute ignore it
+        self._recv_interval = self.silent_interval
+
+    def send(self, request):
+        if request:
+            wait = self._idle_since + self.gap - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        return super().send(request)
+
+    def recv(self, size):
+        try:
+            if (_CAN_WAIT_FOR_DATA and self.socket and size is not None and size > self._in_waiting()
+                    and not self._wait_for_data()):
+                # Nothing came within the timeout, pymodbus would wait for it a second time on the read
+                return b""
+            return super().recv(size)
+        finally:
+            self._idle_since = time.monotonic()
+
+
+class _AsyncRtuClient(AsyncModbusSerialClient):
+    """
+    The asyncio counterpart of _RtuClient. A request is sent once and a missing response raises ModbusIOException,
+    pymodbus would resend it and then close the port, which on a bus takes down every other unit with the absent one.
+    """
+
+    def __init__(self, gap: Optional[float], **kwargs):
+        super().__init__(**kwargs)
+        # The async client does not compute the silent interval at all
+        char_time = 11 / self.comm_params.baudrate
+        self.gap = (0.00175 if self.comm_params.baudrate > 19200 else 3.5 * char_time) if gap is None else gap
+        self._idle_since = 0.0
+
+    async def async_execute(self, request=None):
+        wait = self._idle_since + self.gap - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            if not _CAN_SEND_ONCE:
+                return await super().async_execute(request)
+            # The RTU framer sets the transaction id to the slave id, which the response carries as well
+            return await _execute_once(self, request)
+        finally:
+            self._idle_since = time.monotonic()
+
+
+class SerialModbusGateway(ModbusGateway):
+    """
+    A Modbus RTU bus on a serial port, shared by every unit daisy-chained on it. The I/O thread already keeps a single
+    request on the line, the client adds the silent interval between the frames of every slave.
+    """
+
+    def __init__(self, config: SerialConfig, host: str, port: Optional[int] = None):
+        self._serial_config = config
+        super().__init__(host, port)
+
+    def _create_client(self):
+        return _RtuClient(gap=self._serial_config.inter_request_gap, **_serial_client_kwargs(self._serial_config))
+
+
+class AsyncSerialModbusGateway(AsyncModbusGateway):
+    """
+    The asyncio counterpart of SerialModbusGateway.
+    """
+
+    def __init__(self, config: SerialConfig, host: str, port: Optional[int] = None):
+        self._serial_config = config
+        super().__init__(host, port)
+
+    def _create_client(self):
+        return _AsyncRtuClient(gap=self._serial_config.inter_request_gap, reconnect_delay=0,
+                               **_serial_client_kwargs(self._serial_config))
+
+
+class ModbusGatewayPool:
+    def __init__(self, gateway_class=ModbusGateway):
+        self._gateway_class = gateway_class
+        self._gateways: Dict[Tuple[str, int], ModbusGateway] = {}
+
+    def get(self, host: str, port: Optional[int]):
+        key = (host, port)
+        if key not in self._gateways:
+            self._gateways[key] = self._gateway_class(host=host, port=port)
+        return self._gateways[key]
+
+    def all(self):
+        return list(self._gateways.values())
+
+    def close_all(self) -> None:
+        for gateway in self._gateways.values():
+            gateway.close()
@@ -12,9 +12,10 @@ class FanSpeed(Enum):
 
     @staticmethod
     def from_value(value: int):
-        for member in FanSpeed:
-            if member.value == value:
-                return member
-        # Handle the case where the value is not found
-        logger.error(f"Could not map integer {value} to a {FanSpeed.__name__} value.")
-        return None
+        member = _BY_VALUE.get(value)
+        if member is None:
+            logger.error("Could not map integer {} to a FanSpeed value.", value)
+        return member
+
+
+_BY_VALUE = {member.value: member for member in FanSpeed}
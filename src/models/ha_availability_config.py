@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+
+
+class HaAvailabilityConfig(BaseModel):
+    topic: str
+    payload_available: str = "Online"
+    payload_not_available: str = "Offline"
@@ -1,14 +1,18 @@
-from typing import List
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
+from models.ha_availability_config import HaAvailabilityConfig
 from models.ha_device_config import HaDeviceConfig
 from models.mqtt_fan_speed_enums import MqttFanSpeed
 
 
 class HaMqttDiscoveryConfig(BaseModel):
     name: str
-    availability_topic: str
+    # HA does not accept availability_topic together with the availability list, the list covers it.
+    availability_topic: str = Field(..., exclude=True)
+    availability: List[HaAvailabilityConfig]
+    availability_mode: str = "all"
     fan_modes: List[str] = [
         MqttFanSpeed.AUTO.value,
         MqttFanSpeed.LOW.value,
@@ -27,6 +31,11 @@ class HaMqttDiscoveryConfig(BaseModel):
     temperature_state_topic: str
     fan_mode_state_topic: str
     current_temperature_topic: str
+    # Set when the state topics carry the whole state as JSON
+    mode_state_template: Optional[str] = None
+    temperature_state_template: Optional[str] = None
+    fan_mode_state_template: Optional[str] = None
+    current_temperature_template: Optional[str] = None
     payload_available: str = "Online"
     payload_not_available: str = "Offline"
     unique_id: str
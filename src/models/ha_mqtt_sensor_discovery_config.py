@@ -0,0 +1,20 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+from models.ha_availability_config import HaAvailabilityConfig
+from models.ha_device_config import HaDeviceConfig
+
+
+class HaMqttSensorDiscoveryConfig(BaseModel):
+    name: str
+    availability_topic: str = Field(..., exclude=True)
+    availability: List[HaAvailabilityConfig]
+    availability_mode: str = "all"
+    state_topic: str
+    value_template: Optional[str] = None
+    device_class: Optional[str] = None
+    unit_of_measurement: Optional[str] = None
+    state_class: Optional[str] = None
+    unique_id: str
+    device: HaDeviceConfig
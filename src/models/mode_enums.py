@@ -12,10 +12,10 @@ class Mode(Enum):
 
     @staticmethod
     def from_value(value: int):
-        for member in Mode:
-            if member.value == value:
-                return member
-        # Handle the case where the value is not found
-        logger.error(f"Could not map integer {value} to a {Mode.__name__} value.")
-        return None
+        member = _BY_VALUE.get(value)
+        if member is None:
+            logger.error("Could not map integer {} to a Mode value.", value)
+        return member
 
+
+_BY_VALUE = {member.value: member for member in Mode}
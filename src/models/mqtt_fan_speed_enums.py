@@ -12,9 +12,10 @@ class MqttFanSpeed(Enum):
 
     @staticmethod
     def from_value(value: str):
-        for member in MqttFanSpeed:
-            if member.value == value:
-                return member
-        # Handle the case where the value is not found
-        logger.error(f"Could not map str {value} to a {MqttFanSpeed.__name__} value.")
-        return None
+        member = _BY_VALUE.get(value)
+        if member is None:
+            logger.error("Could not map str {} to a MqttFanSpeed value.", value)
+        return member
+
+
+_BY_VALUE = {member.value: member for member in MqttFanSpeed}
@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from dataclasses import dataclass
 
 
-class MqttMessage(BaseModel):
+@dataclass(slots=True)
+class MqttMessage:
     topic: str
     payload: str
     qos: int
@@ -11,3 +11,5 @@ class MqttTopics(BaseModel):
     temperature_state: str
     fan_mode_state: str
     current_temperature: str
+    # The whole state as JSON, with json_state
+    state: str
@@ -1,7 +1,8 @@
-from pydantic import BaseModel
+from dataclasses import dataclass
 
 from models.mqtt_message import MqttMessage
 
 
-class OnMessageEvent(BaseModel):
+@dataclass(slots=True)
+class OnMessageEvent:
     msg: MqttMessage
@@ -0,0 +1,12 @@
+from dataclasses import dataclass, field
+from typing import Dict
+
+
+@dataclass
+class PollCycleEvent:
+    unit_id: str
+    requests: int
+    errors: int
+    duration: float
+    # Round trip per block read, by block name
+    block_durations: Dict[str, float] = field(default_factory=dict)
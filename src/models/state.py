@@ -1,14 +1,18 @@
+from dataclasses import dataclass
 from typing import Optional
 
-from pydantic import BaseModel
-
 from models.fan_speed_enums import FanSpeed
 from models.mode_enums import Mode
 
 
-class State(BaseModel):
+# A plain dataclass rather than a pydantic model, a State is created for every change and never needs validating
+@dataclass
+class State:
     running: Optional[bool] = None
     current_temperature: Optional[float] = None
     set_temperature: Optional[float] = None
     mode: Optional[Mode] = None
     fan_speed: Optional[FanSpeed] = None
+    error_code: Optional[int] = None
+    pipe_in_temperature: Optional[float] = None
+    pipe_out_temperature: Optional[float] = None
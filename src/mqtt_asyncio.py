@@ -0,0 +1,84 @@
+import asyncio
+from typing import Callable, Optional
+
+import paho.mqtt.client as mqtt
+from loguru import logger
+
+RECONNECT_DELAY_MIN = 1
+RECONNECT_DELAY_MAX = 60
+
+
+class MqttAsyncioAdapter:
+    """
+    Drives a paho client from an asyncio event loop instead of its own network loop.
+    Reads and writes happen when the socket is ready, so no paho call ever blocks the loop waiting for the broker.
+    Connecting blocks on DNS and the TCP handshake, so it runs in the default executor. All paho callbacks run on the
+    event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client: mqtt.Client):
+        self._loop = loop
+        self._client = client
+        self._misc_task: Optional[asyncio.Task] = None
+        self._stopped = False
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def stop(self) -> None:
+        self._stopped = True
+        if self._misc_task:
+            self._misc_task.cancel()
+
+    def _call_on_loop(self, callback: Callable, *args) -> None:
+        # Connecting runs in the executor, the selector may only be changed from the loop itself
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            callback(*args)
+        else:
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call_on_loop(self._watch_socket, client, sock)
+
+    def _watch_socket(self, client: mqtt.Client, sock) -> None:
+        self._loop.add_reader(sock, client.loop_read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self._loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call_on_loop(self._unwatch_socket, sock)
+
+    def _unwatch_socket(self, sock) -> None:
+        self._loop.remove_reader(sock)
+        self._loop.remove_writer(sock)
+
+    def _on_socket_register_write(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call_on_loop(self._loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client: mqtt.Client, userdata, sock) -> None:
+        self._call_on_loop(self._loop.remove_writer, sock)
+
+    async def _misc_loop(self) -> None:
+        # Keepalive handling and reconnects, which paho's own loop would otherwise take care of
+        delay = RECONNECT_DELAY_MIN
+        while not self._stopped:
+            if self._client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                delay = RECONNECT_DELAY_MIN
+                await asyncio.sleep(1)
+                continue
+
+            await asyncio.sleep(delay)
+            if self._stopped:
+                return
+            try:
+                logger.info("MQTT   | Reconnecting")
+                await self._loop.run_in_executor(None, self._client.reconnect)
+            except Exception as e:
+                logger.error(f"MQTT   | Reconnect failed: {e}")
+                delay = min(delay * 2, RECONNECT_DELAY_MAX)
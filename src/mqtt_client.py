@@ -1,37 +1,111 @@
+import asyncio
+import hashlib
+import math
+import struct
+from threading import Lock, Timer
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
 import paho.mqtt.client as mqtt
 from loguru import logger
 
 from config import MQTTConfig
 from event_hook import EventHook
 from models.ha_mqtt_discovery_config import HaMqttDiscoveryConfig
-from models.mqtt_fan_speed_enums import MqttFanSpeed
+from models.ha_mqtt_sensor_discovery_config import HaMqttSensorDiscoveryConfig
 from models.mqtt_message import MqttMessage
-from models.mqtt_mode_enums import MqttMode
 from models.on_connect_event import OnConnectEvent
 from models.on_disconnect_event import OnDisconnectEvent
 from models.on_message_event import OnMessageEvent
+from mqtt_asyncio import MqttAsyncioAdapter
+
+PAYLOAD_AVAILABLE = "Online"
+PAYLOAD_NOT_AVAILABLE = "Offline"
+
+# The read-back of the retained discovery configs ends when none arrived for this many seconds
+DISCOVERY_READBACK_TIMEOUT = 1
+# Discovery configs are published in slices this many seconds apart
+DISCOVERY_TICK = 0.1
+
+
+def _digest(payload: bytes) -> bytes:
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def _encode_retained_publish(topic: str, payload: str) -> bytes:
+    """
+    The MQTT 3.1.1 PUBLISH packet of a retained QoS 0 message, as paho would build it.
+    """
+    topic_bytes = topic.encode()
+    payload_bytes = payload.encode()
+    remaining = 2 + len(topic_bytes) + len(payload_bytes)
+    packet = bytearray([mqtt.PUBLISH | 0x01])
+    while True:
+        byte = remaining % 128
+        remaining //= 128
+        packet.append(byte | 0x80 if remaining else byte)
+        if not remaining:
+            break
+    packet += struct.pack("!H", len(topic_bytes))
+    packet += topic_bytes
+    packet += payload_bytes
+    return bytes(packet)
+
+
+# Queueing one packet built from several messages relies on a private paho method, checked once on import
+_CAN_COALESCE = hasattr(mqtt.Client, "_packet_queue")
 
 
 class MqttClient:
-    def __init__(self, config: MQTTConfig, ha_discovery_config: HaMqttDiscoveryConfig):
+    def __init__(self, config: MQTTConfig):
         self._config = config
-        self._ha_discovery_config = ha_discovery_config
+        self._asyncio_adapter: Optional[MqttAsyncioAdapter] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Last retained payload per topic, to skip identical publishes and to restore everything after a reconnect
+        self._retained: Dict[str, Tuple[str, int]] = {}
+        self._subscriptions: Set[str] = set()
+        self._has_connected = False
+        # Discovery topic to its payload, serialised once, the digest of that payload and the QoS
+        self._discovery: Dict[str, Tuple[str, bytes, int]] = {}
+        # The digests of the retained discovery configs read back from the broker, while that is going on
+        self._discovery_readback: Optional[Dict[str, bytes]] = None
+        self._discovery_subscribe_mid: Optional[int] = None
+        self._discovery_last_readback = 0.0
+        self._discovery_pending: List[str] = []
+        # Incremented for every announcement, so the timers of an earlier one stop
+        self._discovery_generation = 0
+        self._discovery_lock = Lock()
+        # Counters for the metrics, read when scraped
+        self.connects = 0
+        self.publishes: Dict[str, int] = {}
 
         self._client = mqtt.Client()
+        self._client.max_inflight_messages_set(self._config.max_inflight)
         self._client.username_pw_set(username=self._config.username, password=self._config.password)
 
         self._client.on_connect = self._on_connect
         self._client.on_message = self._on_message
         self._client.on_disconnect = self._on_disconnect
+        self._client.on_subscribe = self._on_subscribe
 
         self.on_connected = EventHook[OnConnectEvent]()
         self.on_message = EventHook[OnMessageEvent]()
         self.on_disconnect = EventHook[OnDisconnectEvent]()
+        # Fired with the seconds from a state change to its batch reaching the socket
+        self.batch_published = EventHook[float]()
 
     def connect(self) -> None:
         host = self._config.host
         port = self._config.port
 
+        # One connection serves all units, so the last will covers the bridge as a whole.
+        self._client.will_set(
+            topic=self._config.availability_topic,
+            payload=PAYLOAD_NOT_AVAILABLE,
+            qos=self._config.qos.availability,
+            retain=True
+        )
+
         logger.info(f"MQTT   | Connecting to {host}:{port}")
         self._client.connect(
             host=host,
@@ -39,39 +113,117 @@ class MqttClient:
             keepalive=self._config.keepalive
         )
 
-    def go_online(self) -> None:
-        topics = [
-            self._ha_discovery_config.power_command_topic,
-            self._ha_discovery_config.mode_command_topic,
-            self._ha_discovery_config.temperature_command_topic,
-            self._ha_discovery_config.fan_mode_command_topic
-        ]
+    def subscribe(self, topics: List[str]) -> None:
+        """
+        Subscribe to all topics with a single SUBSCRIBE, they are restored the same way after a reconnect.
+        """
+        self._subscriptions.update(topics)
+        logger.info(f"MQTT   | Subscribing to {len(topics)} topic(s)")
+        self._client.subscribe([(topic, 0) for topic in topics])
+
+    def go_online(self, ha_discovery_configs: List[HaMqttDiscoveryConfig],
+                  sensor_discovery_configs: List[HaMqttSensorDiscoveryConfig] = ()) -> None:
+        """
+        Announce the units to Home Assistant. The discovery configs are serialised once, only those that differ from
+        the retained config on the broker are published, so a restart does not make Home Assistant reload anything.
+        """
+        qos = self._config.qos
+        for ha_discovery_config in ha_discovery_configs:
+            self._add_discovery(f"homeassistant/climate/lg-{ha_discovery_config.unique_id}/config",
+                                ha_discovery_config.model_dump_json(exclude_none=True), qos.discovery)
+        for sensor_discovery_config in sensor_discovery_configs:
+            self._add_discovery(f"homeassistant/sensor/lg-{sensor_discovery_config.unique_id}/config",
+                                sensor_discovery_config.model_dump_json(exclude_none=True), qos.discovery)
+        self._announce_discovery()
+
+        self._publish_retained(topic=self._config.availability_topic, payload=PAYLOAD_AVAILABLE, qos=qos.availability)
+
+    def _add_discovery(self, topic: str, payload: str, qos: int) -> None:
+        # With QoS 1 the broker acknowledges every config, paho holds back all beyond max_inflight until it does
+        self._discovery[topic] = (payload, _digest(payload.encode()), qos)
+
+    def _announce_discovery(self) -> None:
+        # Read back the retained configs first, the broker sends them right after acknowledging the subscription
+        if not self._discovery:
+            return
+        with self._discovery_lock:
+            self._discovery_generation += 1
+            self._discovery_readback = {}
+            self._discovery_pending = []
+        logger.info(f"MQTT   | Reading back {len(self._discovery)} retained discovery config(s)")
+        _, self._discovery_subscribe_mid = self._client.subscribe([(topic, 0) for topic in self._discovery])
+
+    def _on_subscribe(self, client: mqtt.Client, userdata, mid: int, granted_qos) -> None:
+        if mid == self._discovery_subscribe_mid:
+            self._discovery_last_readback = monotonic()
+            self._call_later(DISCOVERY_READBACK_TIMEOUT, self._check_discovery_readback, self._discovery_generation)
+
+    def _check_discovery_readback(self, generation: int) -> None:
+        # A broker with many retained topics may take a while, wait as long as the configs keep coming
+        idle = monotonic() - self._discovery_last_readback
+        if idle < DISCOVERY_READBACK_TIMEOUT:
+            self._call_later(DISCOVERY_READBACK_TIMEOUT - idle, self._check_discovery_readback, generation)
+        else:
+            self._finish_discovery_readback(generation)
+
+    def _on_discovery_readback(self, topic: str, payload: bytes) -> None:
+        with self._discovery_lock:
+            readback = self._discovery_readback
+            if readback is None:
+                # Our own publishes, or a late message after the read-back ended
+                return
+            readback[topic] = _digest(payload)
+            self._discovery_last_readback = monotonic()
+            complete = len(readback) == len(self._discovery)
+            generation = self._discovery_generation
+        if complete:
+            self._finish_discovery_readback(generation)
 
+    def _finish_discovery_readback(self, generation: int) -> None:
+        with self._discovery_lock:
+            if generation != self._discovery_generation or self._discovery_readback is None:
+                return
+            readback = self._discovery_readback
+            self._discovery_readback = None
+            self._discovery_pending = [topic for topic, (_, digest, _) in self._discovery.items()
+                                       if readback.get(topic) != digest]
+            pending = len(self._discovery_pending)
+        self._client.unsubscribe(list(self._discovery))
+        if not pending:
+            logger.info(f"MQTT   | All {len(self._discovery)} discovery config(s) are up to date")
+            return
+        logger.info(f"MQTT   | Publishing {pending} of {len(self._discovery)} discovery config(s), new or changed, "
+                    f"at {self._config.discovery_rate:g}/s")
+        self._publish_discovery_slice(generation)
+
+    def _publish_discovery_slice(self, generation: int) -> None:
+        with self._discovery_lock:
+            if generation != self._discovery_generation:
+                return
+            count = math.ceil(self._config.discovery_rate * DISCOVERY_TICK)
+            topics = self._discovery_pending[:count]
+            del self._discovery_pending[:count]
+            more = bool(self._discovery_pending)
         for topic in topics:
-            self._client.subscribe(topic=topic, qos=0)
+            payload, _, qos = self._discovery[topic]
+            self._publish(topic, payload, qos)
+        if more:
+            self._call_later(DISCOVERY_TICK, self._publish_discovery_slice, generation)
 
-        self._client.will_set(
-            topic=self._ha_discovery_config.availability_topic,
-            payload=self._ha_discovery_config.payload_not_available,
-            retain=True
-        )
-        self._client.publish(
-            topic=f"homeassistant/climate/lg-{self._ha_discovery_config.unique_id}/config",
-            payload=self._ha_discovery_config.model_dump_json(),
-            retain=True
-        )
-        self._client.publish(
-            topic=self._ha_discovery_config.availability_topic,
-            payload=self._ha_discovery_config.payload_available,
-            retain=True
-        )
+    def _call_later(self, delay: float, function: Callable, *args) -> None:
+        if self._loop is not None:
+            # Called from the paho callbacks, which run on the event loop
+            self._loop.call_later(delay, function, *args)
+            return
+        timer = Timer(interval=delay, function=function, args=args)
+        timer.daemon = True
+        timer.start()
 
-    def go_offline(self) -> None:
-        self._client.publish(
-            topic=self._ha_discovery_config.availability_topic,
-            payload=self._ha_discovery_config.payload_not_available,
-            retain=True
-        )
+    def go_offline(self, ha_discovery_configs: List[HaMqttDiscoveryConfig]) -> None:
+        for ha_discovery_config in ha_discovery_configs:
+            self.publish_availability(ha_discovery_config, available=False)
+        self._publish_retained(topic=self._config.availability_topic, payload=PAYLOAD_NOT_AVAILABLE,
+                               qos=self._config.qos.availability)
 
     def loop_forever(self, timeout=1.0, max_packets=1, retry_first_connection=False) -> None:
         logger.info("MQTT   | Starting loop")
@@ -79,44 +231,86 @@ class MqttClient:
                                   retry_first_connection=retry_first_connection)
         logger.info("MQTT   | Loop has ended")
 
-    def publish_mode(self, mode: MqttMode) -> None:
-        logger.debug(f"MQTT   | Publishing mode {mode} to HA")
-        self._client.publish(
-            topic=self._ha_discovery_config.mode_state_topic,
-            payload=mode.value,
-            qos=0,
-            retain=True
-        )
+    def attach_to_event_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Used instead of loop_forever by the asyncio runtime, must be called before connecting
+        logger.info("MQTT   | Running on the asyncio event loop")
+        self._loop = loop
+        self._asyncio_adapter = MqttAsyncioAdapter(loop=loop, client=self._client)
 
-    def publish_temperature_state(self, set_temperature: float) -> None:
-        logger.debug(f"MQTT   | Publishing set temperature {set_temperature} to HA")
-        self._client.publish(
-            topic=self._ha_discovery_config.temperature_state_topic,
-            payload=str(set_temperature),
-            qos=0,
-            retain=True
-        )
+    async def connect_async(self) -> None:
+        """
+        connect for the asyncio runtime, the blocking part runs off the event loop.
+        """
+        await self._loop.run_in_executor(None, self.connect)
 
-    def publish_current_temperature_state(self, current_temperature: float) -> None:
-        logger.debug(f"MQTT   | Publishing current temperature {current_temperature} to HA")
-        self._client.publish(
-            topic=self._ha_discovery_config.current_temperature_topic,
-            payload=str(current_temperature),
-            qos=0,
-            retain=True
+    def publish_availability(self, ha_discovery_config: HaMqttDiscoveryConfig, available: bool) -> None:
+        self._publish_retained(
+            topic=ha_discovery_config.availability_topic,
+            payload=ha_discovery_config.payload_available if available else ha_discovery_config.payload_not_available,
+            qos=self._config.qos.availability
         )
 
-    def publish_fan_speed(self, fan_speed: MqttFanSpeed) -> None:
-        logger.debug(f"MQTT   | Publishing fan speed {fan_speed} to HA")
-        self._client.publish(
-            topic=self._ha_discovery_config.fan_mode_state_topic,
-            payload=fan_speed.value,
-            qos=0,
-            retain=True
-        )
+    def publish_batch(self, messages: List[MqttMessage], since: Optional[float] = None) -> None:
+        """
+        Publish the retained messages of one state change, skipping payloads that are already on the broker.
+        The QoS 0 messages go out together as one write to the socket, the others through paho one by one,
+        as it has to track their acknowledgement.
+        `since` is the perf_counter() of the change, batch_published is fired with the time it took.
+        """
+        messages = [message for message in messages
+                    if self._retained.get(message.topic, (None,))[0] != message.payload]
+        if not messages:
+            return
+        logger.opt(lazy=True).debug("MQTT   | Publishing {}",
+                                    lambda: ", ".join(f"{m.topic} {m.payload}" for m in messages))
+        coalesced = []
+        for message in messages:
+            self._retained[message.topic] = (message.payload, message.qos)
+            if message.qos == 0 and _CAN_COALESCE:
+                coalesced.append(message)
+            else:
+                self._publish(message.topic, message.payload, message.qos)
+        if len(coalesced) == 1:
+            self._publish(coalesced[0].topic, coalesced[0].payload)
+        elif coalesced:
+            self._publish_coalesced(coalesced)
+        if since is not None:
+            self.batch_published.fire(perf_counter() - since)
+
+    def republish_all(self) -> None:
+        logger.info(f"MQTT   | Restoring {len(self._subscriptions)} subscription(s) and "
+                    f"{len(self._retained)} retained topic(s)")
+        if self._subscriptions:
+            self._client.subscribe([(topic, 0) for topic in self._subscriptions])
+        for topic, (payload, qos) in list(self._retained.items()):
+            self._publish(topic, payload, qos)
+
+    def _publish_retained(self, topic: str, payload: str, qos: int = 0) -> None:
+        retained = self._retained.get(topic)
+        if retained is not None and retained[0] == payload:
+            return
+        self._retained[topic] = (payload, qos)
+        self._publish(topic, payload, qos)
+
+    def _publish(self, topic: str, payload: str, qos: int = 0) -> None:
+        self.publishes[topic] = self.publishes.get(topic, 0) + 1
+        self._client.publish(topic=topic, payload=payload, qos=qos, retain=True)
+
+    def _publish_coalesced(self, messages: List[MqttMessage]) -> None:
+        if not self._client.is_connected():
+            # Dropped like paho drops a QoS 0 publish without a connection, the reconnect republishes them
+            return
+        for message in messages:
+            self.publishes[message.topic] = self.publishes.get(message.topic, 0) + 1
+        packet = b"".join(_encode_retained_publish(message.topic, message.payload) for message in messages)
+        # Queued as a single packet, paho sends it with one write, or one writer callback on the event loop.
+        # QoS 0 has no message id, 0 is only what on_publish would be called with
+        self._client._packet_queue(mqtt.PUBLISH, packet, 0, 0, mqtt.MQTTMessageInfo(0))
 
     def exit(self) -> None:
         logger.info('MQTT   | Stopping loop.')
+        if self._asyncio_adapter:
+            self._asyncio_adapter.stop()
         self._client.loop_stop(True)
         logger.info('MQTT   | Disconnecting.')
         self._client.disconnect()
@@ -124,19 +318,26 @@ class MqttClient:
     def _on_connect(self, client: mqtt.Client, userdata, flags, rc: int) -> None:
         if rc == 0:
             logger.info("MQTT   | Connected!")
+            self.connects += 1
+            if self._has_connected:
+                # The broker may have lost our subscriptions and retained state, e.g. after a restart
+                self.republish_all()
+                self._announce_discovery()
+            self._has_connected = True
             self.on_connected.fire(OnConnectEvent(flags=flags))
         else:
             logger.error("MQTT   | Could not connect to Server")
 
     def _on_message(self, client: mqtt.Client, userdata, msg) -> None:
-        logger.debug(
-            f"MQTT   | Received message | Topic: {msg.topic} | qos: {msg.qos}  | retain: {msg.retain} | Payload: {msg.payload}")
-        self.on_message.fire(OnMessageEvent(msg=MqttMessage(
-            topic=msg.topic,
-            payload=msg.payload,
-            qos=msg.qos,
-            retain=msg.retain
-        )))
+        # Formatted only when debug logging is on
+        logger.debug("MQTT   | Received message | Topic: {} | qos: {}  | retain: {} | Payload: {}",
+                     msg.topic, msg.qos, msg.retain, msg.payload)
+        if msg.topic in self._discovery:
+            if msg.retain and msg.payload:
+                self._on_discovery_readback(msg.topic, msg.payload)
+            return
+        self.on_message.fire(OnMessageEvent(MqttMessage(msg.topic, msg.payload.decode(errors="replace"), msg.qos,
+                                                        msg.retain)))
 
     def _on_disconnect(self, client: mqtt.Client, userdata, rc: int) -> None:
         logger.info(f"MQTT   | Disconnected with result code {rc}")
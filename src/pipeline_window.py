@@ -0,0 +1,68 @@
+from time import monotonic
+from typing import Optional
+
+# Completed requests per probe, enough to average out the jitter of single requests
+PROBE_REQUESTS = 20
+# A larger window is only kept when it raises the throughput by this share
+MIN_GAIN = 0.1
+# Seconds before a settled window is probed again, the gateway or the network may have changed
+REPROBE_AFTER = 300
+
+
+class PipelineWindow:
+    """
+    How many requests a gateway gets in flight on its connection at once, probed between 1 and `limit`.
+
+    The window starts at 1 and grows by one as long as that raises the throughput, measured with Little's law as
+    the requests in flight over their duration. A gateway that answers one request at a time takes longer per request
+    as the window grows, so the window stays small. Probes only count while the window was the limit, not while
+    there was too little to do to fill it. A failed request halves the window.
+    """
+
+    def __init__(self, limit: int, clock=monotonic):
+        self.limit = limit
+        self.size = 1
+        self._clock = clock
+        self._last_throughput: Optional[float] = None
+        self._settled_until = 0.0
+        self._start_probe()
+
+    def _start_probe(self) -> None:
+        self._requests = 0
+        self._full = 0
+        self._in_flight = 0
+        self._duration = 0.0
+
+    def record(self, in_flight: int, duration: float, failed: bool = False) -> None:
+        """
+        A completed request. `in_flight` is the number of requests that were running when it started, itself included.
+        """
+        if failed:
+            self.size = max(1, self.size // 2)
+            self._settle()
+            return
+
+        self._requests += 1
+        self._full += in_flight >= self.size
+        self._in_flight += in_flight
+        self._duration += duration
+        if self._requests < PROBE_REQUESTS:
+            return
+
+        full = self._full * 2 >= self._requests
+        throughput = self._in_flight / self._duration if self._duration > 0 else 0
+        self._start_probe()
+        if not full or self.size >= self.limit or self._clock() < self._settled_until:
+            return
+        if self._last_throughput is not None and throughput < self._last_throughput * (1 + MIN_GAIN):
+            # The last step did not pay off
+            self.size -= 1
+            self._settle()
+            return
+        self._last_throughput = throughput
+        self.size += 1
+
+    def _settle(self) -> None:
+        self._last_throughput = None
+        self._settled_until = self._clock() + REPROBE_AFTER
+        self._start_probe()
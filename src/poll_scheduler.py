@@ -0,0 +1,100 @@
+from time import monotonic
+from typing import Iterable, Mapping, Optional
+
+from config import ModbusConfig
+
+
+class PollScheduler:
+    """
+    Fixed rate schedule on the monotonic clock. Tick n is due at start + phase + n * interval, no matter how long
+    the polls take, so the period does not drift. The first tick is due right away, apart from the phase. Ticks
+    that passed while a poll was still running are skipped instead of being caught up, and counted as overruns.
+    """
+
+    def __init__(self, interval: float, phase: float = 0, clock=monotonic):
+        self._interval = interval
+        self._clock = clock
+        self._next_tick = clock() + phase
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped_ticks = 0
+
+    @property
+    def interval(self) -> float:
+        return self._interval
+
+    def set_interval(self, interval: float) -> None:
+        """
+        Change the interval, the next tick moves to one new interval after the last one, or now if that already passed.
+        """
+        last_tick = self._next_tick - self._interval
+        self._interval = interval
+        self._next_tick = max(self._clock(), last_tick + interval)
+
+    def time_until_next_tick(self) -> float:
+        return max(0.0, self._next_tick - self._clock())
+
+    def advance(self) -> int:
+        """
+        Move on to the next tick that is still in the future, returns the number of ticks that were skipped.
+        """
+        self.ticks += 1
+        self._next_tick += self._interval
+        now = self._clock()
+        if now < self._next_tick:
+            return 0
+
+        skipped = int((now - self._next_tick) // self._interval) + 1
+        self._next_tick += skipped * self._interval
+        self.overruns += 1
+        self.skipped_ticks += skipped
+        return skipped
+
+
+class AdaptivePollInterval:
+    """
+    Picks the poll interval of a unit from its activity. For `boost_duration` after a command, or after a change
+    of a writable register, e.g. from the remote control, it polls at `min_poll_interval`. When the unit is off or
+    nothing changed for `idle_after`, it slows down to `max_poll_interval`. Otherwise it polls at `poll_interval`.
+    """
+
+    def __init__(self, config: ModbusConfig, control_fields: Iterable[str], clock=monotonic):
+        self._interval = config.poll_interval
+        self._min_interval = config.min_poll_interval or config.poll_interval
+        self._max_interval = config.max_poll_interval or config.poll_interval
+        self._idle_after = config.idle_after
+        self._boost_duration = config.boost_duration
+        self._control_fields = frozenset(control_fields)
+        self._clock = clock
+        self._last_change = clock()
+        self._boost_until = 0.0
+        self._running: Optional[bool] = None
+        # The first poll fills the state from scratch, that is no activity
+        self._primed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self._min_interval != self._interval or self._max_interval != self._interval
+
+    def boost(self) -> None:
+        now = self._clock()
+        self._last_change = now
+        self._boost_until = now + self._boost_duration
+
+    def record(self, changes: Optional[Mapping[str, object]], running: Optional[bool]) -> None:
+        self._running = running
+        if not changes:
+            return
+        now = self._clock()
+        self._last_change = now
+        if self._primed and not self._control_fields.isdisjoint(changes):
+            self._boost_until = now + self._boost_duration
+        self._primed = True
+
+    def current(self) -> float:
+        now = self._clock()
+        if now < self._boost_until:
+            return self._min_interval
+        if self._running is False or now - self._last_change >= self._idle_after:
+            return self._max_interval
+        return self._interval
@@ -0,0 +1,50 @@
+from collections import deque
+from time import monotonic
+from typing import Optional
+
+from config import PublishFilterConfig
+
+
+class PublishFilter:
+    """
+    Decides when a new value of a noisy field is worth publishing.
+
+    Values can be smoothed with a moving average first. A value is published when it moved at least `threshold`
+    away from the last published value and `min_interval` seconds passed since. A value that moved less than the
+    threshold is still published once the last published value is `max_staleness` seconds old.
+    """
+
+    def __init__(self, config: PublishFilterConfig, clock=monotonic):
+        self._threshold = config.threshold
+        self._min_interval = config.min_interval
+        self._max_staleness = config.max_staleness
+        self._window = deque(maxlen=config.smoothing) if config.smoothing > 1 else None
+        self._clock = clock
+        self._published_at = 0.0
+
+    def offer(self, value, published) -> Optional[object]:
+        """
+        Offer a polled value, returns the value to publish or None to hold it back.
+        """
+        if self._window is not None:
+            self._window.append(value)
+            value = round(sum(self._window) / len(self._window), 2)
+
+        now = self._clock()
+        if published is None:
+            return self._publish(value, now)
+        if value == published:
+            return None
+
+        elapsed = now - self._published_at
+        if self._max_staleness is not None and elapsed >= self._max_staleness:
+            return self._publish(value, now)
+        if elapsed < self._min_interval:
+            return None
+        if self._threshold and abs(value - published) < self._threshold:
+            return None
+        return self._publish(value, now)
+
+    def _publish(self, value, now: float):
+        self._published_at = now
+        return value
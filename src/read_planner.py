@@ -0,0 +1,118 @@
+import math
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple
+
+from register_map import RegisterDefinition, RegisterTable, compile_decoder
+from state_service import FIELD_INDEX
+
+# Protocol limits for a single read request
+MAX_BITS_PER_READ = 2000
+MAX_REGISTERS_PER_READ = 125
+
+# Name of the pymodbus client method reading each table, the same for the sync and the async client
+READ_METHODS = {
+    RegisterTable.COIL: "read_coils",
+    RegisterTable.DISCRETE_INPUT: "read_discrete_inputs",
+    RegisterTable.INPUT_REGISTER: "read_input_registers",
+    RegisterTable.HOLDING_REGISTER: "read_holding_registers",
+}
+
+
+class ReadBlock:
+    """
+    One read request covering a contiguous address range of a single table.
+    `registers` holds every definition in the range together with its offset from `address`.
+    `read` is the read method of `client` bound once, None without a client.
+    """
+
+    def __init__(self, table: RegisterTable, address: int, count: int,
+                 registers: List[Tuple[RegisterDefinition, int]], client=None):
+        self.table = table
+        self.address = address
+        self.count = count
+        self.registers = registers
+        self.read_method = READ_METHODS[table]
+        self.read: Optional[Callable] = getattr(client, self.read_method) if client is not None else None
+        self.name = f"{table.value}:{address}-{address + count - 1}"
+        self._is_bit = table.is_bit
+        self._decoders = [(FIELD_INDEX[definition.field], offset, compile_decoder(definition))
+                          for definition, offset in registers]
+
+    def decode_into(self, rr, values: List) -> None:
+        """
+        Decode the response into `values`, which has a slot per state field in STATE_FIELDS order.
+        """
+        raw = rr.bits if self._is_bit else rr.registers
+        for index, offset, decode in self._decoders:
+            values[index] = decode(raw[offset])
+
+    def __repr__(self) -> str:
+        return f"ReadBlock({self.table.value}, address={self.address}, count={self.count})"
+
+
+def plan_reads(definitions: List[RegisterDefinition], max_gap: int, client=None) -> List[ReadBlock]:
+    """
+    Merge the definitions into as few block reads as possible, reading with `client`.
+    Two addresses of the same table end up in one block when at most `max_gap` unused addresses sit between them
+    and the block stays within the protocol limit.
+    """
+    by_table: Dict[RegisterTable, List[RegisterDefinition]] = {}
+    for definition in definitions:
+        by_table.setdefault(definition.table, []).append(definition)
+
+    blocks = []
+    for table in RegisterTable:
+        table_definitions = sorted(by_table.get(table, []), key=lambda d: d.address)
+        max_count = MAX_BITS_PER_READ if table.is_bit else MAX_REGISTERS_PER_READ
+
+        current = []
+        for definition in table_definitions:
+            if current:
+                start = current[0].address
+                end = current[-1].address
+                gap = definition.address - end - 1
+                if gap > max_gap or definition.address - start + 1 > max_count:
+                    blocks.append(_to_block(table, current, client))
+                    current = []
+            current.append(definition)
+        if current:
+            blocks.append(_to_block(table, current, client))
+
+    return blocks
+
+
+def _to_block(table: RegisterTable, definitions: List[RegisterDefinition], client) -> ReadBlock:
+    start = definitions[0].address
+    count = definitions[-1].address - start + 1
+    return ReadBlock(
+        table=table,
+        address=start,
+        count=count,
+        registers=[(definition, definition.address - start) for definition in definitions],
+        client=client
+    )
+
+
+class TieredReadPlan:
+    """
+    The block reads of every poll cycle, when fields are read at different rates. Cycle 0 reads every field, cycle n
+    the fields whose `poll_every` divides n. The plans repeat, so they are all made up front.
+    """
+
+    def __init__(self, definitions: List[RegisterDefinition], max_gap: int, client=None):
+        self._full_plan = plan_reads(definitions, max_gap=max_gap, client=client)
+        self._period = math.lcm(*(definition.poll_every for definition in definitions if definition.poll_every))
+        # Cycles that read the same fields share one plan
+        plans: Dict[FrozenSet[str], List[ReadBlock]] = {}
+        self._cycle_plans: List[List[ReadBlock]] = []
+        for cycle in range(self._period):
+            cycle_definitions = [definition for definition in definitions
+                                 if definition.poll_every and cycle % definition.poll_every == 0]
+            key = frozenset(definition.field for definition in cycle_definitions)
+            if key not in plans:
+                plans[key] = plan_reads(cycle_definitions, max_gap=max_gap, client=client)
+            self._cycle_plans.append(plans[key])
+
+    def blocks(self, cycle: int) -> List[ReadBlock]:
+        if cycle == 0:
+            return self._full_plan
+        return self._cycle_plans[cycle % self._period]
@@ -0,0 +1,97 @@
+from enum import Enum
+from typing import Callable, Dict, List, NamedTuple, Optional, Type
+
+import yaml
+
+from config import RegisterMapConfig, SensorConfig
+from models.fan_speed_enums import FanSpeed
+from models.mode_enums import Mode
+from state_service import FIELD_INDEX
+
+# Enums a register map can refer to by name
+ENUMS: Dict[str, Type[Enum]] = {
+    "Mode": Mode,
+    "FanSpeed": FanSpeed,
+}
+
+
+class RegisterTable(Enum):
+    COIL = "coil"
+    DISCRETE_INPUT = "discrete_input"
+    INPUT_REGISTER = "input_register"
+    HOLDING_REGISTER = "holding_register"
+
+    @property
+    def is_bit(self) -> bool:
+        return self in (RegisterTable.COIL, RegisterTable.DISCRETE_INPUT)
+
+    @property
+    def is_writable(self) -> bool:
+        return self in (RegisterTable.COIL, RegisterTable.HOLDING_REGISTER)
+
+
+class RegisterDefinition(NamedTuple):
+    field: str
+    table: RegisterTable
+    address: int
+    # Raw register values are divided by the scale, e.g. 215 with scale 10 is 21.5 degrees
+    scale: int = 1
+    enum: Optional[Type[Enum]] = None
+    # Read on every Nth poll cycle, 0 reads it only on the first cycle and after a write to it
+    poll_every: int = 1
+    sensor: Optional[SensorConfig] = None
+
+
+def load_register_map(path: str) -> List[RegisterDefinition]:
+    with open(path, 'r') as f:
+        register_map = RegisterMapConfig(**yaml.safe_load(f))
+
+    definitions = []
+    for register in register_map.registers:
+        if register.field not in FIELD_INDEX:
+            raise ValueError(f"Register map {path}: '{register.field}' is not a state field")
+        if register.enum is not None and register.enum not in ENUMS:
+            raise ValueError(f"Register map {path}: unknown enum '{register.enum}' for '{register.field}'")
+        definitions.append(RegisterDefinition(
+            field=register.field,
+            table=RegisterTable(register.table),
+            address=register.address,
+            scale=register.scale,
+            enum=ENUMS.get(register.enum),
+            poll_every=register.poll_every,
+            sensor=register.sensor
+        ))
+
+    fields = [definition.field for definition in definitions]
+    if len(fields) != len(set(fields)):
+        raise ValueError(f"Register map {path}: every field can only be mapped once")
+    return definitions
+
+
+def compile_decoder(definition: RegisterDefinition) -> Callable:
+    """
+    The conversion from a raw bit or register value to the state value, decided once instead of on every read.
+    """
+    if definition.table.is_bit:
+        return bool
+    if definition.enum is not None:
+        return definition.enum.from_value
+    if definition.scale != 1:
+        scale = definition.scale
+        return lambda raw: raw / scale
+    return int
+
+
+def decode_raw(definition: RegisterDefinition, value):
+    return compile_decoder(definition)(value)
+
+
+def encode_value(definition: RegisterDefinition, value) -> object:
+    """
+    The raw value to write for a state value.
+    """
+    if definition.table.is_bit:
+        return bool(value)
+    if definition.enum is not None:
+        return value.value
+    return int(round(value * definition.scale))
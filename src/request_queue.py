@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+from concurrent.futures import Future
+from itertools import count
+from threading import Condition
+from typing import Callable, Collection, Dict, Hashable, List, Optional
+
+# Lower runs first: commands ahead of the read-backs that confirm them, both ahead of polls
+PRIORITY_WRITE = 0
+PRIORITY_READ_BACK = 1
+PRIORITY_POLL = 2
+
+# More than one poll per slave id on a bus, so polls are only dropped when the gateway really falls behind
+REQUEST_QUEUE_SIZE = 256
+
+
+class RequestDropped(Exception):
+    """
+    The request was superseded by a newer one with the same key, dropped to make room or the gateway was closed.
+    """
+
+
+class Request:
+    __slots__ = ("priority", "sequence", "function", "key", "future", "slave", "dropped")
+
+    def __init__(self, priority: int, sequence: int, function: Callable, key: Optional[Hashable], future,
+                 slave: Optional[int] = None):
+        self.priority = priority
+        self.sequence = sequence
+        self.function = function
+        self.key = key
+        self.future = future
+        self.slave = slave
+        self.dropped = False
+
+    def __lt__(self, other: 'Request') -> bool:
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class _RequestHeap:
+    """
+    The bookkeeping shared by both queues. Dropped requests stay in the heap, marked, until they are popped.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._heap: List[Request] = []
+        self._size = 0
+        self._sequence = count()
+        self._queued_by_key: Dict[Hashable, Request] = {}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _push(self, request: Request) -> None:
+        if request.key is not None:
+            superseded = self._queued_by_key.get(request.key)
+            if superseded is not None:
+                self._drop(superseded, "superseded")
+            self._queued_by_key[request.key] = request
+        heapq.heappush(self._heap, request)
+        self._size += 1
+
+    def _pop(self, busy_slaves: Collection[int] = ()) -> Optional[Request]:
+        """
+        The next request, skipping the ones for a slave in `busy_slaves`.
+        """
+        skipped = []
+        found = None
+        while self._heap:
+            request = heapq.heappop(self._heap)
+            if request.dropped:
+                continue
+            if request.slave is not None and request.slave in busy_slaves:
+                skipped.append(request)
+                continue
+            found = request
+            break
+        for request in skipped:
+            heapq.heappush(self._heap, request)
+        if found is not None:
+            self._size -= 1
+            if found.key is not None and self._queued_by_key.get(found.key) is found:
+                del self._queued_by_key[found.key]
+        return found
+
+    def _make_room(self) -> bool:
+        """
+        Drop the oldest queued poll when the queue is full, returns False if there is none and the caller must wait.
+        """
+        if self._size < self.maxsize:
+            return True
+        polls = [request for request in self._heap if not request.dropped and request.priority >= PRIORITY_POLL]
+        if not polls:
+            return False
+        self._drop(min(polls, key=lambda request: request.sequence), "dropped, the queue is full")
+        return True
+
+    def _drop(self, request: Request, reason: str) -> None:
+        request.dropped = True
+        self._size -= 1
+        self.dropped += 1
+        if request.key is not None and self._queued_by_key.get(request.key) is request:
+            del self._queued_by_key[request.key]
+        if not request.future.done():
+            request.future.set_exception(RequestDropped(reason))
+
+    def _drop_all(self) -> None:
+        for request in self._heap:
+            if not request.dropped:
+                self._drop(request, "the gateway is closed")
+        self._heap = []
+
+
+class RequestQueue(_RequestHeap):
+    """
+    The requests waiting for one gateway, taken by its I/O thread. Highest priority first and in order of arrival
+    within a priority. When the queue is full the oldest poll makes room, writes wait for a free slot instead.
+    """
+
+    def __init__(self, maxsize: int = REQUEST_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self._condition = Condition()
+        self._closed = False
+
+    def put(self, priority: int, function: Callable, key: Optional[Hashable] = None) -> Future:
+        future = Future()
+        with self._condition:
+            while not self._closed and not self._make_room():
+                self._condition.wait()
+            if self._closed:
+                future.set_exception(RequestDropped("the gateway is closed"))
+                return future
+            self._push(Request(priority, next(self._sequence), function, key, future))
+            self._condition.notify_all()
+        return future
+
+    def get(self) -> Optional[Request]:
+        """
+        Wait for the next request, None once the queue is closed.
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                request = self._pop()
+                if request is not None:
+                    self._condition.notify_all()
+                    return request
+                self._condition.wait()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._drop_all()
+            self._condition.notify_all()
+
+
+class AsyncRequestQueue(_RequestHeap):
+    """
+    The asyncio counterpart of RequestQueue, the functions are coroutine functions.
+    """
+
+    def __init__(self, maxsize: int = REQUEST_QUEUE_SIZE):
+        super().__init__(maxsize)
+        self._changed = asyncio.Event()
+
+    async def put(self, priority: int, function: Callable, key: Optional[Hashable] = None,
+                  slave: Optional[int] = None) -> asyncio.Future:
+        while not self._make_room():
+            self._changed.clear()
+            await self._changed.wait()
+        future = asyncio.get_running_loop().create_future()
+        self._push(Request(priority, next(self._sequence), function, key, future, slave))
+        self._changed.set()
+        return future
+
+    async def get(self, busy_slaves: Collection[int] = ()) -> Request:
+        """
+        The next request for a slave that is not in `busy_slaves`. Call `notify` when that set shrinks.
+        """
+        while True:
+            request = self._pop(busy_slaves)
+            if request is not None:
+                self._changed.set()
+                return request
+            self._changed.clear()
+            await self._changed.wait()
+
+    def notify(self) -> None:
+        self._changed.set()
+
+    def close(self) -> None:
+        self._drop_all()
+        self._changed.set()
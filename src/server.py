@@ -1,211 +1,524 @@
+import asyncio
+import json
+import os
 import signal
 import sys
-from time import sleep
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
 
 from loguru import logger
 
-from config import load_config, load_version
+from config import Config, UnitConfig, load_config, load_version
 from modbus_client import ModbusClient
+from modbus_gateway import (AsyncModbusGateway, AsyncSerialModbusGateway, ModbusGateway, ModbusGatewayPool,
+                            SerialModbusGateway)
 from models.fan_speed_enums import FanSpeed
+from models.ha_availability_config import HaAvailabilityConfig
 from models.ha_device_config import HaDeviceConfig
 from models.ha_mqtt_discovery_config import HaMqttDiscoveryConfig
+from models.ha_mqtt_sensor_discovery_config import HaMqttSensorDiscoveryConfig
 from models.mode_enums import Mode
 from models.mqtt_fan_speed_enums import MqttFanSpeed
+from models.mqtt_message import MqttMessage
 from models.mqtt_mode_enums import MqttMode
 from models.mqtt_topcis import MqttTopics
 from models.on_message_event import OnMessageEvent
+from models.poll_cycle_event import PollCycleEvent
 from models.state import State
 from mqtt_client import MqttClient
+from register_map import load_register_map
+from startup_profile import StartupProfile
+from state_history import StateHistory
 from state_service import StateService
+from unit import Unit
+
+# The modes and fan speeds of the unit and their Home Assistant counterparts
+MODES = {
+    MqttMode.AUTO: Mode.AUTO,
+    MqttMode.COOL: Mode.COOL,
+    MqttMode.HEAT: Mode.HEATING,
+    MqttMode.DRY: Mode.DRY,
+    MqttMode.FAN_ONLY: Mode.FAN_ONLY,
+}
+MQTT_MODES = {mode: mqtt_mode for mqtt_mode, mode in MODES.items()}
+
+FAN_SPEEDS = {
+    MqttFanSpeed.AUTO: FanSpeed.AUTO,
+    MqttFanSpeed.LOW: FanSpeed.LOW,
+    MqttFanSpeed.MEDIUM: FanSpeed.MIDDLE,
+    MqttFanSpeed.HIGH: FanSpeed.HIGH,
+    MqttFanSpeed.UNKNOWN: FanSpeed.UNKNOWN,
+}
+MQTT_FAN_SPEEDS = {fan_speed: mqtt_fan_speed for mqtt_fan_speed, fan_speed in FAN_SPEEDS.items()}
 
 
 class Server:
-    def __init__(self):
+    def __init__(self, config: Optional[Config] = None, profile: Optional[StartupProfile] = None):
         logger.info("Server | Setup server")
-        self._config = load_config()
-        self._version = load_version()
-        self._topics = self._get_mqtt_topics()
-        self._ha_discovery_config = self._get_ha_discovery_config()
-
-        self._state_service = StateService()
-        self._mqtt_client = MqttClient(
-            config=self._config.mqtt,
-            ha_discovery_config=self._ha_discovery_config
-        )
-        self._modbus_client = ModbusClient(config=self._config.modbus, state_service=self._state_service)
+        self._profile = profile or StartupProfile(enabled=False)
+        with self._profile.phase("load config"):
+            self._config = config or load_config()
+            self._version = load_version()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+        with self._profile.phase("load register map"):
+            self._register_map = load_register_map(self._config.register_map)
+
+        self._asyncio_runtime = self._config.runtime == "asyncio"
+        rtu = self._config.modbus.transport == "rtu"
+        if self._asyncio_runtime:
+            # Only imported by the runtime that uses it
+            from async_modbus_client import AsyncModbusClient
+            self._modbus_client_class = AsyncModbusClient
+            if rtu:
+                gateway_class = partial(AsyncSerialModbusGateway, self._config.modbus.serial)
+            else:
+                gateway_class = partial(AsyncModbusGateway, pipeline_window=self._config.modbus.pipeline_window,
+                                        timeout=self._config.modbus.timeout)
+        else:
+            self._modbus_client_class = ModbusClient
+            if rtu:
+                gateway_class = partial(SerialModbusGateway, self._config.modbus.serial)
+            else:
+                gateway_class = partial(ModbusGateway, timeout=self._config.modbus.timeout)
+        self._gateway_pool = ModbusGatewayPool(gateway_class)
+        self._mqtt_client = MqttClient(config=self._config.mqtt)
+
+        self._units: Dict[str, Unit] = {}
+        # Command topic to the unit and the handler, so a message is dispatched with a single lookup
+        self._command_handlers: Dict[str, Tuple[Unit, Callable[[Unit, str], None]]] = {}
+        with self._profile.phase(f"create {len(self._config.units)} unit(s)"):
+            for unit_config in self._config.units:
+                unit = self._create_unit(unit_config, phase=self._get_poll_phase(unit_config))
+                self._units[unit.id] = unit
+                self._command_handlers[unit.topics.power_command] = (unit, self._on_power_command)
+                self._command_handlers[unit.topics.mode_command] = (unit, self._on_mode_command)
+                self._command_handlers[unit.topics.temperature_command] = (unit, self._on_temperature_command)
+                self._command_handlers[unit.topics.fan_mode_command] = (unit, self._on_fan_mode_command)
+
+        logger.info(f"Server | Bridging {len(self._units)} unit(s) over {len(self._gateway_pool.all())} gateway(s)")
+
+        # By host and port, metrics and history share a server when they are configured on the same port
+        self._http_servers = {}
+        if self._config.metrics.enabled:
+            from bridge_metrics import BridgeMetrics
+            metrics = BridgeMetrics(units=self.units, gateways=self._gateway_pool.all(), mqtt_client=self._mqtt_client)
+            metrics_config = self._config.metrics
+            self._get_http_server(metrics_config.host, metrics_config.port).add_route("/metrics", metrics.serve)
+        if self._config.history.enabled:
+            from history_api import HistoryApi
+            with self._profile.phase("open history"):
+                for unit in self._units.values():
+                    self._enable_history(unit)
+            history_config = self._config.history
+            history_api = HistoryApi(units=self.units)
+            self._get_http_server(history_config.host, history_config.port).add_route("/history", history_api.serve)
 
         self._mqtt_client.on_message.add_handler(self._on_mqtt_message)
 
-        self._state_service.state_changed.add_handler(self._on_state_changed)
+        # Units are only marked available while their gateway is reachable
+        self._mqtt_online = False
+        for gateway in self._gateway_pool.all():
+            gateway.availability_changed.add_handler(partial(self._on_gateway_availability_changed, gateway))
+
+    @property
+    def units(self) -> List[Unit]:
+        return list(self._units.values())
+
+    def _get_http_server(self, host: str, port: int):
+        from http_server import LocalHttpServer
+        if (host, port) not in self._http_servers:
+            self._http_servers[(host, port)] = LocalHttpServer(host=host, port=port)
+        return self._http_servers[(host, port)]
+
+    def _enable_history(self, unit: Unit) -> None:
+        history_config = self._config.history
+        path = os.path.join(history_config.path, f"{unit.id}.history") if history_config.path else None
+        unit.history = StateHistory(capacity=history_config.size, path=path)
+        unit.modbus_client.poll_completed.add_handler(partial(self._on_poll_completed, unit))
+
+    def _on_poll_completed(self, unit: Unit, event: PollCycleEvent) -> None:
+        # A poll where every request failed has nothing new to record
+        if event.errors < event.requests:
+            unit.history.record(time.time(), unit.state_service.raw_snapshot())
+
+    def _close_local_services(self) -> None:
+        for http_server in self._http_servers.values():
+            http_server.stop()
+        for unit in self._units.values():
+            if unit.history is not None:
+                unit.history.close()
+
+    def _get_poll_phase(self, unit_config: UnitConfig) -> float:
+        if not self._config.modbus.spread_polls:
+            return 0
+        gateway_units = [unit for unit in self._config.units
+                         if (unit.host, unit.port) == (unit_config.host, unit_config.port)]
+        return self._config.modbus.poll_interval * gateway_units.index(unit_config) / len(gateway_units)
+
+    def _create_unit(self, unit_config: UnitConfig, phase: float = 0) -> Unit:
+        topics = self._get_mqtt_topics(unit_config)
+        state_service = StateService(publish_filters=self._config.publish_filters)
+        modbus_client = self._modbus_client_class(
+            config=self._config.modbus,
+            unit=unit_config,
+            gateway=self._gateway_pool.get(unit_config.host, unit_config.port),
+            state_service=state_service,
+            register_map=self._register_map,
+            phase=phase
+        )
+        unit = Unit(
+            config=unit_config,
+            topics=topics,
+            ha_discovery_config=self._get_ha_discovery_config(unit_config, topics),
+            state_service=state_service,
+            modbus_client=modbus_client,
+            sensors=self._get_sensor_discovery_configs(unit_config, topics)
+        )
+        state_service.state_changed.add_handler(partial(self._on_state_changed, unit))
+        modbus_client.health.availability_changed.add_handler(partial(self._on_unit_availability_changed, unit))
+        return unit
 
     def start(self) -> None:
         logger.info("Server | Startup server")
+        for http_server in self._http_servers.values():
+            http_server.start()
+        if self._asyncio_runtime:
+            asyncio.run(self._run_async())
+            return
+
+        # MQTT first, the first poll starts right away and its state is published as soon as it is read
+        with self._profile.phase("connect mqtt"):
+            self._mqtt_client.connect()
         try:
-            self._modbus_client.connect()
+            with self._profile.phase("connect modbus"):
+                for unit in self._units.values():
+                    unit.modbus_client.connect()
         except Exception as e:
             logger.error(e)
             self.stop()
-        self._mqtt_client.connect()
-        self._mqtt_client.go_online()
+        self._go_online()
         self._mqtt_client.loop_forever()
 
+        # The loop only ends on its own after request_stop
+        for unit in self._units.values():
+            unit.modbus_client.disconnect()
+        self._gateway_pool.close_all()
+        self._close_local_services()
+
+    def request_stop(self) -> None:
+        # Can be called from any thread, start() returns once the server has shut down
+        if self._asyncio_runtime:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        else:
+            self._go_offline()
+            self._mqtt_client.exit()
+
     def stop(self, signum=None, frame=None) -> None:
         logger.info(f"Server | Shutting down")
+        self._go_offline()
         self._mqtt_client.exit()
-        self._modbus_client.disconnect()
+        for unit in self._units.values():
+            unit.modbus_client.disconnect()
+        self._gateway_pool.close_all()
+        self._close_local_services()
 
         logger.info(f"Server | Done. Bye!")
         sys.exit(0)
 
-    def _on_state_changed(self, changes: State) -> None:
-        if changes.running is False:
-            self._mqtt_client.publish_mode(MqttMode.OFF)
-        if changes.running is True:
-            current_state = self._state_service.get_state()
-            mode = current_state.mode
-            self._publish_mode_state(mode)
+    async def _run_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop_event = asyncio.Event()
+        self._loop = loop
+        self._stop_event = stop_event
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        self._mqtt_client.attach_to_event_loop(loop)
+        with self._profile.phase("connect mqtt"):
+            await self._mqtt_client.connect_async()
+        try:
+            with self._profile.phase("connect modbus"):
+                for unit in self._units.values():
+                    await unit.modbus_client.connect()
+        except Exception as e:
+            logger.error(e)
+            stop_event.set()
+
+        if not stop_event.is_set():
+            self._go_online()
+            await stop_event.wait()
+
+        logger.info(f"Server | Shutting down")
+        self._go_offline()
+        self._mqtt_client.exit()
+        for unit in self._units.values():
+            await unit.modbus_client.disconnect()
+        self._gateway_pool.close_all()
+        self._close_local_services()
+        logger.info(f"Server | Done. Bye!")
 
-        if changes.running is None and changes.mode:
-            self._publish_mode_state(changes.mode)
+    def _go_online(self) -> None:
+        with self._profile.phase("publish discovery"):
+            self._mqtt_client.subscribe(self._get_command_subscriptions())
+            self._mqtt_client.go_online(
+                [unit.ha_discovery_config for unit in self._units.values()],
+                [sensor for unit in self._units.values() for sensor in unit.sensors.values()]
+            )
+            self._mqtt_online = True
+            for unit in self._units.values():
+                self._publish_unit_availability(unit)
+        self._profile.online.set()
+
+    def _go_offline(self) -> None:
+        # A clean disconnect does not send the last will, so the units and the bridge are marked offline before it
+        if not self._mqtt_online:
+            return
+        self._mqtt_online = False
+        self._mqtt_client.go_offline([unit.ha_discovery_config for unit in self._units.values()])
+
+    def _on_gateway_availability_changed(self, gateway, available: bool) -> None:
+        units = [unit for unit in self._units.values() if self._get_gateway(unit) is gateway]
+        logger.info(f"Server | {gateway.name} is {'up' if available else 'down'}, marking "
+                    f"{', '.join(unit.id for unit in units)} {'available' if available else 'unavailable'}")
+        if not self._mqtt_online:
+            # Published by _go_online
+            return
+        for unit in units:
+            self._publish_unit_availability(unit)
+
+    def _on_unit_availability_changed(self, unit: Unit, available: bool) -> None:
+        if self._mqtt_online:
+            self._publish_unit_availability(unit)
+
+    def _publish_unit_availability(self, unit: Unit) -> None:
+        # A unit whose circuit is open is unavailable, even if its gateway is up
+        available = self._get_gateway(unit).available and unit.modbus_client.health.available
+        self._mqtt_client.publish_availability(unit.ha_discovery_config, available=available)
+
+    def _get_gateway(self, unit: Unit):
+        return self._gateway_pool.get(unit.config.host, unit.config.port)
+
+    def _on_state_changed(self, unit: Unit, changes: State) -> None:
+        self._publish_changes(unit, changes, since=unit.state_service.last_merge)
+
+    def _publish_changes(self, unit: Unit, changes: State, since: Optional[float] = None) -> None:
+        # Everything a poll cycle or a command changed goes out in one batch
+        if self._config.mqtt.json_state:
+            messages = [self._get_json_state_message(unit)]
+        else:
+            messages = self._get_state_messages(unit, changes)
+        self._mqtt_client.publish_batch(messages, since=since)
+
+    def _get_state_messages(self, unit: Unit, changes: State) -> List[MqttMessage]:
+        qos = self._config.mqtt.qos
+        topics = unit.topics
+        messages = []
+        if changes.running is False:
+            messages.append(MqttMessage(topics.mode_state, MqttMode.OFF.value, qos.state, True))
+        elif changes.running is True or changes.mode:
+            mqtt_mode = MQTT_MODES.get(changes.mode or unit.state_service.get_value("mode"))
+            if mqtt_mode is not None:
+                messages.append(MqttMessage(topics.mode_state, mqtt_mode.value, qos.state, True))
 
         if changes.set_temperature:
-            self._mqtt_client.publish_temperature_state(changes.set_temperature)
+            messages.append(MqttMessage(topics.temperature_state, str(changes.set_temperature), qos.state, True))
 
         if changes.current_temperature:
-            self._mqtt_client.publish_current_temperature_state(changes.current_temperature)
+            messages.append(MqttMessage(topics.current_temperature, str(changes.current_temperature), qos.state,
+                                        True))
 
         if changes.fan_speed:
-            self._publish_fan_speed_state(changes.fan_speed)
-
-    def _publish_mode_state(self, mode) -> None:
-        if mode == Mode.AUTO:
-            self._mqtt_client.publish_mode(MqttMode.AUTO)
-        if mode == Mode.COOL:
-            self._mqtt_client.publish_mode(MqttMode.COOL)
-        if mode == Mode.DRY:
-            self._mqtt_client.publish_mode(MqttMode.DRY)
-        if mode == Mode.FAN_ONLY:
-            self._mqtt_client.publish_mode(MqttMode.FAN_ONLY)
-        if mode == Mode.HEATING:
-            self._mqtt_client.publish_mode(MqttMode.HEAT)
-
-    def _publish_fan_speed_state(self, fan_speed: FanSpeed) -> None:
-        if fan_speed == FanSpeed.AUTO:
-            self._mqtt_client.publish_fan_speed(MqttFanSpeed.AUTO)
-        if fan_speed == FanSpeed.LOW:
-            self._mqtt_client.publish_fan_speed(MqttFanSpeed.LOW)
-        if fan_speed == FanSpeed.MIDDLE:
-            self._mqtt_client.publish_fan_speed(MqttFanSpeed.MEDIUM)
-        if fan_speed == FanSpeed.HIGH:
-            self._mqtt_client.publish_fan_speed(MqttFanSpeed.HIGH)
-        if fan_speed == FanSpeed.UNKNOWN:
-            self._mqtt_client.publish_fan_speed(MqttFanSpeed.UNKNOWN)
+            mqtt_fan_speed = MQTT_FAN_SPEEDS.get(changes.fan_speed)
+            if mqtt_fan_speed is not None:
+                messages.append(MqttMessage(topics.fan_mode_state, mqtt_fan_speed.value, qos.state, True))
+
+        for field, sensor in unit.sensors.items():
+            value = getattr(changes, field)
+            if value is not None:
+                messages.append(MqttMessage(sensor.state_topic, str(value), qos.sensor, True))
+        return messages
+
+    def _get_json_state_message(self, unit: Unit) -> MqttMessage:
+        state_service = unit.state_service
+        if state_service.get_value("running") is False:
+            mqtt_mode = MqttMode.OFF
+        else:
+            mqtt_mode = MQTT_MODES.get(state_service.get_value("mode"))
+        mqtt_fan_speed = MQTT_FAN_SPEEDS.get(state_service.get_value("fan_speed"))
+        state = {
+            "mode": mqtt_mode.value if mqtt_mode is not None else None,
+            "temperature": state_service.get_value("set_temperature"),
+            "fan_mode": mqtt_fan_speed.value if mqtt_fan_speed is not None else None,
+            "current_temperature": state_service.get_value("current_temperature"),
+        }
+        for field in unit.sensors:
+            state[field] = state_service.get_value(field)
+        payload = json.dumps({key: value for key, value in state.items() if value is not None}, separators=(",", ":"))
+        return MqttMessage(unit.topics.state, payload, self._config.mqtt.qos.state, True)
 
     def _on_mqtt_message(self, event: OnMessageEvent) -> None:
         topic = event.msg.topic
-        payload = event.msg.payload
+        command = self._command_handlers.get(topic)
+        if command is None:
+            logger.warning("Server | Received message on unknown topic {}", topic)
+            return
 
-        if topic == self._ha_discovery_config.power_command_topic:
-            command = str(payload)
-            if command == "ON":
-                self._modbus_client.write_operate(value=True)
-            elif command == "OFF":
-                self._modbus_client.write_operate(value=False)
-                self._mqtt_client.publish_mode(mode=MqttMode.OFF)
+        unit, handler = command
+        unit.modbus_client.boost_polling()
+        handler(unit, event.msg.payload)
 
-        elif topic == self._ha_discovery_config.temperature_command_topic:
+    def _on_power_command(self, unit: Unit, payload: str) -> None:
+        if payload == "ON":
+            unit.modbus_client.write_operate(value=True)
+        elif payload == "OFF":
+            unit.modbus_client.write_operate(value=False)
+            self._publish_changes(unit, State(running=False))
+
+    def _on_temperature_command(self, unit: Unit, payload: str) -> None:
+        try:
             command = float(payload)
-            self._modbus_client.set_temperature(value=command)
-            self._mqtt_client.publish_temperature_state(set_temperature=command)
-
-        elif topic == self._ha_discovery_config.mode_command_topic:
-            command = MqttMode.from_value(str(payload))
-            if command == MqttMode.OFF:
-                self._modbus_client.write_operate(value=False)
-                self._mqtt_client.publish_mode(mode=command)
-            else:
-                self._modbus_client.write_operate(value=True)
-                self._mqtt_client.publish_mode(mode=command)
-                # If you set mode too quick, the mode the unit was in previously might prevail.
-                sleep(3)
-                self._modbus_set_mode(command)
-
-        elif topic == self._ha_discovery_config.fan_mode_command_topic:
-            logger.debug("Processing fan speed change from HA")
-            command = MqttFanSpeed.from_value(str(payload))
-            if command == MqttFanSpeed.AUTO:
-                self._modbus_client.set_fan_speed(value=FanSpeed.AUTO)
-            elif command == MqttFanSpeed.LOW:
-                self._modbus_client.set_fan_speed(value=FanSpeed.LOW)
-            elif command == MqttFanSpeed.MEDIUM:
-                self._modbus_client.set_fan_speed(value=FanSpeed.MIDDLE)
-            elif command == MqttFanSpeed.HIGH:
-                self._modbus_client.set_fan_speed(value=FanSpeed.HIGH)
-            elif command == MqttFanSpeed.UNKNOWN:
-                self._modbus_client.set_fan_speed(value=FanSpeed.UNKNOWN)
-            self._mqtt_client.publish_fan_speed(fan_speed=command)
-
-    def _modbus_set_mode(self, command) -> None:
-        if command == MqttMode.AUTO:
-            self._modbus_client.set_mode(value=Mode.AUTO)
-        elif command == MqttMode.COOL:
-            self._modbus_client.set_mode(value=Mode.COOL)
-        elif command == MqttMode.HEAT:
-            self._modbus_client.set_mode(value=Mode.HEATING)
-        elif command == MqttMode.DRY:
-            self._modbus_client.set_mode(value=Mode.DRY)
-        elif command == MqttMode.FAN_ONLY:
-            self._modbus_client.set_mode(value=Mode.FAN_ONLY)
-
-    def _get_mqtt_topics(self) -> MqttTopics:
-        unique_id = self._config.id
+        except ValueError:
+            logger.error("Server | {} | Invalid temperature {}", unit.id, payload)
+            return
+        unit.modbus_client.set_temperature(value=command)
+        self._publish_changes(unit, State(set_temperature=command))
+
+    def _on_mode_command(self, unit: Unit, payload: str) -> None:
+        command = MqttMode.from_value(payload)
+        if command is None:
+            return
+        if command == MqttMode.OFF:
+            unit.modbus_client.write_operate(value=False)
+        else:
+            # If you set mode too quick, the mode the unit was in previously might prevail.
+            # It is queued first, so the state already holds the new mode when the unit is switched on.
+            unit.modbus_client.set_mode(value=MODES[command], delay=3)
+            unit.modbus_client.write_operate(value=True)
+        if command == MqttMode.OFF:
+            self._publish_changes(unit, State(running=False))
+        else:
+            self._publish_changes(unit, State(running=True, mode=MODES[command]))
+
+    def _on_fan_mode_command(self, unit: Unit, payload: str) -> None:
+        logger.debug("Server | {} | Processing fan speed change from HA", unit.id)
+        command = MqttFanSpeed.from_value(payload)
+        if command is None:
+            return
+        unit.modbus_client.set_fan_speed(value=FAN_SPEEDS[command])
+        self._publish_changes(unit, State(fan_speed=FAN_SPEEDS[command]))
+
+    def _get_command_subscriptions(self) -> List[str]:
+        topic_prefix = self._config.mqtt.topic_prefix
+        if topic_prefix is not None:
+            # The dispatch table tells the unit and the command apart, whatever the number of units
+            return [f"{topic_prefix}/+/command/+"]
+        return list(self._command_handlers)
+
+    def _get_unit_topic_base(self, unit_config: UnitConfig) -> str:
+        topic_prefix = self._config.mqtt.topic_prefix
+        return unit_config.id if topic_prefix is None else f"{topic_prefix}/{unit_config.id}"
+
+    def _get_mqtt_topics(self, unit_config: UnitConfig) -> MqttTopics:
+        base = self._get_unit_topic_base(unit_config)
         return MqttTopics(
-            availability=f"{unique_id}/availability",
-            power_command=f"{unique_id}/command/power",
-            mode_command=f"{unique_id}/command/mode",
-            temperature_command=f"{unique_id}/command/temperature",
-            fan_mode_command=f"{unique_id}/command/fan-mode",
-            mode_state=f"{unique_id}/state/mode",
-            temperature_state=f"{unique_id}/state/temperature",
-            fan_mode_state=f"{unique_id}/state/fan-mode",
-            current_temperature=f"{unique_id}/current-temperature"
+            availability=f"{base}/availability",
+            power_command=f"{base}/command/power",
+            mode_command=f"{base}/command/mode",
+            temperature_command=f"{base}/command/temperature",
+            fan_mode_command=f"{base}/command/fan-mode",
+            mode_state=f"{base}/state/mode",
+            temperature_state=f"{base}/state/temperature",
+            fan_mode_state=f"{base}/state/fan-mode",
+            current_temperature=f"{base}/current-temperature",
+            state=f"{base}/state"
         )
 
-    def _get_ha_discovery_config(self) -> HaMqttDiscoveryConfig:
-        topics = self._topics
-        config = self._config
+    def _get_ha_discovery_config(self, unit_config: UnitConfig, topics: MqttTopics) -> HaMqttDiscoveryConfig:
+        state_topics = dict(
+            mode_state_topic=topics.mode_state,
+            temperature_state_topic=topics.temperature_state,
+            fan_mode_state_topic=topics.fan_mode_state,
+            current_temperature_topic=topics.current_temperature
+        )
+        if self._config.mqtt.json_state:
+            # Every state is read from the one JSON topic
+            state_topics = dict(
+                mode_state_topic=topics.state,
+                mode_state_template="{{ value_json.mode }}",
+                temperature_state_topic=topics.state,
+                temperature_state_template="{{ value_json.temperature }}",
+                fan_mode_state_topic=topics.state,
+                fan_mode_state_template="{{ value_json.fan_mode }}",
+                current_temperature_topic=topics.state,
+                current_temperature_template="{{ value_json.current_temperature }}"
+            )
         return HaMqttDiscoveryConfig(
-            name=config.name,
+            name=unit_config.name,
             availability_topic=topics.availability,
+            availability=[
+                HaAvailabilityConfig(topic=topics.availability),
+                HaAvailabilityConfig(topic=self._config.mqtt.availability_topic)
+            ],
             power_command_topic=topics.power_command,
             mode_command_topic=topics.mode_command,
             temperature_command_topic=topics.temperature_command,
             fan_mode_command_topic=topics.fan_mode_command,
-            mode_state_topic=topics.mode_state,
-            temperature_state_topic=topics.temperature_state,
-            fan_mode_state_topic=topics.fan_mode_state,
-            current_temperature_topic=topics.current_temperature,
-            unique_id=config.id,
-            device=HaDeviceConfig(
-                identifiers=[f"lg-{config.id}"],
-                model=config.model,
-                name=f"LG",
-                sw_version=self._version
+            **state_topics,
+            unique_id=unit_config.id,
+            device=self._get_ha_device_config(unit_config)
+        )
+
+    def _get_sensor_discovery_configs(self, unit_config: UnitConfig,
+                                      topics: MqttTopics) -> Dict[str, HaMqttSensorDiscoveryConfig]:
+        sensors = {}
+        for definition in self._register_map:
+            if definition.sensor is None:
+                continue
+            slug = definition.field.replace("_", "-")
+            if self._config.mqtt.json_state:
+                state = dict(state_topic=topics.state, value_template=f"{{{{ value_json.{definition.field} }}}}")
+            else:
+                state = dict(state_topic=f"{self._get_unit_topic_base(unit_config)}/sensor/{slug}")
+            sensors[definition.field] = HaMqttSensorDiscoveryConfig(
+                name=definition.sensor.name,
+                availability_topic=topics.availability,
+                availability=[
+                    HaAvailabilityConfig(topic=topics.availability),
+                    HaAvailabilityConfig(topic=self._config.mqtt.availability_topic)
+                ],
+                **state,
+                device_class=definition.sensor.device_class,
+                unit_of_measurement=definition.sensor.unit_of_measurement,
+                state_class=definition.sensor.state_class,
+                unique_id=f"{unit_config.id}-{slug}",
+                device=self._get_ha_device_config(unit_config)
             )
+        return sensors
+
+    def _get_ha_device_config(self, unit_config: UnitConfig) -> HaDeviceConfig:
+        return HaDeviceConfig(
+            identifiers=[f"lg-{unit_config.id}"],
+            model=unit_config.model,
+            name=f"LG",
+            sw_version=self._version
         )
 
 
-logger.configure(handlers=[{"sink": sys.stdout, "format": "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
-                                                          "<level>{level: <8}</level> | "
-                                                          "<level>{message}</level>"}])
+if __name__ == '__main__':
+    logger.configure(handlers=[{"sink": sys.stdout, "format": "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+                                                              "<level>{level: <8}</level> | "
+                                                              "<level>{message}</level>"}])
 
-logger.info("Welcome to lg-airco-modbus-mqtt!")
-server = Server()
-try:
-    server.start()
-except KeyboardInterrupt:
-    logger.warning("Server | Interrupt received, stopping server...")
-    server.stop()
+    logger.info("Welcome to lg-airco-modbus-mqtt!")
+    server = Server()
+    try:
+        server.start()
+    except KeyboardInterrupt:
+        logger.warning("Server | Interrupt received, stopping server...")
+        server.stop()
 
-signal.signal(signal.SIGINT, server.stop)
-signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    signal.signal(signal.SIGTERM, server.stop)
@@ -0,0 +1,79 @@
+"""
+Run simulated PDRYCB500 gateways, and optionally an MQTT broker, to try the bridge without hardware.
+
+    python src/simulate.py --units 4 --modbus-port 5020 --mqtt-port 1883
+
+Point the modbus section of the config at the printed address, with slave ids 1 up to the number of units.
+With --rtu the units are on a simulated RTU bus instead, point modbus.serial.port at the printed pseudo terminal.
+"""
+import argparse
+import asyncio
+import sys
+
+from loguru import logger
+
+from simulator import MqttBroker, Pdrycb500Simulator, RtuBusSimulator
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="PDRYCB500 Modbus simulator")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--modbus-port", type=int, default=5020,
+                        help="port of the first gateway, further gateways use the next ports")
+    parser.add_argument("--units", type=int, default=1, help="number of units per gateway")
+    parser.add_argument("--gateways", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests answered with an exception")
+    parser.add_argument("--drop-rate", type=float, default=0, help="share of requests left unanswered")
+    parser.add_argument("--apply-delay", type=float, default=0,
+                        help="seconds before a written value shows up in the registers")
+    parser.add_argument("--concurrent", action="store_true",
+                        help="process requests on one connection in parallel, answering out of order")
+    parser.add_argument("--rtu", action="store_true",
+                        help="put the units on a Modbus RTU bus behind a pseudo terminal instead of TCP gateways")
+    parser.add_argument("--baudrate", type=int, default=9600, help="baud rate of the RTU bus")
+    parser.add_argument("--mqtt-port", type=int, default=None, help="also run an MQTT broker on this port")
+    return parser.parse_args()
+
+
+async def run(args) -> None:
+    servers = []
+    if args.mqtt_port is not None:
+        servers.append(MqttBroker(host=args.host, port=args.mqtt_port))
+    if args.rtu:
+        servers.append(RtuBusSimulator(
+            slaves=range(1, args.units + 1),
+            baudrate=args.baudrate,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            apply_delay=args.apply_delay
+        ))
+    for gateway in range(0 if args.rtu else args.gateways):
+        servers.append(Pdrycb500Simulator(
+            slaves=range(1, args.units + 1),
+            host=args.host,
+            port=args.modbus_port + gateway,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            drop_rate=args.drop_rate,
+            concurrent=args.concurrent,
+            apply_delay=args.apply_delay
+        ))
+
+    for server in servers:
+        await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for server in servers:
+            await server.stop()
+
+
+if __name__ == '__main__':
+    logger.configure(handlers=[{"sink": sys.stdout, "format": "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | "
+                                                              "<level>{level: <8}</level> | "
+                                                              "<level>{message}</level>"}])
+    try:
+        asyncio.run(run(parse_args()))
+    except KeyboardInterrupt:
+        logger.info("Sim    | Stopped")
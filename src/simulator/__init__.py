@@ -0,0 +1,3 @@
+from simulator.mqtt_broker import MqttBroker
+from simulator.pdrycb500 import Pdrycb500Simulator, SimulatedUnit
+from simulator.rtu_bus import RtuBusSimulator
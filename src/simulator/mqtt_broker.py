@@ -0,0 +1,223 @@
+import asyncio
+import struct
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+PUBREC = 5
+PUBREL = 6
+PUBCOMP = 7
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels = topic_filter.split("/")
+    topic_levels = topic.split("/")
+    for index, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if index >= len(topic_levels):
+            return False
+        if level != "+" and level != topic_levels[index]:
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length: int) -> bytes:
+    encoded = bytearray()
+    while True:
+        byte = length % 128
+        length //= 128
+        if length:
+            byte |= 0x80
+        encoded.append(byte)
+        if not length:
+            return bytes(encoded)
+
+
+def _encode_string(value: bytes) -> bytes:
+    return struct.pack("!H", len(value)) + value
+
+
+def _packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([(packet_type << 4) | flags]) + _encode_length(len(body)) + body
+
+
+class _Session:
+    def __init__(self, broker: 'MqttBroker', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.broker = broker
+        self.reader = reader
+        self.writer = writer
+        self.client_id = ""
+        self.subscriptions: Dict[str, int] = {}
+        self.will: Optional[Tuple[str, bytes, int, bool]] = None
+        self.next_packet_id = 1
+
+    def send(self, data: bytes) -> None:
+        self.broker.packets_out += 1
+        self.writer.write(data)
+
+    def deliver(self, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        body = _encode_string(topic.encode())
+        flags = (qos << 1) | (1 if retain else 0)
+        if qos:
+            body += struct.pack("!H", self.next_packet_id)
+            self.next_packet_id = self.next_packet_id % 65535 + 1
+        self.send(_packet(PUBLISH, flags, body + payload))
+
+    async def run(self) -> None:
+        clean = False
+        try:
+            while True:
+                header = await self.reader.readexactly(1)
+                length = 0
+                multiplier = 1
+                while True:
+                    byte = (await self.reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await self.reader.readexactly(length) if length else b""
+                packet_type = header[0] >> 4
+                if packet_type == DISCONNECT:
+                    clean = True
+                    return
+                self._handle(packet_type, header[0] & 0x0F, body)
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.broker.sessions.discard(self)
+            if not clean and self.will:
+                self.broker.route(*self.will)
+            self.writer.close()
+
+    def _handle(self, packet_type: int, flags: int, body: bytes) -> None:
+        self.broker.packets_in += 1
+        if packet_type == CONNECT:
+            self._handle_connect(body)
+        elif packet_type == PUBLISH:
+            qos = (flags >> 1) & 0x03
+            retain = bool(flags & 0x01)
+            topic_length = struct.unpack("!H", body[:2])[0]
+            topic = body[2:2 + topic_length].decode()
+            position = 2 + topic_length
+            if qos:
+                packet_id = body[position:position + 2]
+                position += 2
+                self.send(_packet(PUBACK if qos == 1 else PUBREC, 0, packet_id))
+            self.broker.route(topic, body[position:], qos, retain)
+        elif packet_type == PUBREL:
+            self.send(_packet(PUBCOMP, 0, body[:2]))
+        elif packet_type == SUBSCRIBE:
+            packet_id = body[:2]
+            position = 2
+            granted = bytearray()
+            new_filters = []
+            while position < len(body):
+                length = struct.unpack("!H", body[position:position + 2])[0]
+                topic_filter = body[position + 2:position + 2 + length].decode()
+                qos = min(body[position + 2 + length], 1)
+                position += 3 + length
+                self.subscriptions[topic_filter] = qos
+                granted.append(qos)
+                new_filters.append(topic_filter)
+            self.send(_packet(SUBACK, 0, packet_id + bytes(granted)))
+            # Plain topics are looked up, only wildcard filters are matched against every retained topic
+            wildcards = [topic_filter for topic_filter in new_filters if "+" in topic_filter or "#" in topic_filter]
+            if wildcards:
+                for topic, (payload, qos) in list(self.broker.retained.items()):
+                    if any(topic_matches(topic_filter, topic) for topic_filter in new_filters):
+                        self.deliver(topic, payload, 0, True)
+            else:
+                for topic in new_filters:
+                    if topic in self.broker.retained:
+                        self.deliver(topic, self.broker.retained[topic][0], 0, True)
+        elif packet_type == UNSUBSCRIBE:
+            position = 2
+            while position < len(body):
+                length = struct.unpack("!H", body[position:position + 2])[0]
+                self.subscriptions.pop(body[position + 2:position + 2 + length].decode(), None)
+                position += 2 + length
+            self.send(_packet(UNSUBACK, 0, body[:2]))
+        elif packet_type == PINGREQ:
+            self.send(_packet(PINGRESP, 0, b""))
+
+    def _handle_connect(self, body: bytes) -> None:
+        position = 2 + struct.unpack("!H", body[:2])[0]
+        connect_flags = body[position + 1]
+        position += 4
+        length = struct.unpack("!H", body[position:position + 2])[0]
+        self.client_id = body[position + 2:position + 2 + length].decode()
+        position += 2 + length
+        if connect_flags & 0x04:
+            length = struct.unpack("!H", body[position:position + 2])[0]
+            will_topic = body[position + 2:position + 2 + length].decode()
+            position += 2 + length
+            length = struct.unpack("!H", body[position:position + 2])[0]
+            will_payload = body[position + 2:position + 2 + length]
+            self.will = (will_topic, will_payload, (connect_flags >> 3) & 0x03, bool(connect_flags & 0x20))
+        self.send(_packet(CONNACK, 0, b"\x00\x00"))
+
+
+class MqttBroker:
+    """
+    A minimal in-process MQTT 3.1.1 broker, good enough to run the bridge against in benchmarks.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.sessions: Set[_Session] = set()
+        self.retained: Dict[str, Tuple[bytes, int]] = {}
+        self.messages = 0
+        self.packets_in = 0
+        self.packets_out = 0
+        self.listeners: List = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._on_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Broker | Listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        for session in list(self.sessions):
+            session.writer.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        self.route(topic, payload, 0, retain)
+
+    def route(self, topic: str, payload: bytes, qos: int, retain: bool) -> None:
+        self.messages += 1
+        if retain:
+            if payload:
+                self.retained[topic] = (payload, qos)
+            else:
+                self.retained.pop(topic, None)
+        for listener in self.listeners:
+            listener(topic, payload)
+        for session in list(self.sessions):
+            granted = [subscription_qos for topic_filter, subscription_qos in session.subscriptions.items()
+                       if topic_matches(topic_filter, topic)]
+            if granted:
+                session.deliver(topic, payload, min(qos, max(granted)), False)
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = _Session(self, reader, writer)
+        self.sessions.add(session)
+        await session.run()
@@ -0,0 +1,196 @@
+import asyncio
+import random
+import struct
+from typing import Dict, Iterable, Optional, Set
+
+from loguru import logger
+
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+SLAVE_DEVICE_FAILURE = 0x04
+
+COIL_COUNT = 16
+DISCRETE_INPUT_COUNT = 16
+INPUT_REGISTER_COUNT = 16
+HOLDING_REGISTER_COUNT = 32
+
+
+class SimulatedUnit:
+    """
+    Register layout of one LG indoor unit behind a PDRYCB500, as read and written by the bridge.
+    """
+
+    def __init__(self, slave: int, apply_delay: float = 0):
+        self.slave = slave
+        self.apply_delay = apply_delay
+        self.coils = [False] * COIL_COUNT
+        self.discrete_inputs = [False] * DISCRETE_INPUT_COUNT
+        self.input_registers = [0] * INPUT_REGISTER_COUNT
+        self.holding_registers = [0] * HOLDING_REGISTER_COUNT
+
+        self.holding_registers[0] = 0    # run mode: cool
+        self.holding_registers[1] = 220  # set temperature 22.0
+        self.holding_registers[14] = 4   # fan speed: auto
+        self.input_registers[2] = 250    # room temperature 25.0
+        self.input_registers[3] = 180    # pipe in temperature
+        self.input_registers[4] = 200    # pipe out temperature
+
+    def tick(self) -> None:
+        # Let the room temperature drift towards the set temperature, with some sensor jitter
+        room = self.input_registers[2]
+        target = self.holding_registers[1] if self.coils[0] else 250
+        room += (target > room) - (target < room)
+        self.input_registers[2] = room + random.choice((-1, 0, 0, 0, 1))
+
+    def write_coil(self, address: int, value: bool) -> None:
+        self._apply(self.coils, address, value)
+
+    def write_register(self, address: int, value: int) -> None:
+        self._apply(self.holding_registers, address, value)
+
+    def _apply(self, table, address: int, value) -> None:
+        if self.apply_delay:
+            asyncio.get_running_loop().call_later(self.apply_delay, table.__setitem__, address, value)
+        else:
+            table[address] = value
+
+
+class Pdrycb500Simulator:
+    """
+    A Modbus TCP server answering like a PDRYCB500 gateway with any number of slave ids.
+
+    `latency` is added to every request and `error_rate` / `drop_rate` make a share of the requests fail
+    with a slave device failure or time out without an answer. With `concurrent` set, requests on one connection
+    are processed in parallel and may be answered out of order, otherwise they are answered one after the other
+    like a gateway in front of a serial bus.
+    """
+
+    def __init__(self, slaves: Iterable[int], host: str = "127.0.0.1", port: int = 0, latency: float = 0,
+                 error_rate: float = 0, drop_rate: float = 0, concurrent: bool = False, apply_delay: float = 0,
+                 dead_slaves: Iterable[int] = ()):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.concurrent = concurrent
+        self.units: Dict[int, SimulatedUnit] = {slave: SimulatedUnit(slave, apply_delay) for slave in slaves}
+        self.dead_slaves = set(dead_slaves)
+        self.requests = 0
+        self.connections = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tick_task: Optional[asyncio.Task] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._on_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._tick_task = asyncio.get_running_loop().create_task(self._tick())
+        logger.info(f"Sim    | PDRYCB500 simulator with {len(self.units)} unit(s) on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._tick_task:
+            self._tick_task.cancel()
+        for writer in list(self._writers):
+            writer.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(5)
+            for unit in self.units.values():
+                unit.tick()
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        self._writers.add(writer)
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                transaction_id, protocol_id, length, slave = struct.unpack("!HHHB", header)
+                pdu = await reader.readexactly(length - 1)
+                task = asyncio.get_running_loop().create_task(
+                    self._answer(writer, transaction_id, slave, pdu))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if not self.concurrent:
+                    await task
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _answer(self, writer: asyncio.StreamWriter, transaction_id: int, slave: int, pdu: bytes) -> None:
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5) if self.concurrent else self.latency)
+
+        unit = self.units.get(slave)
+        if unit is None or slave in self.dead_slaves or random.random() < self.drop_rate:
+            return
+        if random.random() < self.error_rate:
+            response = bytes([pdu[0] | 0x80, SLAVE_DEVICE_FAILURE])
+        else:
+            response = self.handle_pdu(unit, pdu)
+
+        writer.write(struct.pack("!HHHB", transaction_id, 0, len(response) + 1, slave) + response)
+        await writer.drain()
+
+    @staticmethod
+    def handle_pdu(unit: SimulatedUnit, pdu: bytes) -> bytes:
+        function_code = pdu[0]
+        try:
+            if function_code in (1, 2):
+                address, count = struct.unpack("!HH", pdu[1:5])
+                table = unit.coils if function_code == 1 else unit.discrete_inputs
+                bits = table[address:address + count]
+                if len(bits) != count:
+                    raise IndexError()
+                data = bytearray((count + 7) // 8)
+                for index, bit in enumerate(bits):
+                    if bit:
+                        data[index // 8] |= 1 << (index % 8)
+                return bytes([function_code, len(data)]) + bytes(data)
+            if function_code in (3, 4):
+                address, count = struct.unpack("!HH", pdu[1:5])
+                table = unit.holding_registers if function_code == 3 else unit.input_registers
+                registers = table[address:address + count]
+                if len(registers) != count:
+                    raise IndexError()
+                return bytes([function_code, count * 2]) + struct.pack(f"!{count}H", *registers)
+            if function_code == 5:
+                address, value = struct.unpack("!HH", pdu[1:5])
+                if address >= COIL_COUNT:
+                    raise IndexError()
+                unit.write_coil(address, value == 0xFF00)
+                return pdu[:5]
+            if function_code == 6:
+                address, value = struct.unpack("!HH", pdu[1:5])
+                if address >= HOLDING_REGISTER_COUNT:
+                    raise IndexError()
+                unit.write_register(address, value)
+                return pdu[:5]
+            if function_code == 15:
+                address, count = struct.unpack("!HH", pdu[1:5])
+                if address + count > COIL_COUNT:
+                    raise IndexError()
+                data = pdu[6:]
+                for index in range(count):
+                    unit.write_coil(address + index, bool(data[index // 8] & (1 << (index % 8))))
+                return pdu[:5]
+            if function_code == 16:
+                address, count = struct.unpack("!HH", pdu[1:5])
+                if address + count > HOLDING_REGISTER_COUNT:
+                    raise IndexError()
+                for index, value in enumerate(struct.unpack(f"!{count}H", pdu[6:6 + count * 2])):
+                    unit.write_register(address + index, value)
+                return pdu[:5]
+        except (IndexError, struct.error):
+            return bytes([function_code | 0x80, ILLEGAL_DATA_ADDRESS])
+        return bytes([function_code | 0x80, ILLEGAL_FUNCTION])
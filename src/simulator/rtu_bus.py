@@ -0,0 +1,121 @@
+import asyncio
+import os
+import random
+import struct
+import time
+import tty
+from typing import Dict, Iterable, Optional
+
+from loguru import logger
+from pymodbus.utilities import computeCRC
+
+from simulator.pdrycb500 import SLAVE_DEVICE_FAILURE, Pdrycb500Simulator, SimulatedUnit
+
+# Request length by function code, for the ones with a fixed length: slave, function code, 4 bytes, CRC
+FIXED_REQUEST_LENGTH = {1: 8, 2: 8, 3: 8, 4: 8, 5: 8, 6: 8}
+
+
+class RtuBusSimulator:
+    """
+    PDRYCB500 units daisy-chained on a Modbus RTU bus, behind a pseudo terminal that the bridge opens like the serial
+    port of an RS485 adapter. Linux only.
+
+    Responses are delayed by the time their bytes take on the line at `baudrate`. A request that starts less than
+    `min_gap` seconds after the previous response ended counts as a timing violation, a real bus would garble it.
+    """
+
+    def __init__(self, slaves: Iterable[int], baudrate: int = 9600, min_gap: Optional[float] = None,
+                 latency: float = 0, error_rate: float = 0, apply_delay: float = 0):
+        self.baudrate = baudrate
+        self.char_time = 11 / baudrate
+        self.min_gap = (0.00175 if baudrate > 19200 else 3.5 * self.char_time) if min_gap is None else min_gap
+        self.latency = latency
+        self.error_rate = error_rate
+        self.units: Dict[int, SimulatedUnit] = {slave: SimulatedUnit(slave, apply_delay) for slave in slaves}
+        self.requests = 0
+        self.crc_errors = 0
+        self.timing_violations = 0
+        self.port: Optional[str] = None
+        self._master: Optional[int] = None
+        self._slave: Optional[int] = None
+        self._buffer = bytearray()
+        self._idle_since = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    async def start(self) -> None:
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self._queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self._master, self._on_readable)
+        self._tasks = [loop.create_task(self._answer_requests()), loop.create_task(self._tick())]
+        logger.info(f"Sim    | RTU bus with {len(self.units)} unit(s) at {self.baudrate} baud on {self.port}")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        if self._master is not None:
+            asyncio.get_running_loop().remove_reader(self._master)
+            os.close(self._master)
+            os.close(self._slave)
+            self._master = None
+
+    async def _tick(self) -> None:
+        while True:
+            await asyncio.sleep(5)
+            for unit in self.units.values():
+                unit.tick()
+
+    def _on_readable(self) -> None:
+        try:
+            data = os.read(self._master, 1024)
+        except OSError:
+            return
+        if not self._buffer and time.monotonic() - self._idle_since < self.min_gap:
+            self.timing_violations += 1
+        self._buffer += data
+        while self._buffer:
+            length = self._request_length()
+            if length is None or len(self._buffer) < length:
+                return
+            frame = bytes(self._buffer[:length])
+            del self._buffer[:length]
+            self._queue.put_nowait(frame)
+
+    def _request_length(self) -> Optional[int]:
+        if len(self._buffer) < 2:
+            return None
+        function_code = self._buffer[1]
+        if function_code in FIXED_REQUEST_LENGTH:
+            return FIXED_REQUEST_LENGTH[function_code]
+        if len(self._buffer) < 7:
+            return None
+        # Writes of multiple coils or registers: slave, function code, address, count, byte count, data, CRC
+        return 9 + self._buffer[6]
+
+    async def _answer_requests(self) -> None:
+        while True:
+            frame = await self._queue.get()
+            # The request itself takes this long on the line before a slave can answer
+            await asyncio.sleep(len(frame) * self.char_time + self.latency)
+            self.requests += 1
+            if computeCRC(frame[:-2]) != struct.unpack(">H", frame[-2:])[0]:
+                self.crc_errors += 1
+                continue
+            slave, pdu = frame[0], frame[1:-2]
+            unit = self.units.get(slave)
+            if unit is None:
+                # No slave with that id on the bus, the request times out
+                continue
+            if random.random() < self.error_rate:
+                response = bytes([pdu[0] | 0x80, SLAVE_DEVICE_FAILURE])
+            else:
+                response = Pdrycb500Simulator.handle_pdu(unit, pdu)
+            response = bytes([slave]) + response
+            response += struct.pack(">H", computeCRC(response))
+            await asyncio.sleep(len(response) * self.char_time)
+            os.write(self._master, response)
+            self._idle_since = time.monotonic()
@@ -0,0 +1,85 @@
+"""
+Profile the startup of the bridge: how long every import and setup phase takes and how much memory it adds.
+
+Run from the repository root, with the usual config/config.yaml: python src/startup_profile.py
+The bridge starts as usual, stops again as soon as it is online and prints the profile.
+"""
+import importlib
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from typing import List, Tuple
+
+# The heavy dependencies, in the order the bridge imports them
+DEPENDENCIES = ("loguru", "yaml", "pydantic", "paho.mqtt.client", "pymodbus.client")
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class StartupProfile:
+    """
+    Collects the duration and memory growth of named phases. A disabled profile records nothing.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started = perf_counter()
+        self.started_rss = rss_kb() if enabled else 0
+        self.phases: List[Tuple[str, float, int]] = []
+        # Set once the bridge has published its discovery and availability
+        self.online = threading.Event()
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        rss = rss_kb()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, perf_counter() - start, rss_kb() - rss))
+
+    def report(self) -> str:
+        lines = [f"{'phase':<32} {'ms':>8} {'+RSS kB':>9}"]
+        for name, duration, rss in self.phases:
+            lines.append(f"{name:<32} {duration * 1000:8.1f} {rss:9d}")
+        lines.append(f"{'time to online':<32} {(perf_counter() - self.started) * 1000:8.1f} "
+                     f"{rss_kb() - self.started_rss:9d}")
+        lines.append(f"RSS {rss_kb() / 1024:.1f} MB")
+        return "\n".join(lines)
+
+
+def main() -> None:
+    profile = StartupProfile()
+    for module in DEPENDENCIES:
+        with profile.phase(f"import {module}"):
+            importlib.import_module(module)
+    with profile.phase("import bridge"):
+        from server import Server
+
+    server = Server(profile=profile)
+
+    def stop_when_online() -> None:
+        profile.online.wait()
+        server.request_stop()
+
+    threading.Thread(target=stop_when_online, daemon=True).start()
+    server.start()
+    print(profile.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import math
+import mmap
+import os
+import struct
+import zlib
+from dataclasses import fields
+from enum import Enum
+from threading import Lock
+from typing import Callable, List, Optional, Sequence, Tuple, get_args
+
+from loguru import logger
+
+from models.state import State
+
+# magic, layout signature, capacity, next slot, samples held
+_HEADER = struct.Struct("<8sIIQQ")
+_MAGIC = b"LGHIST01"
+# The header takes the room of four doubles, the samples after it stay aligned
+_HEADER_DOUBLES = 4
+
+
+def _field_codec(field_type) -> Tuple[Callable[[object], float], Callable[[float], object]]:
+    value_type = next(arg for arg in get_args(field_type) if arg is not type(None))
+    if value_type is bool:
+        return float, lambda value: value != 0
+    if issubclass(value_type, Enum):
+        return lambda value: float(value.value), lambda value: value_type(int(value)).name
+    if value_type is int:
+        return float, int
+    return float, float
+
+
+HISTORY_FIELDS = tuple(field.name for field in fields(State))
+# Fields that are averaged when downsampled, the others keep the last value of each bucket
+AVERAGED_FIELDS = frozenset(field.name for field in fields(State) if float in get_args(field.type))
+_CODECS = [_field_codec(field.type) for field in fields(State)]
+_ENCODERS = [encode for encode, _ in _CODECS]
+_DECODERS = [decode for _, decode in _CODECS]
+_SIGNATURE = zlib.crc32(",".join(HISTORY_FIELDS).encode())
+
+
+class StateHistory:
+    """
+    The last `capacity` polled states of one unit, in a ring of doubles: the timestamp, then every State field, with
+    NaN for unknown values. The ring lives in a bytearray, or with `path` in a memory-mapped file, so it is kept
+    across restarts. Either way its size is fixed when it is created.
+    """
+
+    def __init__(self, capacity: int, path: Optional[str] = None):
+        self.capacity = capacity
+        self._width = 1 + len(HISTORY_FIELDS)
+        size = _HEADER_DOUBLES * 8 + capacity * self._width * 8
+        self._lock = Lock()
+        self._closed = False
+        self._file = None
+        if path is None:
+            self._buffer = bytearray(size)
+        else:
+            self._buffer = self._open(path, size)
+        self._samples = memoryview(self._buffer)[_HEADER_DOUBLES * 8:].cast("d")
+
+        magic, signature, stored_capacity, self._next, self._count = _HEADER.unpack_from(self._buffer)
+        if (magic, signature, stored_capacity) != (_MAGIC, _SIGNATURE, capacity):
+            if magic == _MAGIC:
+                logger.warning(f"State  | {path} holds a history with other fields or size, starting over")
+            self._next = 0
+            self._count = 0
+            self._write_header()
+
+    def _open(self, path: str, size: int) -> mmap.mmap:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a+b")
+        if os.path.getsize(path) != size:
+            self._file.truncate(0)
+            self._file.truncate(size)
+        return mmap.mmap(self._file.fileno(), size)
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(self._buffer, 0, _MAGIC, _SIGNATURE, self.capacity, self._next, self._count)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def record(self, timestamp: float, values: Sequence) -> None:
+        """
+        Append a sample, `values` holds the State fields in their declaration order.
+        """
+        samples = self._samples
+        with self._lock:
+            if self._closed:
+                # A poll that finished during shutdown
+                return
+            offset = self._next * self._width
+            samples[offset] = timestamp
+            for encode, value in zip(_ENCODERS, values):
+                offset += 1
+                samples[offset] = math.nan if value is None else encode(value)
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+            self._write_header()
+
+    def samples(self, start: float = -math.inf, end: float = math.inf) -> List[Tuple[float, List]]:
+        """
+        The samples between start and end, oldest first, with the values decoded again.
+        """
+        width = self._width
+        with self._lock:
+            first = (self._next - self._count) % self.capacity
+            # Copied under the lock, decoded outside it, so a query hardly holds up a poll
+            raw = bytes(self._samples) if not self._closed else b""
+            count = self._count if not self._closed else 0
+        raw = memoryview(raw).cast("d").tolist()
+
+        result = []
+        for position in range(count):
+            offset = ((first + position) % self.capacity) * width
+            timestamp = raw[offset]
+            if not start <= timestamp <= end:
+                continue
+            values = [None if math.isnan(value) else decode(value)
+                      for value, decode in zip(raw[offset + 1:offset + width], _DECODERS)]
+            result.append((timestamp, values))
+        return result
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._samples.release()
+                self._buffer.flush()
+                self._buffer.close()
+                self._file.close()
+                self._file = None
@@ -1,38 +1,89 @@
+from dataclasses import fields
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Optional, Sequence
+
 from loguru import logger
 
+from config import PublishFilterConfig
 from event_hook import EventHook
 from models.state import State
+from publish_filter import PublishFilter
+
+# The state is held as a flat list with one slot per State field, in this order
+STATE_FIELDS = tuple(field.name for field in fields(State))
+FIELD_INDEX = {name: index for index, name in enumerate(STATE_FIELDS)}
 
 
 class StateService:
 
-    def __init__(self):
-        self._state = State()
+    def __init__(self, publish_filters: Optional[Dict[str, PublishFilterConfig]] = None):
+        self._values = [None] * len(STATE_FIELDS)
+        # The merged values before the publish filters, for the history
+        self._raw = [None] * len(STATE_FIELDS)
+        # Filtered fields hold the last published value, the filter decides when a new value replaces it
+        self._filters = [None] * len(STATE_FIELDS)
+        for name, filter_config in (publish_filters or {}).items():
+            if name not in FIELD_INDEX:
+                raise ValueError(f"Unknown state field '{name}' in publish_filters")
+            self._filters[FIELD_INDEX[name]] = PublishFilter(filter_config)
+        # Polls, read-backs and commands merge from different threads
+        self._lock = Lock()
+        # When values were last merged in, to measure how long they take to reach the broker
+        self.last_merge = 0.0
 
         self.state_changed = EventHook[State]()
 
-    def merge_in_state(self, state: State, skip_emit: bool = False):
-        # Make a copy of the current state to compare later
-        old_state_data = self._state.model_dump()
-        # Dictionary to hold changes
-        changes = {}
+    def merge_in_values(self, values: Dict[str, object], skip_emit: bool = False) -> Optional[Dict[str, object]]:
+        """
+        Merge values by field name, e.g. a command, fields that are missing or None are left as they are.
+        Returns the changed values, if any.
+        """
+        slots = [None] * len(STATE_FIELDS)
+        for name, value in values.items():
+            slots[FIELD_INDEX[name]] = value
+        return self.merge_in_slots(slots, skip_emit=skip_emit)
 
-        # Merge new state into the current state
-        for name, value in state.model_dump().items():
-            if value is not None:  # Only merge values that are not None
-                setattr(self._state, name, value)
-                # If the value is different from the old state, record the change
-                if old_state_data[name] != value:
-                    changes[name] = value
+    def merge_in_slots(self, values: Sequence, skip_emit: bool = False) -> Optional[Dict[str, object]]:
+        """
+        Merge polled values, a slot per field in STATE_FIELDS order, into the state. Slots holding None are left
+        as they are. Compares in place, nothing is allocated unless something changed. Returns the changed values.
+        """
+        self.last_merge = perf_counter()
+        changes: Optional[Dict[str, object]] = None
+        current = self._values
+        raw = self._raw
+        filters = self._filters
+        with self._lock:
+            for index, value in enumerate(values):
+                if value is None:
+                    continue
+                raw[index] = value
+                if filters[index] is not None:
+                    value = filters[index].offer(value, current[index])
+                    if value is None:
+                        continue
+                if current[index] != value:
+                    current[index] = value
+                    if changes is None:
+                        changes = {}
+                    changes[STATE_FIELDS[index]] = value
 
         # If there are any changes, create a state with only those changes
         if changes and not skip_emit:
             delta_state = State(**changes)
             self._process_changes(delta_state)
+        return changes
 
     def _process_changes(self, delta_state: State):
-        logger.debug(f"State  | Changed state: {delta_state}")
+        logger.debug("State  | Changed state: {}", delta_state)
         self.state_changed.fire(delta_state)
 
-    def get_state(self) -> State:
-        return self._state
+    def raw_snapshot(self) -> tuple:
+        """
+        The values in STATE_FIELDS order as they were merged in, before the publish filters, without building a State.
+        """
+        return tuple(self._raw)
+
+    def get_value(self, name: str):
+        return self._values[FIELD_INDEX[name]]
@@ -0,0 +1,32 @@
+from typing import Dict, Optional
+
+from config import UnitConfig
+from modbus_client import ModbusClient
+from models.ha_mqtt_discovery_config import HaMqttDiscoveryConfig
+from models.ha_mqtt_sensor_discovery_config import HaMqttSensorDiscoveryConfig
+from models.mqtt_topcis import MqttTopics
+from state_history import StateHistory
+from state_service import StateService
+
+
+class Unit:
+    """
+    Everything the server keeps for a single indoor unit.
+    """
+
+    def __init__(self, config: UnitConfig, topics: MqttTopics, ha_discovery_config: HaMqttDiscoveryConfig,
+                 state_service: StateService, modbus_client: ModbusClient,
+                 sensors: Optional[Dict[str, HaMqttSensorDiscoveryConfig]] = None):
+        self.config = config
+        self.topics = topics
+        self.ha_discovery_config = ha_discovery_config
+        self.state_service = state_service
+        self.modbus_client = modbus_client
+        # Sensor entities, by state field
+        self.sensors = sensors or {}
+        # Set by the server when the history is enabled
+        self.history: Optional[StateHistory] = None
+
+    @property
+    def id(self) -> str:
+        return self.config.id
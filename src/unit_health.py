@@ -0,0 +1,109 @@
+from enum import Enum
+from time import monotonic
+
+from loguru import logger
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+
+from config import UnitHealthConfig
+from event_hook import EventHook
+from modbus_gateway import ReconnectBackoff
+
+# Exception codes of a gateway that got no answer from the slave behind it
+GATEWAY_PATH_UNAVAILABLE = 0x0A
+GATEWAY_NO_RESPONSE = 0x0B
+
+
+def is_no_response(response) -> bool:
+    """
+    Whether the slave did not answer at all, as opposed to answering with an error.
+    """
+    if isinstance(response, ModbusIOException):
+        return True
+    return isinstance(response, ExceptionResponse) and response.exception_code in (GATEWAY_PATH_UNAVAILABLE,
+                                                                                   GATEWAY_NO_RESPONSE)
+
+
+class HealthState(Enum):
+    HEALTHY = "healthy"
+    # The last poll cycles got no answer, still polled
+    DEGRADED = "degraded"
+    # Not polled until the next probe is due
+    OPEN = "open"
+    # A probe is running, its outcome closes or opens the circuit again
+    HALF_OPEN = "half_open"
+
+
+class UnitHealth:
+    """
+    A circuit breaker for one unit. After `open_after` poll cycles in a row without any answer the unit is no longer
+    polled and marked unavailable, so it cannot hold up the other units on its gateway. It is probed with a single
+    poll cycle after a backoff that doubles with every failed probe, the first answer makes it healthy again. The
+    jitter goes on top of the backoff, a probe never comes sooner than `probe_min_delay`.
+    """
+
+    def __init__(self, unit_id: str, config: UnitHealthConfig, clock=monotonic):
+        self._unit_id = unit_id
+        self._config = config
+        self._clock = clock
+        self._backoff = ReconnectBackoff(min_delay=config.probe_min_delay, max_delay=config.probe_max_delay,
+                                         jitter_above=True)
+        self._failures = 0
+        self._probe_at = 0.0
+        self.state = HealthState.HEALTHY
+        # Counted for the metrics
+        self.opens = 0
+
+        # Fired with False when the circuit opens and True when the unit answers again
+        self.availability_changed = EventHook[bool]()
+
+    @property
+    def available(self) -> bool:
+        return self.state in (HealthState.HEALTHY, HealthState.DEGRADED)
+
+    def should_poll(self) -> bool:
+        """
+        Whether to run the next poll cycle, a due probe moves the circuit to half open.
+        """
+        if self.state != HealthState.OPEN:
+            return True
+        if self._clock() < self._probe_at:
+            return False
+        self.state = HealthState.HALF_OPEN
+        logger.info(f"Modbus | {self._unit_id} | Probing the unit")
+        return True
+
+    def record(self, answered: bool) -> None:
+        """
+        The outcome of a poll cycle, `answered` when the unit answered at least one request.
+        """
+        if answered:
+            self._failures = 0
+            if self.state != HealthState.HEALTHY:
+                logger.info(f"Modbus | {self._unit_id} | The unit answers again")
+                was_available = self.available
+                self.state = HealthState.HEALTHY
+                self._backoff.reset()
+                if not was_available:
+                    self.availability_changed.fire(True)
+            return
+
+        self._failures += 1
+        if self.state == HealthState.HALF_OPEN or self._failures >= self._config.open_after:
+            self._open()
+        elif self.state == HealthState.HEALTHY:
+            logger.warning(f"Modbus | {self._unit_id} | The unit did not answer")
+            self.state = HealthState.DEGRADED
+
+    def _open(self) -> None:
+        delay = self._backoff.next_delay()
+        self._probe_at = self._clock() + delay
+        was_available = self.available
+        self.state = HealthState.OPEN
+        if was_available:
+            self.opens += 1
+            logger.warning(f"Modbus | {self._unit_id} | No answer to {self._failures} poll cycles in a row, "
+                           f"marking the unit unavailable and probing it in {delay:.0f} s")
+            self.availability_changed.fire(False)
+        else:
+            logger.info(f"Modbus | {self._unit_id} | The probe got no answer, next one in {delay:.0f} s")
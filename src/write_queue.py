@@ -0,0 +1,74 @@
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from register_map import RegisterTable
+
+
+class WriteBatch:
+    """
+    One write request: a single coil or register, or a run of adjacent holding registers.
+    """
+
+    def __init__(self, table: RegisterTable, address: int, values: List):
+        self.table = table
+        self.address = address
+        self.values = values
+
+    @property
+    def method(self) -> str:
+        if self.table == RegisterTable.COIL:
+            return "write_coil" if len(self.values) == 1 else "write_coils"
+        return "write_register" if len(self.values) == 1 else "write_registers"
+
+    @property
+    def kwargs(self) -> dict:
+        if len(self.values) == 1:
+            return {"address": self.address, "value": self.values[0]}
+        return {"address": self.address, "values": self.values}
+
+    def __repr__(self) -> str:
+        return f"WriteBatch({self.table.value}, address={self.address}, values={self.values})"
+
+
+class WriteQueue:
+    """
+    Pending writes of one unit, at most one per coil or register. A newer value for the same address replaces
+    the pending one, so a burst of commands only writes the last value.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._pending: Dict[Tuple[RegisterTable, int], object] = {}
+
+    def put(self, table: RegisterTable, address: int, value) -> bool:
+        """
+        Queue a write, returns True if it replaced a pending write to the same address.
+        """
+        with self._lock:
+            superseded = (table, address) in self._pending
+            self._pending[(table, address)] = value
+            return superseded
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def drain(self) -> List[WriteBatch]:
+        """
+        Take all pending writes, coils first, with adjacent holding registers merged into one batch.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+
+        batches: List[WriteBatch] = []
+        for table in (RegisterTable.COIL, RegisterTable.HOLDING_REGISTER):
+            addresses = sorted(address for pending_table, address in pending if pending_table == table)
+            for address in addresses:
+                value = pending[(table, address)]
+                previous = batches[-1] if batches else None
+                if (table == RegisterTable.HOLDING_REGISTER and previous is not None and previous.table == table
+                        and previous.address + len(previous.values) == address):
+                    previous.values.append(value)
+                else:
+                    batches.append(WriteBatch(table=table, address=address, values=[value]))
+        return batches
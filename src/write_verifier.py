@@ -0,0 +1,99 @@
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from read_planner import ReadBlock, plan_reads
+from register_map import RegisterDefinition, RegisterTable, decode_raw
+from state_service import FIELD_INDEX
+from write_queue import WriteBatch
+
+# Backoff between the read-backs of a write
+VERIFY_FIRST_DELAY = 0.1
+VERIFY_MAX_DELAY = 1.0
+
+
+class WriteVerifier:
+    """
+    Keeps the values a unit was told to take until a read-back shows it did.
+
+    A written field is expected from the moment the command comes in. Until it is confirmed, or its deadline passed,
+    the polled value of that field is masked, so a poll racing the write does not flip the state back.
+    """
+
+    def __init__(self, unit_id: str, definitions: List[RegisterDefinition], timeout: float):
+        self._unit_id = unit_id
+        self._definitions = {(definition.table, definition.address): definition for definition in definitions}
+        self._timeout = timeout
+        self._lock = Lock()
+        # field -> (expected value, deadline)
+        self._pending: Dict[str, Tuple[object, float]] = {}
+
+    def expect(self, table: RegisterTable, address: int, raw, delay: float = 0) -> Optional[Tuple[str, object]]:
+        """
+        Expect a write of `raw`, which goes out after at most `delay` seconds.
+        Returns the field and its decoded value, to update the state optimistically.
+        """
+        definition = self._definitions.get((table, address))
+        if definition is None:
+            return None
+        value = decode_raw(definition, raw)
+        with self._lock:
+            self._pending[definition.field] = (value, monotonic() + delay + self._timeout)
+        return definition.field, value
+
+    def forget(self, batch: WriteBatch) -> None:
+        # The write failed, the next poll brings the state back in line
+        with self._lock:
+            for definition in self._batch_definitions(batch):
+                self._pending.pop(definition.field, None)
+
+    def has_pending(self, blocks: List[ReadBlock]) -> bool:
+        with self._lock:
+            return any(definition.field in self._pending for block in blocks for definition, _ in block.registers)
+
+    def mask(self, values: List) -> None:
+        """
+        Clear the slots of the fields that are waiting for confirmation from polled values.
+        """
+        if not self._pending:
+            return
+        now = monotonic()
+        with self._lock:
+            for field, (_, deadline) in list(self._pending.items()):
+                if now >= deadline:
+                    del self._pending[field]
+                else:
+                    values[FIELD_INDEX[field]] = None
+
+    def check(self, values: List) -> Dict[str, object]:
+        """
+        Compare read-back values, a slot per state field, with the expected ones.
+        Returns the values of the fields that did not confirm before their deadline, these are the real state.
+        """
+        now = monotonic()
+        expired = {}
+        with self._lock:
+            for field, (expected, deadline) in list(self._pending.items()):
+                value = values[FIELD_INDEX[field]]
+                if value is None:
+                    continue
+                if value == expected:
+                    del self._pending[field]
+                    logger.debug("Modbus | {} | Confirmed {} = {}", self._unit_id, field, value)
+                elif now >= deadline:
+                    del self._pending[field]
+                    expired[field] = value
+                    logger.warning(f"Modbus | {self._unit_id} | {field} is {value} instead of {expected} "
+                                   f"after {self._timeout} s")
+        return expired
+
+    def read_back_plan(self, batches: List[WriteBatch], client=None) -> List[ReadBlock]:
+        definitions = [definition for batch in batches for definition in self._batch_definitions(batch)]
+        return plan_reads(definitions, max_gap=0, client=client)
+
+    def _batch_definitions(self, batch: WriteBatch) -> List[RegisterDefinition]:
+        addresses = range(batch.address, batch.address + len(batch.values))
+        return [self._definitions[(batch.table, address)] for address in addresses
+                if (batch.table, address) in self._definitions]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other by their plain names, as when the bridge runs from src
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
@@ -0,0 +1,68 @@
+from pipeline_window import PROBE_REQUESTS, REPROBE_AFTER, PipelineWindow
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def probe(window: PipelineWindow, in_flight: int, duration: float) -> None:
+    for _ in range(PROBE_REQUESTS):
+        window.record(in_flight=in_flight, duration=duration)
+
+
+def test_the_window_grows_while_the_throughput_rises():
+    window = PipelineWindow(limit=4, clock=Clock())
+
+    probe(window, in_flight=1, duration=0.1)
+    assert window.size == 2
+    probe(window, in_flight=2, duration=0.1)
+    assert window.size == 3
+
+
+def test_a_step_that_does_not_pay_off_is_taken_back():
+    window = PipelineWindow(limit=4, clock=Clock())
+    probe(window, in_flight=1, duration=0.1)
+
+    # A gateway answering one request at a time: twice the requests in flight take twice as long
+    probe(window, in_flight=2, duration=0.2)
+
+    assert window.size == 1
+
+
+def test_the_window_only_grows_when_it_was_full():
+    window = PipelineWindow(limit=4, clock=Clock())
+    probe(window, in_flight=1, duration=0.1)
+
+    probe(window, in_flight=1, duration=0.05)
+
+    assert window.size == 2
+
+
+def test_the_window_stops_at_the_limit():
+    window = PipelineWindow(limit=2, clock=Clock())
+
+    probe(window, in_flight=1, duration=0.1)
+    probe(window, in_flight=2, duration=0.01)
+
+    assert window.size == 2
+
+
+def test_a_failure_halves_the_window_until_the_next_reprobe():
+    clock = Clock()
+    window = PipelineWindow(limit=8, clock=clock)
+    for size in range(1, 5):
+        probe(window, in_flight=size, duration=0.1)
+    assert window.size == 5
+
+    window.record(in_flight=5, duration=3.0, failed=True)
+    assert window.size == 2
+    probe(window, in_flight=2, duration=0.1)
+    assert window.size == 2
+
+    clock.now += REPROBE_AFTER
+    probe(window, in_flight=2, duration=0.1)
+    assert window.size == 3
@@ -0,0 +1,115 @@
+from pytest import approx
+
+from config import ModbusConfig
+from poll_scheduler import AdaptivePollInterval, PollScheduler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_the_first_tick_is_due_after_the_phase():
+    clock = Clock()
+
+    assert PollScheduler(interval=1, clock=clock).time_until_next_tick() == approx(0)
+    assert PollScheduler(interval=1, phase=0.25, clock=clock).time_until_next_tick() == approx(0.25)
+
+
+def test_ticks_stay_on_the_fixed_rate_however_long_the_polls_take():
+    clock = Clock()
+    scheduler = PollScheduler(interval=1, clock=clock)
+
+    clock.now += 0.3
+    assert scheduler.advance() == 0
+    assert scheduler.time_until_next_tick() == approx(0.7)
+
+    clock.now += 0.7 + 0.9
+    assert scheduler.advance() == 0
+    assert scheduler.time_until_next_tick() == approx(0.1)
+    assert scheduler.overruns == 0
+
+
+def test_ticks_missed_by_a_long_poll_are_skipped_and_counted():
+    clock = Clock()
+    scheduler = PollScheduler(interval=1, clock=clock)
+
+    clock.now += 3.5
+    assert scheduler.advance() == 3
+    assert scheduler.time_until_next_tick() == approx(0.5)
+
+    clock.now += 0.5 + 1.2
+    assert scheduler.advance() == 1
+
+    assert scheduler.ticks == 2
+    assert scheduler.overruns == 2
+    assert scheduler.skipped_ticks == 4
+
+
+def test_a_new_interval_counts_from_the_last_tick():
+    clock = Clock()
+    scheduler = PollScheduler(interval=10, clock=clock)
+    clock.now += 1
+    scheduler.advance()
+
+    scheduler.set_interval(5)
+    assert scheduler.time_until_next_tick() == approx(4)
+
+    clock.now += 8
+    scheduler.set_interval(2)
+    assert scheduler.time_until_next_tick() == approx(0)
+
+
+def adaptive(clock: Clock) -> AdaptivePollInterval:
+    config = ModbusConfig(host="127.0.0.1", poll_interval=5, min_poll_interval=1, max_poll_interval=30,
+                          idle_after=300, boost_duration=30)
+    return AdaptivePollInterval(config, control_fields=["mode", "set_temperature"], clock=clock)
+
+
+def test_a_running_unit_polls_at_the_normal_interval():
+    clock = Clock()
+    poll_rate = adaptive(clock)
+    poll_rate.record({"running": True, "mode": 0}, running=True)
+
+    assert poll_rate.enabled
+    assert poll_rate.current() == 5
+
+
+def test_a_unit_that_is_off_or_idle_slows_down():
+    clock = Clock()
+    poll_rate = adaptive(clock)
+    poll_rate.record({"running": False}, running=False)
+    assert poll_rate.current() == 30
+
+    poll_rate.record({"running": True}, running=True)
+    clock.now += 300
+    poll_rate.record(None, running=True)
+    assert poll_rate.current() == 30
+
+
+def test_a_command_or_a_change_made_on_the_unit_speeds_up_polling():
+    clock = Clock()
+    poll_rate = adaptive(clock)
+    # The first poll fills the state, that is no activity
+    poll_rate.record({"running": True, "mode": 0}, running=True)
+    poll_rate.boost()
+    assert poll_rate.current() == 1
+
+    clock.now += 30
+    assert poll_rate.current() == 5
+
+    poll_rate.record({"current_temperature": 21.5}, running=True)
+    assert poll_rate.current() == 5
+    poll_rate.record({"set_temperature": 22.0}, running=True)
+    assert poll_rate.current() == 1
+
+
+def test_the_rate_is_fixed_without_min_and_max():
+    poll_rate = AdaptivePollInterval(ModbusConfig(host="127.0.0.1", poll_interval=5), control_fields=["mode"],
+                                     clock=Clock())
+
+    assert not poll_rate.enabled
+    assert poll_rate.current() == 5
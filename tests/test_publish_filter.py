@@ -0,0 +1,62 @@
+from config import PublishFilterConfig
+from publish_filter import PublishFilter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_the_first_value_is_always_published():
+    publish_filter = PublishFilter(PublishFilterConfig(threshold=1), clock=Clock())
+
+    assert publish_filter.offer(21.0, None) == 21.0
+
+
+def test_changes_below_the_threshold_are_held_back():
+    publish_filter = PublishFilter(PublishFilterConfig(threshold=0.5), clock=Clock())
+    publish_filter.offer(21.0, None)
+
+    assert publish_filter.offer(21.3, 21.0) is None
+    assert publish_filter.offer(21.5, 21.0) == 21.5
+
+
+def test_an_unchanged_value_is_never_published_again():
+    publish_filter = PublishFilter(PublishFilterConfig(), clock=Clock())
+    publish_filter.offer(21.0, None)
+
+    assert publish_filter.offer(21.0, 21.0) is None
+
+
+def test_min_interval_limits_the_publish_rate():
+    clock = Clock()
+    publish_filter = PublishFilter(PublishFilterConfig(min_interval=10), clock=clock)
+    publish_filter.offer(21.0, None)
+
+    clock.now += 5
+    assert publish_filter.offer(25.0, 21.0) is None
+    clock.now += 5
+    assert publish_filter.offer(25.0, 21.0) == 25.0
+
+
+def test_a_small_change_goes_out_once_the_published_value_is_stale():
+    clock = Clock()
+    publish_filter = PublishFilter(PublishFilterConfig(threshold=1, max_staleness=60), clock=clock)
+    publish_filter.offer(21.0, None)
+
+    clock.now += 30
+    assert publish_filter.offer(21.2, 21.0) is None
+    clock.now += 30
+    assert publish_filter.offer(21.2, 21.0) == 21.2
+
+
+def test_smoothing_publishes_the_moving_average():
+    publish_filter = PublishFilter(PublishFilterConfig(smoothing=3), clock=Clock())
+
+    assert publish_filter.offer(21.0, None) == 21.0
+    assert publish_filter.offer(22.0, 21.0) == 21.5
+    assert publish_filter.offer(24.0, 21.5) == 22.33
+    assert publish_filter.offer(24.0, 22.33) == 23.33
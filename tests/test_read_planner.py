@@ -0,0 +1,75 @@
+from models.mode_enums import Mode
+from read_planner import MAX_REGISTERS_PER_READ, TieredReadPlan, plan_reads
+from register_map import RegisterDefinition, RegisterTable
+from state_service import FIELD_INDEX, STATE_FIELDS
+
+
+class Response:
+    def __init__(self, registers=None, bits=None):
+        self.registers = registers
+        self.bits = bits
+
+
+class Client:
+    def read_holding_registers(self, **kwargs):
+        return kwargs
+
+
+def holding(field: str, address: int, **kwargs) -> RegisterDefinition:
+    return RegisterDefinition(field=field, table=RegisterTable.HOLDING_REGISTER, address=address, **kwargs)
+
+
+def test_registers_within_the_gap_share_a_block():
+    blocks = plan_reads([holding("mode", 0), holding("set_temperature", 3)], max_gap=2)
+
+    assert len(blocks) == 1
+    assert (blocks[0].address, blocks[0].count) == (0, 4)
+
+
+def test_a_wider_gap_splits_the_block():
+    blocks = plan_reads([holding("mode", 0), holding("set_temperature", 4)], max_gap=2)
+
+    assert [(block.address, block.count) for block in blocks] == [(0, 1), (4, 1)]
+
+
+def test_tables_are_never_merged():
+    blocks = plan_reads([RegisterDefinition("running", RegisterTable.COIL, 0), holding("mode", 0)], max_gap=16)
+
+    assert [block.table for block in blocks] == [RegisterTable.COIL, RegisterTable.HOLDING_REGISTER]
+
+
+def test_a_block_stays_within_the_protocol_limit():
+    blocks = plan_reads([holding("mode", 0), holding("set_temperature", MAX_REGISTERS_PER_READ)],
+                        max_gap=MAX_REGISTERS_PER_READ)
+
+    assert len(blocks) == 2
+
+
+def test_decode_fills_the_slots_of_the_fields():
+    block = plan_reads([holding("mode", 0, enum=Mode), holding("set_temperature", 2, scale=10)], max_gap=16)[0]
+    values = [None] * len(STATE_FIELDS)
+
+    block.decode_into(Response(registers=[Mode.HEATING.value, 0, 215]), values)
+
+    assert values[FIELD_INDEX["mode"]] == Mode.HEATING
+    assert values[FIELD_INDEX["set_temperature"]] == 21.5
+    assert values.count(None) == len(STATE_FIELDS) - 2
+
+
+def test_the_read_method_is_bound_to_the_client():
+    block = plan_reads([holding("mode", 0)], max_gap=0, client=Client())[0]
+
+    assert block.read(address=block.address, count=block.count, slave=1) == {"address": 0, "count": 1, "slave": 1}
+
+
+def test_tiers_read_slow_fields_on_every_nth_cycle():
+    plan = TieredReadPlan([holding("mode", 0), holding("set_temperature", 10, poll_every=3),
+                           holding("fan_speed", 20, poll_every=0)], max_gap=0)
+
+    def fields(cycle):
+        return [definition.field for block in plan.blocks(cycle) for definition, _ in block.registers]
+
+    assert fields(0) == ["mode", "set_temperature", "fan_speed"]
+    assert fields(1) == ["mode"]
+    assert fields(3) == ["mode", "set_temperature"]
+    assert fields(6) == ["mode", "set_temperature"]
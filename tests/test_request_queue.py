@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from request_queue import (PRIORITY_POLL, PRIORITY_READ_BACK, PRIORITY_WRITE, AsyncRequestQueue, RequestDropped,
+                           RequestQueue)
+
+
+def poll():
+    pass
+
+
+def write():
+    pass
+
+
+def test_higher_priority_first_then_in_order_of_arrival():
+    queue = RequestQueue()
+    queue.put(PRIORITY_POLL, poll, key="first poll")
+    queue.put(PRIORITY_READ_BACK, poll)
+    queue.put(PRIORITY_POLL, poll, key="second poll")
+    queue.put(PRIORITY_WRITE, write)
+
+    order = [(request.priority, request.key) for request in (queue.get(), queue.get(), queue.get(), queue.get())]
+
+    assert order == [(PRIORITY_WRITE, None), (PRIORITY_READ_BACK, None), (PRIORITY_POLL, "first poll"),
+                     (PRIORITY_POLL, "second poll")]
+
+
+def test_a_request_with_the_same_key_supersedes_the_queued_one():
+    queue = RequestQueue()
+    superseded = queue.put(PRIORITY_POLL, poll, key=("poll", "ac-0"))
+    queue.put(PRIORITY_POLL, poll, key=("poll", "ac-1"))
+    latest = queue.put(PRIORITY_POLL, poll, key=("poll", "ac-0"))
+
+    with pytest.raises(RequestDropped, match="superseded"):
+        superseded.result(timeout=0)
+    assert len(queue) == 2
+    assert queue.dropped == 1
+    assert queue.get().key == ("poll", "ac-1")
+    assert queue.get().future is latest
+
+
+def test_a_full_queue_drops_the_oldest_poll():
+    queue = RequestQueue(maxsize=2)
+    oldest = queue.put(PRIORITY_POLL, poll, key="oldest")
+    queue.put(PRIORITY_POLL, poll, key="newer")
+    queue.put(PRIORITY_WRITE, write)
+
+    with pytest.raises(RequestDropped, match="full"):
+        oldest.result(timeout=0)
+    assert [queue.get().priority, queue.get().key] == [PRIORITY_WRITE, "newer"]
+
+
+def test_close_drops_the_queued_requests():
+    queue = RequestQueue()
+    queued = queue.put(PRIORITY_WRITE, write)
+
+    queue.close()
+
+    with pytest.raises(RequestDropped, match="closed"):
+        queued.result(timeout=0)
+    assert queue.get() is None
+    with pytest.raises(RequestDropped):
+        queue.put(PRIORITY_WRITE, write).result(timeout=0)
+
+
+def test_the_async_queue_skips_busy_slaves():
+    async def run():
+        queue = AsyncRequestQueue()
+        await queue.put(PRIORITY_WRITE, write, slave=1)
+        await queue.put(PRIORITY_POLL, poll, slave=2)
+
+        request = await queue.get(busy_slaves={1})
+        assert request.slave == 2
+        request = await queue.get()
+        assert request.slave == 1
+
+    asyncio.run(run())
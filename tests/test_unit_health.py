@@ -0,0 +1,109 @@
+from pymodbus.exceptions import ModbusIOException
+from pymodbus.pdu import ExceptionResponse
+
+from config import UnitHealthConfig
+from unit_health import GATEWAY_NO_RESPONSE, HealthState, UnitHealth, is_no_response
+
+PROBE_MIN_DELAY = 30
+PROBE_MAX_DELAY = 300
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def open_circuit(clock: Clock):
+    health = UnitHealth("ac-0", UnitHealthConfig(open_after=3, probe_min_delay=PROBE_MIN_DELAY,
+                                                 probe_max_delay=PROBE_MAX_DELAY), clock=clock)
+    changes = []
+    health.availability_changed.add_handler(changes.append)
+    for _ in range(3):
+        assert health.should_poll()
+        health.record(answered=False)
+    return health, changes
+
+
+def next_probe_delay(health: UnitHealth, clock: Clock) -> float:
+    # The time until a probe is allowed, in steps of half a second
+    start = clock.now
+    while not health.should_poll():
+        clock.now += 0.5
+    return clock.now - start
+
+
+def test_missed_cycles_degrade_and_then_open_the_circuit():
+    clock = Clock()
+    health = UnitHealth("ac-0", UnitHealthConfig(open_after=3), clock=clock)
+    health.record(answered=False)
+    assert health.state == HealthState.DEGRADED
+    assert health.available
+
+    health.record(answered=False)
+    health.record(answered=False)
+
+    assert health.state == HealthState.OPEN
+    assert not health.available
+    assert health.opens == 1
+
+
+def test_an_answer_before_the_threshold_keeps_the_unit_healthy():
+    health = UnitHealth("ac-0", UnitHealthConfig(open_after=3), clock=Clock())
+    health.record(answered=False)
+    health.record(answered=False)
+
+    health.record(answered=True)
+    health.record(answered=False)
+    health.record(answered=False)
+
+    assert health.state == HealthState.DEGRADED
+
+
+def test_the_probe_comes_within_the_jitter_of_the_minimum_delay():
+    for _ in range(20):
+        clock = Clock()
+        health, _ = open_circuit(clock)
+
+        delay = next_probe_delay(health, clock)
+
+        assert PROBE_MIN_DELAY <= delay <= PROBE_MIN_DELAY * 1.5 + 0.5
+        assert health.state == HealthState.HALF_OPEN
+
+
+def test_a_failed_probe_doubles_the_backoff():
+    clock = Clock()
+    health, changes = open_circuit(clock)
+    next_probe_delay(health, clock)
+
+    health.record(answered=False)
+    delay = next_probe_delay(health, clock)
+
+    assert health.state == HealthState.HALF_OPEN
+    assert 2 * PROBE_MIN_DELAY <= delay <= 3 * PROBE_MIN_DELAY + 0.5
+    # Unavailable once, not again for the failed probe
+    assert changes == [False]
+    assert health.opens == 1
+
+
+def test_an_answered_probe_closes_the_circuit():
+    clock = Clock()
+    health, changes = open_circuit(clock)
+    next_probe_delay(health, clock)
+
+    health.record(answered=True)
+
+    assert health.state == HealthState.HEALTHY
+    assert changes == [False, True]
+    # The backoff starts over
+    for _ in range(3):
+        health.record(answered=False)
+    assert next_probe_delay(health, clock) <= PROBE_MIN_DELAY * 1.5 + 0.5
+
+
+def test_no_response_is_told_apart_from_an_error_response():
+    assert is_no_response(ModbusIOException("timeout"))
+    assert is_no_response(ExceptionResponse(0x03, GATEWAY_NO_RESPONSE))
+    assert not is_no_response(ExceptionResponse(0x03, 0x02))
@@ -0,0 +1,51 @@
+from register_map import RegisterTable
+from write_queue import WriteQueue
+
+COIL = RegisterTable.COIL
+HOLDING = RegisterTable.HOLDING_REGISTER
+
+
+def test_a_newer_value_supersedes_the_pending_write():
+    queue = WriteQueue()
+
+    assert not queue.put(HOLDING, 1, 200)
+    assert queue.put(HOLDING, 1, 220)
+
+    batches = queue.drain()
+    assert [(batch.address, batch.values) for batch in batches] == [(1, [220])]
+
+
+def test_adjacent_holding_registers_are_written_together():
+    queue = WriteQueue()
+    queue.put(HOLDING, 1, 220)
+    queue.put(HOLDING, 0, 4)
+    queue.put(HOLDING, 14, 2)
+
+    batches = queue.drain()
+
+    assert [(batch.address, batch.values) for batch in batches] == [(0, [4, 220]), (14, [2])]
+    assert batches[0].method == "write_registers"
+    assert batches[0].kwargs == {"address": 0, "values": [4, 220]}
+    assert batches[1].method == "write_register"
+    assert batches[1].kwargs == {"address": 14, "value": 2}
+
+
+def test_coils_go_first_and_are_never_merged():
+    queue = WriteQueue()
+    queue.put(HOLDING, 0, 4)
+    queue.put(COIL, 1, True)
+    queue.put(COIL, 0, True)
+
+    batches = queue.drain()
+
+    assert [(batch.table, batch.address) for batch in batches] == [(COIL, 0), (COIL, 1), (HOLDING, 0)]
+    assert batches[0].method == "write_coil"
+
+
+def test_drain_empties_the_queue():
+    queue = WriteQueue()
+    queue.put(COIL, 0, True)
+    queue.drain()
+
+    assert len(queue) == 0
+    assert queue.drain() == []
@@ -0,0 +1,85 @@
+from models.mode_enums import Mode
+from register_map import RegisterDefinition, RegisterTable
+from state_service import FIELD_INDEX, STATE_FIELDS
+from write_queue import WriteBatch
+from write_verifier import WriteVerifier
+
+HOLDING = RegisterTable.HOLDING_REGISTER
+DEFINITIONS = [
+    RegisterDefinition("mode", HOLDING, 0, enum=Mode),
+    RegisterDefinition("set_temperature", HOLDING, 1, scale=10),
+    RegisterDefinition("fan_speed", HOLDING, 14),
+]
+
+
+def slots(**values) -> list:
+    result = [None] * len(STATE_FIELDS)
+    for name, value in values.items():
+        result[FIELD_INDEX[name]] = value
+    return result
+
+
+def test_expect_returns_the_decoded_value_for_the_state():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=5)
+
+    assert verifier.expect(HOLDING, 1, 215) == ("set_temperature", 21.5)
+    assert verifier.expect(HOLDING, 99, 1) is None
+
+
+def test_a_pending_write_masks_the_polled_value():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=5)
+    verifier.expect(HOLDING, 1, 215)
+    values = slots(mode=Mode.COOL, set_temperature=20.0)
+
+    verifier.mask(values)
+
+    assert values == slots(mode=Mode.COOL)
+
+
+def test_a_matching_read_back_confirms_the_write():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=5)
+    verifier.expect(HOLDING, 1, 215)
+
+    assert verifier.check(slots(set_temperature=21.5)) == {}
+
+    values = slots(set_temperature=21.5)
+    verifier.mask(values)
+    assert values == slots(set_temperature=21.5)
+
+
+def test_a_different_read_back_waits_for_the_deadline():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=5)
+    verifier.expect(HOLDING, 1, 215)
+
+    assert verifier.check(slots(set_temperature=20.0)) == {}
+    assert verifier.check(slots(mode=Mode.COOL)) == {}
+
+
+def test_a_write_not_confirmed_in_time_gives_way_to_the_read_back():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=0)
+    verifier.expect(HOLDING, 1, 215)
+
+    assert verifier.check(slots(set_temperature=20.0)) == {"set_temperature": 20.0}
+    assert verifier.check(slots(set_temperature=20.0)) == {}
+
+
+def test_a_failed_write_is_forgotten():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=5)
+    verifier.expect(HOLDING, 0, Mode.HEATING.value)
+    batch = WriteBatch(HOLDING, 0, [Mode.HEATING.value])
+
+    verifier.forget(batch)
+
+    assert not verifier.has_pending(verifier.read_back_plan([batch]))
+
+
+def test_the_read_back_only_reads_the_written_registers():
+    verifier = WriteVerifier("ac-0", DEFINITIONS, timeout=5)
+    verifier.expect(HOLDING, 0, Mode.HEATING.value)
+    verifier.expect(HOLDING, 1, 215)
+    verifier.expect(HOLDING, 14, 2)
+
+    blocks = verifier.read_back_plan([WriteBatch(HOLDING, 0, [Mode.HEATING.value, 215]), WriteBatch(HOLDING, 14, [2])])
+
+    assert [(block.address, block.count) for block in blocks] == [(0, 2), (14, 1)]
+    assert verifier.has_pending(blocks)